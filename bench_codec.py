@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Size and encode cost of one state_update broadcast, JSON vs MessagePack,
+# measured on the complete Socket.IO packet the server writes (one encode per
+# broadcast, see web_app.emit_state). Needs python-socketio and msgpack:
+#
+#   python3 bench_codec.py            # 2000 encodes per case
+#   python3 bench_codec.py 10000
+import sys, time
+import msgpack
+from socketio import packet
+
+def state(files):
+    return {
+        "mode": "MIDI FILE", "index": 12, "volume": 80, "bpm": 120, "metro_vol": 50,
+        "mixer_idx": 0, "dsp_level": 0, "metronome_on": False, "is_eco": False,
+        "is_adjusting": False, "dsp_load": 12.5, "power_mode": "AUTO", "power_profile": "PLAY",
+        "battery": "3:12 (87%)", "msg": "", "rename_tmp": "",
+        "files": files, "sf2": "/home/pi/sf2/GeneralUser GS v1.471.sf2",
+    }
+
+CASES = [
+    ("main menu", state(["MIDI KEYBOARD", "SOUND FONT", "MIDI FILE", "MIXER", "RECORD",
+                         "METRONOME", "VOLUME", "POWER", "SHUTDOWN"])),
+    ("200 files", state([f"Song number {i:03d}" for i in range(200)])),
+    ("1000 files", state([f"Song number {i:04d}" for i in range(1000)])),
+]
+
+CODECS = {
+    "json": lambda s: s,
+    "msgpack": lambda s: msgpack.packb(s, use_single_float=True),
+}
+
+def encoded(s, codec):
+    pkt = packet.Packet(packet.EVENT, data=["state_update", CODECS[codec](s)]).encode()
+    return pkt if isinstance(pkt, list) else [pkt]
+
+def timed(n, fn):
+    t0 = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def run(n):
+    print(f"{'state':<12}{'codec':<9}{'bytes':>8}{'frames':>8}{'encode us':>11}")
+    for name, s in CASES:
+        for codec in CODECS:
+            frames = encoded(s, codec)
+            size = sum(len(f) for f in frames)
+            us = timed(n, lambda: encoded(s, codec))
+            print(f"{name:<12}{codec:<9}{size:>8}{len(frames):>8}{us:>11.1f}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
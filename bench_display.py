@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Render-time benchmark for update_display, per screen, using the virtual
+# display backend. Runs on any Linux box, no SPI hardware needed:
+#
+#   python3 bench_display.py            # 200 frames per screen
+#   python3 bench_display.py 1000
+#
+# "full" repaints the whole frame (mode change), "step" is the incremental
+# repaint after one scroll, which is what the Pi does most of the time.
+import os, sys, time
+
+os.environ.setdefault("ZOMPLER_HOME", "/tmp/zompler-bench")
+os.environ["ZOMPLER_DISPLAY"] = "virtual"
+import main as engine
+
+def timed(n, setup, step):
+    samples = []
+    for _ in range(n):
+        setup()
+        t0 = time.perf_counter()
+        engine.update_display(force=True)
+        samples.append(time.perf_counter() - t0)
+        step()
+    samples.sort()
+    return sum(samples) / n * 1000, samples[int(n * 0.95) - 1] * 1000
+
+def screen(mode, items, index=0):
+    def enter():
+        engine.operation_mode = mode
+        engine.files = list(items)
+        engine.selectedindex = index
+    return enter
+
+def run(n):
+    engine.init_display("virtual")
+    engine.channel_presets.update({i: f"Preset {i}" for i in range(16)})
+    files = [f"Song number {i:03d}" for i in range(200)]
+    screens = [
+        ("main screen", screen("main screen", engine.MAIN_MENU), lambda: engine.handle_scroll("DOWN")),
+        ("MIDI FILE (200)", screen("MIDI FILE", files), lambda: engine.handle_scroll("DOWN")),
+        ("VOLUME", screen("VOLUME", []), lambda: engine.handle_scroll("UP")),
+        ("METRONOME", screen("METRONOME", []), lambda: engine.handle_scroll("DOWN")),
+        ("MIXER", screen("MIXER", []), lambda: engine.handle_scroll("DOWN")),
+        ("RENAME", screen("RENAME", []), lambda: engine.handle_scroll("DOWN")),
+    ]
+    print(f"{'screen':<18}{'full ms':>10}{'p95':>8}{'step ms':>10}{'p95':>8}")
+    for name, enter, scroll in screens:
+        enter(); engine.update_display(force=True)
+        full = timed(n, lambda: (enter(), engine._frame_keys.clear()), lambda: None)
+        enter(); engine.update_display(force=True)
+        step = timed(n, lambda: None, scroll)
+        print(f"{name:<18}{full[0]:>10.2f}{full[1]:>8.2f}{step[0]:>10.2f}{step[1]:>8.2f}")
+    print(f"row cache: {engine._row_bitmap.cache_info()}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Import-time benchmark for the two long-running processes, with a committed
+# budget (startup_budget.json) so heavy imports don't creep back in:
+#
+#   python3 bench_startup.py            # 7 runs each, compare with budget
+#   python3 bench_startup.py --update   # record this machine's numbers
+#
+# Each run is a fresh interpreter with -X importtime. Two checks per process:
+# modules listed under "forbidden" must not load at import (they belong to a
+# boot step or first use), and the median import time must stay under the
+# budget recorded for this machine type (platform.machine(), so the Pi and a
+# desktop keep separate numbers). Exit status 1 on any regression.
+import os, sys, json, subprocess, platform, tempfile, statistics, argparse
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGET_FILE = os.path.join(APP_DIR, "startup_budget.json")
+HEADROOM = 1.5 # --update records median * HEADROOM
+
+def import_profile(module, home):
+    env = dict(os.environ, ZOMPLER_HOME=home, ZOMPLER_FAKE_UPS="1", PYTHONWARNINGS="ignore")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=APP_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        err = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+        raise RuntimeError(f"import {module} failed: {err[-1] if err else proc.returncode}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cum_us, name = line.split("|", 2)
+        name = name[1:] # one separator space, then two per nesting level
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(cum_us)))
+    # The target is the last depth-0 row; its direct imports are the depth-1
+    # rows since the previous depth-0 row
+    end = max(i for i, r in enumerate(rows) if r[0] == module and r[1] == 0)
+    start = max([i for i, r in enumerate(rows[:end]) if r[1] == 0] or [-1]) + 1
+    children = [(n, c) for n, d, c in rows[start:end] if d == 1]
+    loaded = {n.split(".")[0] for n, _, _ in rows}
+    return rows[end][2] / 1000.0, children, loaded
+
+def bench(module, runs, home):
+    import_profile(module, home) # warm-up: writes .pyc files
+    totals, children, loaded = [], {}, set()
+    for _ in range(runs):
+        total, kids, mods = import_profile(module, home)
+        totals.append(total); loaded |= mods
+        for n, c in kids: children.setdefault(n, []).append(c / 1000.0)
+    top = sorted(((statistics.median(v), n) for n, v in children.items()), reverse=True)[:8]
+    return statistics.median(totals), top, loaded
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import-time benchmark for main.py and web_app.py.")
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--update", action="store_true", help="Write this machine's budget instead of checking")
+    args = ap.parse_args(argv)
+
+    with open(BUDGET_FILE, "r") as f: budget = json.load(f)
+    machine = platform.machine()
+    failed = False
+    with tempfile.TemporaryDirectory() as home:
+        for module, rules in budget.items():
+            try:
+                total, top, loaded = bench(module, args.runs, home)
+            except Exception as e:
+                print(f"{module}: {e}"); failed = True; continue
+            print(f"{module}: {total:.1f} ms median import ({machine})")
+            for ms, name in top: print(f"  {ms:8.1f} ms  {name}")
+            eager = sorted(set(rules.get("forbidden", [])) & loaded)
+            if eager:
+                print(f"  FAIL: imported at startup: {', '.join(eager)}"); failed = True
+            if args.update:
+                rules.setdefault("ms", {})[machine] = round(total * HEADROOM, 1)
+                continue
+            limit = rules.get("ms", {}).get(machine)
+            if limit is None:
+                print(f"  no time budget for {machine}: only the forbidden-module check ran (record one with --update)")
+            elif total > limit:
+                print(f"  FAIL: {total:.1f} ms over budget {limit} ms"); failed = True
+            else:
+                print(f"  ok: budget {limit} ms")
+    if args.update:
+        tmp = BUDGET_FILE + ".tmp"
+        with open(tmp, "w") as f: json.dump(budget, f, indent=2); f.write("\n")
+        os.replace(tmp, BUDGET_FILE)
+        print(f"Budget written to {BUDGET_FILE}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Offline "bounce" of MIDI files to WAV/FLAC using FluidSynth's fast file renderer.
+#
+# On the Pi this is started by web_app.py (BOUNCE panel) and reports per-file
+# progress through bounce_state.json. On a desktop it runs against the same
+# folder layout:
+#
+#   python3 bounce.py --sf2 ~/sf2/GeneralUser.sf2 --midi-dir ~/midifiles --out /tmp/bounces
+#
+# and prints render throughput (seconds of audio per wall-clock second).
+import sys, os, time, json, argparse, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 1. DEFAULT PATHS (match main.py) ---
+BASE_DIR = "/home/pi/midifileplayer"
+MIDI_DIR = "/home/pi/midifiles"
+OUT_DIR = "/home/pi/bounces"
+BOUNCE_FILE = os.path.join(BASE_DIR, "bounce_state.json")
+
+FORMATS = {"wav": ".wav", "flac": ".flac"}
+SAMPLE_RATE = 44100
+
+# ---------------------- SINGLE FILE RENDER ----------------------
+def midi_length(path):
+    # Song length in seconds; only used for the throughput figure
+    try:
+        import mido
+        return float(mido.MidiFile(path).length)
+    except: return 0.0
+
+def render_one(sf2, midi_path, out_path, fmt="wav", rate=SAMPLE_RATE, nice=10):
+    # Every render is its own fluidsynth process, so the pool below only
+    # supervises N concurrent renderers. One synth thread per renderer keeps
+    # the total at one core each.
+    tmp_path = out_path + ".part"
+    cmd = ["fluidsynth", "-ni", "-q",
+           "-o", "synth.cpu-cores=1",
+           "-o", "player.timing-source=sample",
+           "-r", str(rate), "-T", fmt, "-F", tmp_path, sf2, midi_path]
+    start = time.time()
+    proc = subprocess.run(cmd, capture_output=True,
+                          preexec_fn=(lambda: os.nice(nice)) if nice else None)
+    wall = time.time() - start
+    if proc.returncode != 0 or not os.path.exists(tmp_path):
+        try: os.remove(tmp_path)
+        except: pass
+        err = proc.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(err[-1] if err else f"fluidsynth exit {proc.returncode}")
+    os.replace(tmp_path, out_path)
+    return wall
+
+# ---------------------- BATCH RENDER ----------------------
+class BounceJob:
+    def __init__(self, sf2, midi_paths, out_dir, fmt="wav", jobs=None, progress_file=None, rate=SAMPLE_RATE, nice=10):
+        self.sf2 = sf2; self.midi_paths = list(midi_paths); self.out_dir = out_dir
+        self.fmt = fmt; self.rate = rate; self.nice = nice
+        self.jobs = jobs or min(4, os.cpu_count() or 1)
+        self.progress_file = progress_file
+        self.lock = threading.Lock()
+        self.state = {
+            "running": True,
+            "sf2": os.path.basename(sf2),
+            "format": fmt,
+            "jobs": self.jobs,
+            "started": time.time(),
+            "elapsed": 0.0,
+            "done": 0,
+            "total": len(self.midi_paths),
+            "audio_seconds": 0.0,
+            "files": [{"name": os.path.basename(p), "status": "queued", "seconds": 0.0} for p in self.midi_paths],
+        }
+
+    def _publish(self):
+        # Atomic write so web_app never reads half a file
+        if not self.progress_file: return
+        try:
+            tmp = self.progress_file + ".tmp"
+            with open(tmp, "w") as f: json.dump(self.state, f)
+            os.replace(tmp, self.progress_file)
+        except: pass
+
+    def _set(self, i, **kw):
+        with self.lock:
+            self.state["files"][i].update(kw)
+            self.state["elapsed"] = round(time.time() - self.state["started"], 2)
+            self._publish()
+
+    def _work(self, i):
+        path = self.midi_paths[i]
+        name = os.path.splitext(os.path.basename(path))[0]
+        out_path = os.path.join(self.out_dir, name + FORMATS[self.fmt])
+        self._set(i, status="rendering")
+        try:
+            wall = render_one(self.sf2, path, out_path, self.fmt, self.rate, self.nice)
+            length = midi_length(path)
+            with self.lock:
+                self.state["done"] += 1
+                self.state["audio_seconds"] = round(self.state["audio_seconds"] + length, 2)
+            self._set(i, status="done", seconds=round(wall, 2), audio_seconds=round(length, 2), out=out_path)
+        except Exception as e:
+            with self.lock: self.state["done"] += 1
+            self._set(i, status="error", error=str(e)[:120])
+
+    def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._publish()
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            list(pool.map(self._work, range(len(self.midi_paths))))
+        with self.lock:
+            self.state["running"] = False
+            self.state["elapsed"] = round(time.time() - self.state["started"], 2)
+            self._publish()
+        return self.state
+
+# ---------------------- CLI ----------------------
+def loaded_sf2_from_state():
+    # The soundfont currently loaded in the engine (published by main.py)
+    try:
+        import shm_state
+        return (shm_state.read_state() or {}).get("sf2") or None
+    except: return None
+
+def resolve_midi(names, midi_dir):
+    if not names:
+        return [os.path.join(midi_dir, f) for f in sorted(os.listdir(midi_dir)) if f.endswith(".mid")]
+    paths = []
+    for n in names:
+        p = n if os.path.sep in n else os.path.join(midi_dir, n)
+        if not p.endswith(".mid"): p += ".mid"
+        paths.append(p)
+    return paths
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Render MIDI files to audio with FluidSynth, in parallel.")
+    ap.add_argument("files", nargs="*", help="MIDI file names (in --midi-dir) or paths; default: all")
+    ap.add_argument("--sf2", help="SoundFont to render with (default: the one loaded in the engine)")
+    ap.add_argument("--midi-dir", default=MIDI_DIR)
+    ap.add_argument("--out", default=OUT_DIR)
+    ap.add_argument("--format", choices=sorted(FORMATS), default="wav")
+    ap.add_argument("--jobs", type=int, default=None, help="Parallel renders (default: up to 4 cores)")
+    ap.add_argument("--rate", type=int, default=SAMPLE_RATE)
+    ap.add_argument("--nice", type=int, default=10, help="Niceness of render processes (0 = off)")
+    ap.add_argument("--progress", default=None, help="Write progress JSON here (web remote uses bounce_state.json)")
+    args = ap.parse_args(argv)
+
+    sf2 = args.sf2 or loaded_sf2_from_state()
+    if not sf2 or not os.path.exists(sf2):
+        print("No SoundFont: pass --sf2 or load one in the engine first"); return 2
+    paths = resolve_midi(args.files, args.midi_dir)
+    if not paths:
+        print("No MIDI files to render"); return 1
+
+    job = BounceJob(sf2, paths, args.out, args.format, args.jobs, args.progress, args.rate, args.nice)
+    state = job.run()
+
+    for f in state["files"]:
+        print(f"{f['status']:>9}  {f['seconds']:7.2f}s  {f['name']}" + (f"  ({f['error']})" if f.get("error") else ""))
+    wall = state["elapsed"] or 1e-9
+    print(f"{state['total']} files, {state['audio_seconds']:.1f}s audio in {wall:.1f}s wall "
+          f"with {state['jobs']} jobs = {state['audio_seconds'] / wall:.1f}x realtime")
+    return 0 if all(f["status"] == "done" for f in state["files"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# Display backends for the 240x240 frame that main.py renders.
+#
+# Every backend gets the PIL frame plus the list of regions that were
+# repainted since the last push. Pick one with --display or ZOMPLER_DISPLAY:
+#
+#   st7789      Pirate Audio screen over SPI, partial-window updates
+#   null        no screen: main.py skips rendering entirely, backlight off
+#   virtual     frames kept in memory (benchmarks, tests on a desktop)
+#   png:DIR     like virtual, and writes DIR/frame.png on every change
+#   mirror      publishes the raw frame for web_app's live LCD mirror
+#
+# Several can run at once, comma separated: "st7789,mirror".
+import os
+
+WIDTH = HEIGHT = 240
+LCD_BL = 13 # Pirate Audio backlight pin
+# Raw RGB888 frame shared with web_app.py (tmpfs, so no SD card writes)
+LCD_MIRROR_FILE = "/dev/shm/zompler_lcd.rgb" if os.path.isdir("/dev/shm") else "/tmp/zompler_lcd.rgb"
+
+# ---------------------- ST7789 PARTIAL UPDATES ----------------------
+class ST7789Window:
+    # Keeps an RGB565 copy of what is on the panel and only sends the part of
+    # each dirty region that actually differs, through the controller's
+    # column/row address window (CASET/RASET) instead of a full 115 KB frame.
+    def __init__(self, disp, width, height, rotation=0):
+        import numpy as np
+        self.np = np; self.disp = disp
+        self.width = width; self.height = height
+        self.k = (rotation // 90) % 4 # same np.rot90 turns the driver applies
+        self.fb = None # panel-orientation uint16 frame; None until the first push
+        self.bytes_sent = 0
+
+    def _panel_box(self, x0, y0, x1, y1):
+        # Image box (half-open) -> panel rows/cols after the driver's rotation
+        w, h = self.width, self.height
+        if self.k == 0: return y0, y1, x0, x1
+        if self.k == 1: return w - x1, w - x0, y0, y1
+        if self.k == 2: return h - y1, h - y0, w - x1, w - x0
+        return x0, x1, h - y1, h - y0
+
+    def _send(self, r0, c0, px):
+        rows, cols = px.shape
+        self.disp.set_window(c0, r0, c0 + cols - 1, r0 + rows - 1)
+        data = px.astype(">u2").tobytes()
+        for i in range(0, len(data), 4096):
+            self.disp.data(list(data[i:i + 4096]))
+        self.bytes_sent += len(data)
+
+    def push(self, image, regions=None):
+        np = self.np
+        if self.fb is None or regions is None:
+            regions = [(0, 0, self.width, self.height)]
+        for x0, y0, x1, y1 in regions:
+            x0, y0 = max(0, x0), max(0, y0)
+            x1, y1 = min(self.width, x1), min(self.height, y1)
+            if x1 <= x0 or y1 <= y0: continue
+            rgb = np.asarray(image.crop((x0, y0, x1, y1)), dtype=np.uint16)
+            px = ((rgb[..., 0] & 0xF8) << 8) | ((rgb[..., 1] & 0xFC) << 3) | (rgb[..., 2] >> 3)
+            px = np.rot90(px, self.k)
+            r0, r1, c0, c1 = self._panel_box(x0, y0, x1, y1)
+            if self.fb is None:
+                self.fb = np.ascontiguousarray(px)
+                self._send(0, 0, self.fb)
+                continue
+            # Shrink the region to the rows/cols that really changed
+            diff = px != self.fb[r0:r1, c0:c1]
+            if not diff.any(): continue
+            rows = np.flatnonzero(diff.any(axis=1)); cols = np.flatnonzero(diff.any(axis=0))
+            ra, rb, ca, cb = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            sub = px[ra:rb, ca:cb]
+            self.fb[r0 + ra:r0 + rb, c0 + ca:c0 + cb] = sub
+            self._send(r0 + ra, c0 + ca, sub)
+
+class ST7789Backend:
+    renders = True
+
+    def __init__(self, rotation=90, spi_speed_hz=40_000_000):
+        try: import st7789 as st_lib
+        except ImportError: import ST7789 as st_lib # older Pimoroni library name
+        self.disp = st_lib.ST7789(width=WIDTH, height=HEIGHT, rotation=rotation, port=0, cs=st_lib.BG_SPI_CS_FRONT,
+                                  dc=9, backlight=LCD_BL, spi_speed_hz=spi_speed_hz)
+        self.disp.begin()
+        self.window = None
+        try: self.window = ST7789Window(self.disp, WIDTH, HEIGHT, rotation)
+        except Exception as e: print(f"Partial updates off: {e}")
+
+    def show(self, image, regions=None):
+        if self.window is not None: self.window.push(image, regions)
+        else: self.disp.display(image)
+
+# ---------------------- NULL (HEADLESS) ----------------------
+class NullBackend:
+    # main.py checks `renders` and never builds a frame, so this costs nothing
+    renders = False
+
+    def __init__(self, backlight_pin=LCD_BL):
+        # Physical power save: hold the backlight low if the pin is there
+        self.backlight = None
+        try:
+            from gpiozero import DigitalOutputDevice
+            self.backlight = DigitalOutputDevice(backlight_pin, initial_value=False)
+        except Exception: pass
+
+    def show(self, image, regions=None): pass
+
+# ---------------------- VIRTUAL FRAMEBUFFER ----------------------
+class VirtualBackend:
+    renders = True
+
+    def __init__(self, png_dir=None):
+        self.png_dir = png_dir
+        self.frame = None # copy of the last pushed frame
+        self.regions = None # regions of the last push (None = full frame)
+        self.frames = 0
+        if png_dir: os.makedirs(png_dir, exist_ok=True)
+
+    def show(self, image, regions=None):
+        self.frame = image.copy()
+        self.regions = regions
+        self.frames += 1
+        if self.png_dir:
+            path = os.path.join(self.png_dir, "frame.png")
+            image.save(path + ".tmp", "PNG")
+            os.replace(path + ".tmp", path)
+
+# ---------------------- WEB MIRROR ----------------------
+class MirrorBackend:
+    # Only called when the screen changed, so this is one 172 KB tmpfs write
+    # per change. web_app.py diffs it into tiles for the phone.
+    renders = True
+
+    def __init__(self, path=LCD_MIRROR_FILE):
+        self.path = path
+
+    def show(self, image, regions=None):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f: f.write(image.tobytes())
+        os.replace(tmp, self.path)
+
+class TeeBackend:
+    def __init__(self, backends):
+        self.backends = backends
+        self.renders = any(b.renders for b in backends)
+
+    def show(self, image, regions=None):
+        for b in self.backends:
+            if b.renders: b.show(image, regions)
+
+def make_backend(spec):
+    spec = (spec or "st7789").strip()
+    if "," in spec:
+        # A broken screen must not take the mirror down with it
+        backends = []
+        for part in [p for p in spec.split(",") if p.strip()]:
+            try: backends.append(make_backend(part))
+            except Exception as e: print(f"Display backend {part} failed: {e}")
+        if not backends: raise RuntimeError(f"No display backend from {spec}")
+        return TeeBackend(backends)
+    if spec == "st7789": return ST7789Backend()
+    if spec == "mirror": return MirrorBackend()
+    if spec == "null": return NullBackend()
+    if spec == "virtual": return VirtualBackend()
+    if spec.startswith("png:"): return VirtualBackend(os.path.expanduser(spec[4:]))
+    raise ValueError(f"Unknown display backend: {spec}")
@@ -1,846 +1,2065 @@
-#!/usr/bin/env python3
-import sys, os, time, threading, smbus, datetime, json
-import mido 
-
-# --- 1. BOOT DELAY ---
-time.sleep(0.5)
-
-# --- 2. HARDCODED PATHS ---
-BASE_DIR = "/home/pi/midifileplayer"
-soundfont_folder = "/home/pi/sf2"
-midi_file_folder = "/home/pi/midifiles"
-STATE_FILE = os.path.join(BASE_DIR, "monkey_state.json")
-mixer_file = os.path.join(BASE_DIR, "mixer_settings.json")
-
-# Ensure folders exist
-for d in [soundfont_folder, midi_file_folder, BASE_DIR]:
-    if not os.path.exists(d): os.makedirs(d)
-
-# --- 3. CONFIGURATION & STATE ---
-LED_NAME = "ACT"  
-SHUTTING_DOWN = False  
-LOW_POWER_MODE = False
-MESSAGE = ""
-msg_start_time = 0
-
-# Navigation & Menu State
-operation_mode = "main screen"
-selectedindex = 0
-files = []
-pathes = []
-MAIN_MENU = ["SOUND FONT", "MIDI FILE", "MIDI KEYBOARD", "MIXER", "METRONOME", "VOLUME", "POWER", "RECORD", "SHUTDOWN"]
-
-# Audio & Volume State
-# Changed 0.5 to 70 (0-100 scale) to match display and scroll logic
-volume_level = 70 
-channel_volumes = {i: 100 for i in range(16)}
-
-# Metronome State
-metronome_on = False
-metro_adjusting = False
-bpm = 120
-metro_vol = 80 # Default MIDI volume (0-127)
-
-# Mixer State
-mixer_selected_ch = 0
-mixer_adjusting = False
-
-# Rename State
-rename_string = ""
-rename_char_idx = 0
-rename_chars = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-OK"
-
-# FluidSynth & MIDI
-midi_manager = None 
-sf2_mapping_cache = {}
-sfid = None # Track loaded SoundFont ID
-selected_file_path = ""
-loaded_sf2_path = ""
-
-# --- MIXER SAVE/LOAD LOGIC ---
-def save_mixer():
-    try:
-        with open(mixer_file, 'w') as f:
-            json.dump(channel_volumes, f)
-    except: pass
-
-def load_mixer():
-    global channel_volumes
-    if os.path.exists(mixer_file):
-        try:
-            with open(mixer_file, 'r') as f:
-                data = json.load(f)
-                channel_volumes = {int(k): v for k, v in data.items()}
-        except: pass
-
-# ---------------------- RECORDING ENGINE ----------------------
-class MidiRecorder:
-    def __init__(self):
-        self.recording = False
-        self.mid = None
-        self.track = None
-        self.start_time = 0
-        self.last_event_time = 0
-
-    def start(self):
-        self.mid = mido.MidiFile()
-        self.track = mido.MidiTrack()
-        self.mid.tracks.append(self.track)
-        self.recording = True
-        self.start_time = time.time()
-        self.last_event_time = self.start_time
-
-    def stop(self, filename=None):
-        if not self.recording: return
-        self.recording = False
-        if filename:
-            # Properly close MIDI track
-            self.track.append(mido.MetaMessage('end_of_track', time=0))
-            self.mid.save(filename)
-
-    def add_event(self, msg):
-        if self.recording:
-            now = time.time()
-            # Calculate delta time in ticks (assuming 480 TPB and 120 BPM)
-            delta = int(mido.second2tick(now - self.last_event_time, self.mid.ticks_per_beat, 500000))
-            msg.time = delta
-            self.track.append(msg)
-            self.last_event_time = now
-
-recorder = MidiRecorder()
-
-# ---------------------- METRONOME ENGINE ----------------------
-metronome_on = False
-bpm = 120
-metro_vol = 80 
-metro_adjusting = False
-
-def metronome_worker():
-    while True:
-        if metronome_on and fs:
-            try:
-                fs.noteon(9, 76, 110) 
-                time.sleep(0.05)
-                fs.noteoff(9, 76)
-                time.sleep(max(0.01, (60.0 / bpm) - 0.05))
-            except: time.sleep(0.1)
-        else:
-            time.sleep(0.2)
-
-threading.Thread(target=metronome_worker, daemon=True).start()
-
-# ---------------------- WAVESHARE UPS (C) ----------------------
-class UPS_C:
-    def __init__(self, addr=0x43):
-        self.bus = None; self.addr = addr; self.readings = []
-        try: self.bus = smbus.SMBus(1)
-        except: pass
-    def get_voltage(self):
-        if not self.bus: return 0.0
-        try:
-            read = self.bus.read_word_data(self.addr, 0x02)
-            swapped = ((read << 8) & 0xFF00) | ((read >> 8) & 0x00FF)
-            v = (swapped >> 3) * 0.004
-            self.readings.append(v)
-            if len(self.readings) > 20: self.readings.pop(0)
-            return sorted(self.readings)[len(self.readings)//2]
-        except: return 0.0
-    def get_time_left(self):
-        v = self.get_voltage()
-        if v < 3.0: return "0:00"
-        p = max(0, min(1, (v - 3.4) / (4.15 - 3.4)))
-        total_minutes = p * (450 if LOW_POWER_MODE else 240)
-        return f"{int(total_minutes // 60)}:{int(total_minutes % 60):02d}"
-
-ups = UPS_C()
-
-# ---------------------- UI MENU CONFIG ----------------------
-MAIN_MENU = ["MIDI KEYBOARD", "SOUND FONT", "MIDI FILE", "MIXER", "RECORD", "METRONOME", "VOLUME", "POWER", "SHUTDOWN"]
-files = MAIN_MENU.copy()
-pathes = MAIN_MENU.copy()
-selectedindex = 0
-operation_mode = "main screen"
-selected_file_path = ""
-rename_string = ""
-rename_chars = [" ", "A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y", "Z", "a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "_", "-", "OK"]
-rename_char_idx = 0
-mixer_selected_ch = 0
-mixer_adjusting = False
-channel_presets = {}
-
-# ---------------------- HARDWARE INITIALIZATION ----------------------
-fs = None; sfid = None; loaded_sf2_path = None; disp = None
-img = draw = font = font_tiny = None
-_last_display_time = 0.0
-soundfont_paths, soundfont_names = [], []; midi_paths, midi_names = [], []
-
-def init_buttons():
-    global button_up, button_down, button_select, button_back
-    from gpiozero import Button
-    button_up, button_down = Button(16), Button(24)
-    button_select, button_back = Button(5), Button(6)
-
-def init_display():
-    global disp, img, draw, font, font_tiny
-    try:
-        import st7789 as st_lib
-        from PIL import Image, ImageDraw, ImageFont
-        disp = st_lib.ST7789(width=240, height=240, rotation=90, port=0, cs=st_lib.BG_SPI_CS_FRONT, dc=9, backlight=13, spi_speed_hz=40_000_000)
-        disp.begin()
-        img = Image.new("RGB", (240, 240), (0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        try: 
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 18)
-            font_tiny = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 14)
-        except: 
-            font = ImageFont.load_default(); font_tiny = ImageFont.load_default()
-    except: pass
-
-def init_fluidsynth_lazy():
-    global fs
-    if fs is None:
-        try:
-            import fluidsynth as fs_lib
-            fs = fs_lib.Synth()
-            
-            # --- VOLUME CORRECTION ---
-            # Converts 0-100 scale back to 0.0-1.0 for FluidSynth
-            fs.setting('synth.gain', volume_level / 100.0)
-            
-            # Performance Settings
-            fs.setting('player.timing-source', 'sample')
-            fs.setting('synth.cpu-cores', 4) # Take advantage of Pi's cores
-            fs.setting('audio.alsa.device', 'default')
-            
-            # Start the driver
-            # Note: driver name can be "alsa", "pulse", or "jack" depending on your OS setup
-            fs.start(driver="alsa")
-            
-            # Initialize Metronome Volume (Internal Channel 9 / MIDI Ch 10)
-            # This ensures the metronome starts at your saved metro_vol level
-            fs.cc(9, 7, metro_vol)
-            
-        except Exception as e: 
-            print(f"Synth Init Fail: {e}")
-# ---------------------- POWER MANAGEMENT ----------------------
-def toggle_power_mode():
-    global LOW_POWER_MODE, MESSAGE, msg_start_time
-    LOW_POWER_MODE = not LOW_POWER_MODE
-    if LOW_POWER_MODE:
-        os.system("sudo tvservice -o > /dev/null 2>&1")
-        os.system("echo powersave | sudo tee /sys/devices/system/cpu/cpu0/cpufreq/scaling_governor > /dev/null")
-        os.system(f"echo none | sudo tee /sys/class/leds/{LED_NAME}/trigger > /dev/null")
-        if fs: fs.setting('synth.polyphony', 48)
-        MESSAGE = "Lean: ON (ECO)"
-    else:
-        os.system("sudo tvservice -p > /dev/null 2>&1")
-        os.system("echo ondemand | sudo tee /sys/devices/system/cpu/cpu0/cpufreq/scaling_governor > /dev/null")
-        os.system(f"echo mmc0 | sudo tee /sys/class/leds/{LED_NAME}/trigger > /dev/null")
-        if fs: fs.setting('synth.polyphony', 96)
-        MESSAGE = "Lean: OFF (MAX)"
-    msg_start_time = time.time()
-
-# ---------------------- MIDI ENGINE LOGIC ----------------------
-def get_internal_channel(monkey_ch): 
-    return 9 if monkey_ch == 0 else monkey_ch - 1
-
-def build_sf2_preset_map(sf2_path):
-    global sf2_mapping_cache
-    if not sf2_path or not os.path.exists(sf2_path):
-        return {}, False
-    try:
-        from sf2utils.sf2parse import Sf2File
-        with open(sf2_path, 'rb') as f:
-            sf2 = Sf2File(f)
-            mapping = {}
-            for p in sf2.presets:
-                b = getattr(p, 'bank', getattr(getattr(p, 'header', object()), 'bank', 0))
-                pr = getattr(p, 'preset', getattr(getattr(p, 'header', object()), 'preset', 0))
-                mapping[(b, pr)] = p.name
-            sf2_mapping_cache = mapping
-            return mapping, True
-    except:
-        return {}, False
-
-def select_first_presets_for_monkey():
-    global channel_presets, sfid, fs, loaded_sf2_path, sf2_mapping_cache
-    if sfid is None or fs is None or not loaded_sf2_path: return
-    
-    # Force a fresh scan if cache is empty
-    mapping, ok = build_sf2_preset_map(loaded_sf2_path)
-        
-    channel_presets.clear() 
-    if ok and mapping:
-        # Find all available banks
-        available_banks = sorted(list(set(bank for bank, prog in mapping.keys())))
-        # Use first available bank if 0 isn't there
-        main_bank = 0 if 0 in available_banks else (available_banks[0] if available_banks else 0)
-        
-        # --- DRUMS (Monkey 0 -> MIDI Ch 10) ---
-        drum_bank = 128 if 128 in available_banks else (127 if 127 in available_banks else main_bank)
-        fs.program_select(9, sfid, drum_bank, 0)
-        channel_presets[9] = mapping.get((drum_bank, 0), "Drums")
-
-        # --- INSTRUMENTS (Monkey 1-9 -> MIDI Ch 1-9) ---
-        # Get all presets in our main bank
-        bank_presets = sorted([p for b, p in mapping.keys() if b == main_bank])
-        
-        for m_ch in range(1, 10):
-            f_ch = m_ch - 1 # Internal index
-            # Pick the next available preset in the bank
-            prog = bank_presets[m_ch-1] if len(bank_presets) >= m_ch else 0
-            fs.program_select(f_ch, sfid, main_bank, prog)
-            channel_presets[f_ch] = mapping.get((main_bank, prog), f"Patch {prog}")
-    else:
-        # Emergency Fallback if sf2utils failed
-        for i in range(16): channel_presets[i] = "Generic Patch"
-    
-    update_web_state()
-
-class SafeMidiIn:
-    def __init__(self):
-        import rtmidi as rt_lib
-        self.midiin = rt_lib.MidiIn(); self.port_name = None; self.callback = None
-    def set_callback(self, cb):
-        self.callback = cb
-        if self.midiin.is_port_open(): self.midiin.set_callback(self._cb)
-    def _cb(self, msg, ts):
-        if self.callback: self.callback(msg, ts)
-    def open_port_by_name_async(self, name):
-        def t():
-            ports = self.midiin.get_ports()
-            if name in ports:
-                if self.midiin.is_port_open(): self.midiin.close_port()
-                self.midiin.open_port(ports.index(name))
-                self.midiin.set_callback(self._cb); self.port_name = name
-                global MESSAGE, msg_start_time; MESSAGE = "MIDI Connected"; msg_start_time = time.time()
-        threading.Thread(target=t, daemon=True).start()
-    def list_ports(self): return self.midiin.get_ports()
-
-def midi_callback(message_data, timestamp):
-    global sf2_mapping_cache, sfid, channel_presets, fs, loaded_sf2_path
-    message, _ = message_data
-    status = message[0] & 0xF0
-    ch = message[0] & 0x0F
-    n1 = message[1] if len(message) > 1 else 0
-    n2 = message[2] if len(message) > 2 else 0
-
-    if recorder.recording:
-        try:
-            mido_msg = mido.Message.from_bytes(bytes(message))
-            recorder.add_event(mido_msg)
-        except: pass
-
-    if not fs: return
-
-    if status == 0x90 and n2 > 0: fs.noteon(ch, n1, n2)
-    elif status == 0x90 or status == 0x80: fs.noteoff(ch, n1)
-    elif status == 0xB0: 
-        fs.cc(ch, n1, n2)
-        if n1 == 7: channel_volumes[ch] = n2 # Sync volume if keyboard sends CC7
-    elif status == 0xE0: fs.pitch_bend(ch, (n2 << 7) + n1 - 8192)
-    elif status == 0xC0:
-        bank = 128 if ch == 9 else 0
-        if sfid is not None:
-            fs.program_select(ch, sfid, bank, n1)
-            name = sf2_mapping_cache.get((bank, n1), f"Patch {n1}")
-            channel_presets[ch] = name
-            update_web_state()
-
-def scan_soundfonts():
-    global soundfont_paths, soundfont_names
-    p, l = [], []
-    if os.path.isdir(soundfont_folder):
-        for f in sorted(os.listdir(soundfont_folder)):
-            if f.endswith('.sf2'): p.append(os.path.join(soundfont_folder, f)); l.append(f.replace('.sf2', ''))
-    soundfont_paths, soundfont_names = p, l
-
-def scan_midifiles():
-    global midi_paths, midi_names
-    p, l = [], []
-    if os.path.isdir(midi_file_folder):
-        for f in sorted(os.listdir(midi_file_folder)):
-            if f.endswith('.mid'): p.append(os.path.join(midi_file_folder, f)); l.append(f.replace('.mid', ''))
-    midi_paths, midi_names = p, l
-
-# ---------------------- BUTTON HANDLERS ----------------------
-def handle_back():
-    global operation_mode, files, pathes, selectedindex, rename_string, mixer_adjusting, metro_adjusting
-    if operation_mode == "MIXER":
-        if mixer_adjusting: mixer_adjusting = False; return
-        else: save_mixer() 
-    if operation_mode == "METRONOME" and metro_adjusting: metro_adjusting = False; return
-    
-    if operation_mode == "RENAME":
-        if len(rename_string) > 0: 
-            rename_string = rename_string[:-1]
-        else: 
-            operation_mode = "FILE ACTION"
-            files = ["PLAY", "STOP", "RENAME", "DELETE", "BACK"]
-            selectedindex = 2 # Highlight RENAME so you know where you came from
-    elif operation_mode == "FILE ACTION":
-        operation_mode = "MIDI FILE"
-        scan_midifiles()
-        files, pathes = midi_names.copy(), midi_paths.copy()
-        selectedindex = 0
-    else:
-        operation_mode = "main screen"
-        files = MAIN_MENU.copy()
-        selectedindex = 0
-    update_web_state()
-    
-def handle_scroll(direction):
-    global selectedindex, operation_mode, volume_level, bpm, rename_char_idx
-    global mixer_selected_ch, mixer_adjusting, metro_vol, metro_adjusting
-
-    # --- 1. NAVIGATION MODES (Main Menu & File Lists) ---
-    if operation_mode in ["main screen", "SOUND FONT", "MIDI FILE", "MIDI KEYBOARD", "FILE ACTION"]:
-        if direction == "UP":
-            selectedindex = (selectedindex - 1) % len(files)
-        else:
-            selectedindex = (selectedindex + 1) % len(files)
-
-    # --- 2. VOLUME MODE (Master Gain) ---
-    elif operation_mode == "VOLUME":
-        if direction == "UP":
-            volume_level = min(100, volume_level + 5)
-        else:
-            volume_level = max(0, volume_level - 5)
-        if fs:
-            fs.setting('synth.gain', volume_level / 100.0)
-
-    # --- 3. METRONOME MODE (Toggle, BPM, and Click Vol) ---
-    elif operation_mode == "METRONOME":
-        if not metro_adjusting:
-            # Scroll through the 3 rows: [0: Status, 1: BPM, 2: Vol]
-            if direction == "UP":
-                selectedindex = (selectedindex - 1) % 3
-            else:
-                selectedindex = (selectedindex + 1) % 3
-        else:
-            # Adjust the actual values of the selected row
-            if selectedindex == 1: # BPM Row
-                bpm = min(250, bpm + 2) if direction == "UP" else max(40, bpm - 2)
-            elif selectedindex == 2: # Metronome Volume Row
-                metro_vol = min(127, metro_vol + 5) if direction == "UP" else max(0, metro_vol - 5)
-                if fs:
-                    fs.cc(9, 7, metro_vol)
-
-    # --- 4. MIXER MODE (Channel Volumes) ---
-    elif operation_mode == "MIXER":
-        if not mixer_adjusting:
-            # Choose which of the 10 channels to look at
-            mixer_selected_ch = (mixer_selected_ch + (1 if direction == "DOWN" else -1)) % 10
-        else:
-            # Adjust the volume of the chosen channel
-            f_ch = get_internal_channel(mixer_selected_ch)
-            vol = channel_volumes.get(f_ch, 100)
-            vol = min(127, vol + 5) if direction == "UP" else max(0, vol - 5)
-            channel_volumes[f_ch] = vol
-            if fs:
-                fs.cc(f_ch, 7, vol)
-
-    # --- 5. RENAME MODE (Letter Picker) ---
-    elif operation_mode == "RENAME":
-        if direction == "UP":
-            rename_char_idx = (rename_char_idx - 1) % len(rename_chars)
-        else:
-            rename_char_idx = (rename_char_idx + 1) % len(rename_chars)
-
-    # Always sync to the web app/phone after a scroll
-    update_web_state()
-    
-def handle_select():
-    global operation_mode, files, pathes, selectedindex, MESSAGE, msg_start_time
-    global fs, sfid, SHUTTING_DOWN, rename_string, rename_char_idx
-    global mixer_adjusting, selected_file_path, loaded_sf2_path, metronome_on, metro_adjusting
-    global volume_level, bpm, metro_vol
-
-    # --- 1. SPECIAL MODES (Mixer & Metronome) ---
-    if operation_mode == "MIXER": 
-        mixer_adjusting = not mixer_adjusting
-        update_web_state()
-        return
-        
-    if operation_mode == "METRONOME":
-        if selectedindex == 0: 
-            metronome_on = not metronome_on
-            MESSAGE = "Metro: " + ("ON" if metronome_on else "OFF")
-        else: 
-            # Toggles between "moving the cursor" and "changing the value"
-            metro_adjusting = not metro_adjusting
-            MESSAGE = "ADJUSTING..." if metro_adjusting else "CONFIRMED"
-        
-        msg_start_time = time.time()
-        update_web_state()
-        return
-
-    # --- 2. VOLUME MODE ---
-    elif operation_mode == "VOLUME":
-        operation_mode = "main screen"
-        files = MAIN_MENU.copy()
-        selectedindex = 0 # Return to top or use a specific index
-        MESSAGE = f"Master: {int(volume_level)}%"
-        msg_start_time = time.time()
-        update_web_state()
-        return
-        
-    # --- 3. VALIDATION ---
-    if not files and operation_mode != "RENAME": return
-    if operation_mode != "RENAME": sel = files[selectedindex]
-    
-    # --- 4. MAIN MENU LOGIC ---
-    if operation_mode == "main screen":
-        # Handle simple mode switches first
-        if sel in ["MIXER", "METRONOME", "VOLUME"]:
-            operation_mode = sel
-            selectedindex = 0
-            return
-        
-        if sel == "POWER": toggle_power_mode(); return
-
-        if sel == "RECORD":
-            if not recorder.recording:
-                recorder.start(); MESSAGE = "Recording..."
-            else:
-                ts = datetime.datetime.now().strftime("%H%M%S")
-                path = os.path.join(midi_file_folder, f"rec_{ts}.mid")
-                recorder.stop(path); MESSAGE = "Saved Rec"; scan_midifiles()
-            msg_start_time = time.time(); update_web_state(); return
-        
-        if sel == "SHUTDOWN":
-            SHUTTING_DOWN = True
-            draw.rectangle((0, 0, 240, 240), fill=(0, 0, 0))
-            draw.text((45, 100), "SYSTEM HALT", font=font, fill=(255, 0, 0))
-            disp.display(img)
-            if fs: fs.delete()
-            time.sleep(1.0); os.system("sudo /sbin/poweroff"); return
-
-        # Load Sub-Menus
-        operation_mode = sel
-        if sel == "SOUND FONT": 
-            scan_soundfonts()
-            files, pathes = soundfont_names.copy(), soundfont_paths.copy()
-        elif sel == "MIDI FILE": 
-            scan_midifiles()
-            files, pathes = midi_names.copy(), midi_paths.copy()
-        elif sel == "MIDI KEYBOARD": 
-            files = pathes = midi_manager.list_ports()
-        selectedindex = 0
-
-    # --- 5. MIDI FILE & FILE ACTIONS ---
-    elif operation_mode == "MIDI FILE":
-        selected_file_path = pathes[selectedindex]
-        operation_mode = "FILE ACTION"
-        files = ["PLAY", "STOP", "RENAME", "DELETE", "BACK"]
-        selectedindex = 0
-
-    elif operation_mode == "FILE ACTION":
-        if sel == "PLAY":
-            if not sfid: 
-                MESSAGE = "LOAD SF2 FIRST"
-            else:
-                import subprocess
-                try:
-                    # 1. Kill old processes
-                    subprocess.run(["pkill", "-9", "aplaymidi"], capture_output=True)
-                    
-                    # 2. Reset synth
-                    if fs:
-                        for i in range(16): 
-                            fs.all_sounds_off(i)
-                    
-                    # 3. Robust Port Discovery
-                    target_port = None
-                    try:
-                        port_data = subprocess.check_output(['aplaymidi', '-l']).decode()
-                        for line in port_data.split('\n'):
-                            if "FLUID Synth" in line:
-                                # This splits the line and takes the first part (e.g., '128:0')
-                                target_port = line.strip().split(' ')[0]
-                                break
-                    except:
-                        target_port = "128:0" # Fallback if -l fails
-
-                    if not target_port:
-                        target_port = "128:0"
-
-                    # 4. Start playback
-                    # Added 'str()' and check if file exists
-                    if os.path.exists(selected_file_path):
-                        subprocess.Popen(["aplaymidi", "--port", target_port, str(selected_file_path)])
-                        MESSAGE = f"Playing"
-                    else:
-                        MESSAGE = "File Not Found"
-                    
-                except Exception as e:
-                    print(f"CRITICAL PLAY ERROR: {e}") # This shows in your terminal/logs
-                    MESSAGE = "Play Error"
-
-        elif sel == "STOP":
-            import subprocess
-            subprocess.run(["pkill", "-9", "aplaymidi"], capture_output=True)
-            if fs:
-                for i in range(16): 
-                    fs.all_sounds_off(i)
-                select_first_presets_for_monkey()
-            MESSAGE = "Stopped"
-
-        elif sel == "RENAME":
-            operation_mode = "RENAME"
-            rename_string = os.path.basename(selected_file_path).replace(".mid", "")
-            rename_char_idx = 0
-
-        elif sel == "DELETE":
-            try:
-                if os.path.exists(selected_file_path): 
-                    os.remove(selected_file_path)
-                MESSAGE = "Deleted"
-                scan_midifiles()
-                files, pathes = midi_names.copy(), midi_paths.copy()
-                operation_mode = "MIDI FILE"
-                selectedindex = 0
-            except:
-                MESSAGE = "Delete Error"
-
-        elif sel == "BACK":
-            operation_mode = "MIDI FILE"
-            selectedindex = 0
-
-    # --- 6. RENAME & SOUNDFONT LOADING ---
-    elif operation_mode == "RENAME":
-        char = rename_chars[rename_char_idx]
-        if char == "OK":
-            new_path = os.path.join(midi_file_folder, rename_string.strip() + ".mid")
-            try: os.rename(selected_file_path, new_path); MESSAGE = "Renamed"
-            except: MESSAGE = "Error"
-            operation_mode = "MIDI FILE"
-            scan_midifiles(); files, pathes = midi_names.copy(), midi_paths.copy()
-            selectedindex = 0
-        else:
-            rename_string += char
-
-    elif operation_mode == "SOUND FONT":
-        loaded_sf2_path = pathes[selectedindex]
-        MESSAGE = "Loading..."
-        update_display() # Show "Loading" immediately
-        init_fluidsynth_lazy()
-        sfid = fs.sfload(loaded_sf2_path, True)
-        select_first_presets_for_monkey()
-        MESSAGE = "SF2 LOADED"
-        operation_mode = "main screen"; files = MAIN_MENU.copy(); selectedindex = 0
-
-    elif operation_mode == "MIDI KEYBOARD":
-        midi_manager.open_port_by_name_async(pathes[selectedindex])
-        operation_mode = "main screen"; files = MAIN_MENU.copy(); selectedindex = 0
-
-    msg_start_time = time.time()
-    update_web_state()
-# ---------------------- WEB CONNECTIVITY ----------------------
-def update_web_state():
-    global operation_mode, selectedindex, rename_string, rename_char_idx, files
-    global volume_level, bpm, metronome_on, MESSAGE, msg_start_time
-    global metro_vol, metro_adjusting, mixer_selected_ch, mixer_adjusting # Added for safety
-
-    try:
-        display_list = []
-        current_idx = selectedindex
-        
-        # 1. Determine the 'List View' content
-        if operation_mode == "RENAME":
-            display_list = [f"Building: {rename_string}", f"Char: {rename_chars[rename_char_idx]}"]
-            current_idx = 1
-        elif operation_mode == "MIXER":
-            current_idx = mixer_selected_ch
-            for m_ch in range(10):
-                f_ch = get_internal_channel(m_ch)
-                name = channel_presets.get(f_ch, f"CH {f_ch}")
-                vol = channel_volumes.get(f_ch, 100)
-                display_list.append(f"{m_ch}: {name[:10]} ({vol}%)")
-        elif operation_mode in ["VOLUME", "METRONOME"]:
-            # We clear the list so the web app shows its specialized UI overlays
-            display_list = []
-        else:
-            display_list = files if files else ["No Files"]
-
-        # 2. Package everything for the Web App
-        state_data = {
-            "mode": str(operation_mode),
-            "index": int(current_idx), # Use the smart index we calculated
-            "files": display_list,     # Use the smart list we built
-            "msg": MESSAGE if (time.time() - msg_start_time < 2.0) else "",
-            "battery": ups.get_time_left(),
-            "is_eco": bool(LOW_POWER_MODE),
-            "rename_tmp": str(rename_string),
-            "volume": int(volume_level),
-            "bpm": int(bpm),
-            "metronome_on": bool(metronome_on),
-            "metro_vol": int(metro_vol),
-            "mixer_idx": int(mixer_selected_ch),
-            "is_adjusting": bool(metro_adjusting or mixer_adjusting)
-        }
-
-        # 3. Atomic Write (Anti-Corruption)
-        target = os.path.join(BASE_DIR, "monkey_state.json")
-        temp_file = target + ".tmp"
-        with open(temp_file, "w") as f: 
-            json.dump(state_data, f)
-        os.replace(temp_file, target) # Instant swap
-        
-    except Exception as e:
-        # print(f"Web Update Error: {e}") 
-        pass
-
-# ---------------------- DISPLAY ENGINE ----------------------
-def update_display():
-    global _last_display_time
-    if SHUTTING_DOWN or draw is None: return 
-    
-    now = time.time()
-    # Throttle display updates to save CPU
-    if now - _last_display_time < (0.15 if LOW_POWER_MODE else 0.06): return
-    _last_display_time = now
-    
-    # Yellow accent for ECO mode, White for MAX
-    accent = (255, 255, 0) if LOW_POWER_MODE else (255, 255, 255)
-    
-    # 1. Clear Background and Draw Header
-    draw.rectangle((0, 0, 240, 240), fill=(0, 0, 0))
-    draw.rectangle((0, 0, 240, 26), fill=(30, 30, 30))
-    draw.text((10, 4), f"BAT: {ups.get_time_left()}", font=font_tiny, fill=accent)
-    
-    # 2. Draw Mode Title
-    draw.rectangle((0, 26, 240, 56), fill=(50, 50, 50))
-    draw.text((10, 31), operation_mode.upper(), font=font, fill=accent)
-
-    # --- MODE: VOLUME ---
-    if operation_mode == "VOLUME":
-        draw.text((30, 90), "MASTER GAIN", font=font, fill=accent)
-        draw.rectangle((20, 120, 220, 150), outline=accent, width=2)
-        # Standardized for 0-100 scale: 196 pixels wide max
-        bar_width = int(1.96 * volume_level)
-        draw.rectangle((22, 122, 22 + bar_width, 148), fill=(0, 255, 0))
-        draw.text((100, 160), f"{int(volume_level)}%", font=font, fill=accent)
-
-    # --- MODE: METRONOME ---
-    elif operation_mode == "METRONOME":
-        metro_lines = [
-            f"STATUS: {'ACTIVE' if metronome_on else 'OFF'}",
-            f"BPM: {bpm}",
-            f"CLICK VOL: {metro_vol}"
-        ]
-        for i, text in enumerate(metro_lines):
-            y = 75 + (i * 35)
-            is_selected = (i == selectedindex)
-            
-            # Draw a green box if we are actually turning the knob to change the value
-            if is_selected:
-                box_color = (0, 255, 0) if metro_adjusting else accent
-                draw.rectangle([10, y-4, 230, y+28], fill=box_color)
-                draw.text((20, y), text, font=font, fill=(0, 0, 0))
-            else:
-                draw.text((20, y), text, font=font, fill=accent)
-
-    # --- MODE: MIXER ---
-    elif operation_mode == "MIXER":
-        for i in range(10):
-            y = 60 + (i * 18)
-            f_ch = get_internal_channel(i)
-            color = accent if i == mixer_selected_ch else (200, 200, 200)
-            
-            # Highlight current channel; Green outline if adjusting
-            if i == mixer_selected_ch:
-                if mixer_adjusting:
-                    draw.rectangle((5, y, 235, y+16), outline=(0, 255, 0), width=1)
-                else:
-                    draw.rectangle((5, y, 235, y+16), outline=accent, width=1)
-            
-            name = channel_presets.get(f_ch, f"CH {f_ch}")
-            draw.text((10, y), f"{i}:{name[:10]}", font=font_tiny, fill=color)
-            vol = channel_volumes.get(f_ch, 100)
-            # Volume bar for channel
-            draw.rectangle((150, y+4, 150 + int(vol/1.6), y+12), fill=color)
-
-    # --- MODE: RENAME ---
-    elif operation_mode == "RENAME":
-        draw.text((10, 80), "Rename to:", font=font_tiny, fill=accent)
-        draw.text((10, 105), rename_string + "_", font=font, fill=(0, 255, 0))
-        
-        # Character Picker Box
-        draw.rectangle((100, 150, 140, 190), outline=accent, width=2)
-        draw.text((112, 158), rename_chars[rename_char_idx], font=font, fill=accent)
-
-    # --- MODE: DEFAULT LIST (Main Menu, Files, etc.) ---
-    else:
-        view = 5
-        start = max(0, min(selectedindex - 2, len(files) - view))
-        for i, line in enumerate(files[start:start+view], start=start):
-            y = 62 + (i - start) * 28
-            if i == selectedindex:
-                draw.rectangle([10, y, 230, y+26], fill=accent)
-                draw.text((15, y+2), line[:22], font=font, fill=(0, 0, 0))
-            else:
-                draw.text((15, y+2), line[:22], font=font, fill=accent)
-
-    # 3. Draw Toast Notifications (Overlay)
-    if MESSAGE and now - msg_start_time < 2.0:
-        draw.rectangle((20, 90, 220, 140), fill=(200, 0, 0), outline=(255, 255, 255), width=2)
-        draw.text((35, 105), MESSAGE, font=font_tiny, fill=(255, 255, 255))
-
-    # 4. Push to ST7789
-    disp.display(img)
-
-# ---------------------- MAIN BOOT ----------------------
-def background_init():
-    global midi_manager
-    try:
-        midi_manager = SafeMidiIn(); midi_manager.set_callback(midi_callback)
-        init_buttons(); init_display(); scan_soundfonts(); scan_midifiles()
-        
-        # CHANGE THESE: Use lambda to pass the direction to handle_scroll
-        button_up.when_pressed = lambda: handle_scroll("UP")
-        button_down.when_pressed = lambda: handle_scroll("DOWN")
-        
-        button_select.when_pressed = handle_select
-        button_back.when_pressed = handle_back
-        update_web_state()
-    except: pass
-
-def main():
-    threading.Thread(target=background_init, daemon=True).start()
-    web_counter = 0
-    while True:
-        if not SHUTTING_DOWN:
-            update_display()
-            
-            # Web Command Check
-            cmd_found = False
-            for btn in ["up", "down", "select", "back"]:
-                path = os.path.join(BASE_DIR, f"cmd_{btn}")
-                if os.path.exists(path):
-                    try:
-                        if btn == "up": 
-                            handle_scroll("UP") # Changed from handle_up()
-                        elif btn == "down": 
-                            handle_scroll("DOWN") # Changed from handle_down()
-                        elif btn == "select": 
-                            handle_select()
-                        elif btn == "back": 
-                            handle_back()
-                        cmd_found = True
-                    finally:
-                        try: os.remove(path)
-                        except: pass
-            
-            web_counter += 1
-            # If a command was processed or 0.5s has passed (10 * 0.05)
-            if cmd_found or web_counter >= 10:
-                update_web_state()
-                web_counter = 0
-                
-        time.sleep(0.1)
-
-if __name__ == '__main__':
-    load_mixer()
-
-    main()
+#!/usr/bin/env python3
+import time
+_BOOT_T0 = time.time() # boot timeline origin: the first line we run
+import sys, os, threading, datetime, json, heapq, argparse, bisect, struct
+from collections import deque
+from functools import lru_cache
+import display_backends, metrics
+# Heavy modules (mido, PIL, rtmidi, gpiozero, smbus, fluidsynth) are imported
+# where they're first needed or by a boot step; bench_startup.py guards this.
+
+# --- 1. BOOT ---
+# No fixed settle delay: boot steps run concurrently, see BootOrchestrator.
+
+# --- 2. PATHS (ZOMPLER_HOME lets a desktop run against its own folders) ---
+HOME_DIR = os.environ.get("ZOMPLER_HOME", "/home/pi")
+BASE_DIR = os.path.join(HOME_DIR, "midifileplayer")
+soundfont_folder = os.path.join(HOME_DIR, "sf2")
+midi_file_folder = os.path.join(HOME_DIR, "midifiles")
+mixer_file = os.path.join(BASE_DIR, "mixer_settings.json")
+session_file = os.path.join(BASE_DIR, "session.json")
+sf2_index_file = os.path.join(BASE_DIR, "sf2_index.json")
+
+# Ensure folders exist
+for d in [soundfont_folder, midi_file_folder, BASE_DIR]:
+    if not os.path.exists(d): os.makedirs(d)
+
+# --- 3. CONFIGURATION & STATE ---
+LED_NAME = "ACT"  
+DISPLAY_SPEC = os.environ.get("ZOMPLER_DISPLAY", "st7789,mirror") # see display_backends.py
+SHUTTING_DOWN = False  
+LOW_POWER_MODE = False
+MESSAGE = ""
+msg_start_time = 0
+
+# Navigation & Menu State
+operation_mode = "main screen"
+selectedindex = 0
+files = []
+pathes = []
+MAIN_MENU = ["SOUND FONT", "MIDI FILE", "MIDI KEYBOARD", "MIXER", "METRONOME", "VOLUME", "POWER", "RECORD", "SHUTDOWN"]
+
+# Audio & Volume State
+# Changed 0.5 to 70 (0-100 scale) to match display and scroll logic
+volume_level = 70 
+channel_volumes = {i: 100 for i in range(16)}
+
+# Metronome State
+metronome_on = False
+metro_adjusting = False
+bpm = 120
+metro_vol = 80 # Default MIDI volume (0-127)
+
+# Mixer State
+mixer_selected_ch = 0
+mixer_adjusting = False
+
+# Rename State
+rename_string = ""
+rename_char_idx = 0
+rename_chars = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-OK"
+
+# FluidSynth & MIDI
+midi_manager = None 
+sf2_mapping_cache = {}
+sfid = None # Track loaded SoundFont ID
+selected_file_path = ""
+loaded_sf2_path = ""
+
+# --- MIXER SAVE/LOAD LOGIC ---
+def save_mixer():
+    try:
+        with open(mixer_file, 'w') as f:
+            json.dump(channel_volumes, f)
+    except: pass
+
+def load_mixer():
+    global channel_volumes
+    if os.path.exists(mixer_file):
+        try:
+            with open(mixer_file, 'r') as f:
+                data = json.load(f)
+                channel_volumes = {int(k): v for k, v in data.items()}
+        except: pass
+
+# --- SESSION SNAPSHOT ---
+# Everything needed to be playable straight after boot. Checked after every
+# state change, written (atomically) once it has been stable for a second so
+# scrolling the volume doesn't hammer the SD card.
+SESSION_SAVE_DELAY = 1.0
+_session_saved = None
+_session_dirty_at = 0.0
+
+def session_snapshot():
+    # A font or port that isn't there right now (unplugged, failed load) stays
+    # remembered until something else replaces it
+    saved = _session_saved or {}
+    port = midi_manager.port_name if midi_manager else None
+    return {
+        "sf2": loaded_sf2_path or saved.get("sf2") or "",
+        "midi_port": port or saved.get("midi_port"),
+        "volume": int(volume_level),
+        "bpm": int(bpm),
+        "metro_vol": int(metro_vol),
+        "power_mode": power_mode,
+        "mixer": {str(k): v for k, v in channel_volumes.items()},
+    }
+
+def note_session_change():
+    global _session_dirty_at
+    if _session_saved is not None and session_snapshot() != _session_saved and not _session_dirty_at:
+        _session_dirty_at = time.time()
+
+def flush_session(force=False):
+    global _session_saved, _session_dirty_at
+    if _session_saved is None: return # never loaded; don't clobber the file with defaults
+    if not _session_dirty_at and not force: return
+    if not force and time.time() - _session_dirty_at < SESSION_SAVE_DELAY: return
+    snap = session_snapshot()
+    _session_dirty_at = 0.0
+    if snap == _session_saved: return
+    try:
+        tmp = session_file + ".tmp"
+        with open(tmp, "w") as f: json.dump(snap, f)
+        os.replace(tmp, session_file)
+        _session_saved = snap
+    except Exception as e: print(f"Session save failed: {e}")
+
+def _session_int(data, key, default):
+    # A hand edit or a cut-off write must not keep the engine from booting
+    try: return int(data.get(key, default))
+    except (TypeError, ValueError, OverflowError): return default
+
+def load_session():
+    # Values only; the SF2 and MIDI port are restored by boot steps
+    global volume_level, bpm, metro_vol, power_mode, channel_volumes, _session_saved
+    load_mixer() # older installs only have mixer_settings.json
+    data = {}
+    try:
+        with open(session_file, "r") as f: data = json.load(f)
+    except: pass
+    if not isinstance(data, dict): data = {}
+    volume_level = _session_int(data, "volume", volume_level)
+    bpm = _session_int(data, "bpm", bpm)
+    metro_vol = _session_int(data, "metro_vol", metro_vol)
+    if data.get("power_mode") in POWER_MODES: power_mode = data["power_mode"]
+    mixer = data.get("mixer")
+    if isinstance(mixer, dict):
+        for k, v in mixer.items():
+            try: channel_volumes[int(k)] = int(v)
+            except (TypeError, ValueError, OverflowError): pass
+    _session_saved = data
+    _session_saved = session_snapshot() # normalised, so nothing looks changed yet
+    return data
+
+# ---------------------- RECORDING ENGINE ----------------------
+class MidiRecorder:
+    def __init__(self):
+        self.recording = False
+        self.mid = None
+        self.track = None
+        self.start_time = 0
+        self.last_event_time = 0
+
+    def start(self):
+        import mido
+        self.mid = mido.MidiFile()
+        self.track = mido.MidiTrack()
+        self.mid.tracks.append(self.track)
+        self.recording = True
+        self.start_time = time.time()
+        self.last_event_time = self.start_time
+
+    def stop(self, filename=None):
+        if not self.recording: return
+        self.recording = False
+        if filename:
+            import mido
+            # Properly close MIDI track
+            self.track.append(mido.MetaMessage('end_of_track', time=0))
+            self.mid.save(filename)
+
+    def add_event(self, msg):
+        if self.recording:
+            import mido
+            now = time.time()
+            # Calculate delta time in ticks (assuming 480 TPB and 120 BPM)
+            delta = int(mido.second2tick(now - self.last_event_time, self.mid.ticks_per_beat, 500000))
+            msg.time = delta
+            self.track.append(msg)
+            self.last_event_time = now
+
+recorder = MidiRecorder()
+
+# ---------------------- METRONOME ENGINE ----------------------
+metronome_on = False
+bpm = 120
+metro_vol = 80 
+metro_adjusting = False
+
+tempo = None # TempoSync once booted: clicks then follow the shared beat grid
+
+def metronome_worker():
+    last_beat = None
+    while True:
+        if metronome_on and fs:
+            try:
+                if tempo is not None:
+                    # Sleep to the next beat of the shared timeline instead of
+                    # counting 60/bpm, which drifts and ignores the other boxes
+                    beat, t = tempo.next_beat()
+                    if last_beat is not None and beat <= last_beat:
+                        beat, t = last_beat + 1, tempo.time_at(last_beat + 1)
+                    wait = t - time.monotonic()
+                    if wait > 0.25: time.sleep(0.25); continue # re-read tempo/transport
+                    if wait > 0: time.sleep(wait)
+                    last_beat = beat
+                fs.noteon(9, 76, 110) 
+                time.sleep(0.05)
+                fs.noteoff(9, 76)
+                if tempo is None: time.sleep(max(0.01, (60.0 / bpm) - 0.05))
+            except: time.sleep(0.1)
+        else:
+            last_beat = None
+            time.sleep(0.2)
+
+threading.Thread(target=metronome_worker, daemon=True).start()
+
+# ---------------------- WAVESHARE UPS (C) ----------------------
+class RollingMedian:
+    # Median of the last `size` samples in O(log n) per sample: the low half
+    # in a max-heap, the high half in a min-heap, expired samples dropped
+    # lazily when they reach a heap top.
+    def __init__(self, size=20):
+        self.size = size
+        self.window = deque() # sample ids in arrival order
+        self.lo, self.hi = [], [] # lo holds (-value, id), hi holds (value, id)
+        self.side = {} # id -> the heap it currently lives in
+        self.n_lo = self.n_hi = 0
+        self.seq = 0
+
+    def _prune(self, heap):
+        while heap and heap[0][1] not in self.side: heapq.heappop(heap)
+
+    def add(self, value):
+        self.seq += 1; s = self.seq
+        self._prune(self.lo)
+        if not self.lo or value <= -self.lo[0][0]:
+            heapq.heappush(self.lo, (-value, s)); self.side[s] = self.lo; self.n_lo += 1
+        else:
+            heapq.heappush(self.hi, (value, s)); self.side[s] = self.hi; self.n_hi += 1
+        self.window.append(s)
+        if len(self.window) > self.size:
+            if self.side.pop(self.window.popleft()) is self.lo: self.n_lo -= 1
+            else: self.n_hi -= 1
+        # Keep n_lo == n_hi or n_hi + 1
+        while self.n_lo > self.n_hi + 1:
+            self._prune(self.lo)
+            v, i = heapq.heappop(self.lo)
+            heapq.heappush(self.hi, (-v, i)); self.side[i] = self.hi
+            self.n_lo -= 1; self.n_hi += 1
+        while self.n_hi > self.n_lo:
+            self._prune(self.hi)
+            v, i = heapq.heappop(self.hi)
+            heapq.heappush(self.lo, (-v, i)); self.side[i] = self.lo
+            self.n_hi -= 1; self.n_lo += 1
+        self._prune(self.lo); self._prune(self.hi)
+        # Dead entries buried below the tops: rebuild once in a while
+        if len(self.lo) + len(self.hi) > 4 * self.size:
+            self.lo = [e for e in self.lo if e[1] in self.side]; heapq.heapify(self.lo)
+            self.hi = [e for e in self.hi if e[1] in self.side]; heapq.heapify(self.hi)
+            for e in self.lo: self.side[e[1]] = self.lo
+            for e in self.hi: self.side[e[1]] = self.hi
+
+    def median(self):
+        # Upper median for even counts, like sorted(readings)[n // 2]
+        if not self.n_lo: return 0.0
+        return -self.lo[0][0] if self.n_lo > self.n_hi else self.hi[0][0]
+
+class FakeSMBus:
+    # Stand-in INA219 so the sampler runs without hardware (ZOMPLER_FAKE_UPS=1).
+    # Set .voltage and .current_ma (negative = discharging) to drive it.
+    def __init__(self, voltage=3.9, current_ma=-450.0):
+        self.voltage = voltage; self.current_ma = current_ma
+    def read_word_data(self, addr, reg):
+        if reg == 0x02: raw = (int(self.voltage / 0.004) << 3) & 0xFFFF
+        elif reg == 0x01: raw = int(self.current_ma) & 0xFFFF
+        else: raw = 0
+        return ((raw << 8) & 0xFF00) | ((raw >> 8) & 0x00FF) # SMBus words are little-endian
+
+class UPS_C:
+    # LiPo open-circuit voltage -> state of charge (0-1)
+    SOC_CURVE = [(3.27, 0.0), (3.61, 0.05), (3.69, 0.10), (3.73, 0.20), (3.77, 0.30), (3.80, 0.40),
+                 (3.84, 0.50), (3.87, 0.60), (3.95, 0.70), (4.02, 0.80), (4.11, 0.90), (4.20, 1.0)]
+    CAPACITY_MAH = 1000 # UPS HAT (C) cell
+    R_INTERNAL = 0.15 # ohm, undoes voltage sag under load
+    SHUNT_MA_PER_LSB = 1.0 # 10 uV LSB across the 0.01 ohm shunt
+
+    def __init__(self, addr=0x43, bus=None, interval=2.0):
+        self.bus = bus; self.addr = addr; self.interval = interval
+        self.median = RollingMedian(20)
+        self.voltage = 0.0; self.current_ma = 0.0; self.draw_ma = 0.0
+        self.time_left = "0:00"; self.minutes_left = 0.0
+        if self.bus is None:
+            try:
+                import smbus
+                self.bus = smbus.SMBus(1)
+            except: pass
+        if self.bus:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _read(self, reg):
+        read = self.bus.read_word_data(self.addr, reg)
+        return ((read << 8) & 0xFF00) | ((read >> 8) & 0x00FF)
+
+    def sample(self):
+        # One INA219 read of bus voltage and shunt current; everything else is cached
+        v = (self._read(0x02) >> 3) * 0.004
+        raw = self._read(0x01)
+        i = (raw - 0x10000 if raw & 0x8000 else raw) * self.SHUNT_MA_PER_LSB
+        self.median.add(v)
+        self.voltage = self.median.median()
+        self.current_ma = i
+        # Discharge rate: ~1 minute moving average of the current being drawn
+        alpha = min(1.0, self.interval / 60.0)
+        draw = max(0.0, -i)
+        self.draw_ma = draw if self.draw_ma == 0.0 else self.draw_ma + alpha * (draw - self.draw_ma)
+        self.time_left = self._estimate()
+
+    def _run(self):
+        while True:
+            try: self.sample()
+            except: pass
+            time.sleep(self.interval)
+
+    def _soc(self, v):
+        curve = self.SOC_CURVE
+        if v <= curve[0][0]: return 0.0
+        for (v0, s0), (v1, s1) in zip(curve, curve[1:]):
+            if v <= v1: return s0 + (s1 - s0) * (v - v0) / (v1 - v0)
+        return 1.0
+
+    def _estimate(self):
+        v = self.voltage
+        if v < 3.0:
+            self.minutes_left = 0.0
+            return "0:00"
+        if self.draw_ma > 20:
+            soc = self._soc(v + self.draw_ma / 1000.0 * self.R_INTERNAL)
+            total_minutes = soc * self.CAPACITY_MAH / self.draw_ma * 60
+        else:
+            # Charging or no current reading: fall back to the voltage profile
+            p = max(0, min(1, (v - 3.4) / (4.15 - 3.4)))
+            total_minutes = p * (450 if LOW_POWER_MODE else 240)
+        self.minutes_left = total_minutes
+        return f"{int(total_minutes // 60)}:{int(total_minutes % 60):02d}"
+
+    def get_voltage(self):
+        return self.voltage
+
+    def get_time_left(self):
+        return self.time_left
+
+ups = UPS_C(bus=FakeSMBus() if os.environ.get("ZOMPLER_FAKE_UPS") else None)
+
+# ---------------------- UI MENU CONFIG ----------------------
+MAIN_MENU = ["MIDI KEYBOARD", "SOUND FONT", "MIDI FILE", "MIXER", "RECORD", "METRONOME", "VOLUME", "POWER", "SHUTDOWN"]
+files = MAIN_MENU.copy()
+pathes = MAIN_MENU.copy()
+selectedindex = 0
+operation_mode = "main screen"
+selected_file_path = ""
+rename_string = ""
+rename_chars = [" ", "A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y", "Z", "a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "_", "-", "OK"]
+rename_char_idx = 0
+mixer_selected_ch = 0
+mixer_adjusting = False
+channel_presets = {}
+
+# ---------------------- HARDWARE INITIALIZATION ----------------------
+fs = None; sfid = None; loaded_sf2_path = None; display = None
+img = draw = font = font_tiny = None
+_last_display_time = 0.0
+soundfont_paths, soundfont_names = [], []; midi_paths, midi_names = [], []
+
+def init_buttons():
+    global button_up, button_down, button_select, button_back
+    from gpiozero import Button
+    button_up, button_down = Button(16), Button(24)
+    button_select, button_back = Button(5), Button(6)
+
+def init_display(spec=None):
+    global display, img, draw, font, font_tiny
+    try:
+        display = display_backends.make_backend(spec or DISPLAY_SPEC)
+        # Null backend: never build a frame, update_display returns at once
+        if not display.renders:
+            print("Display Initialization Skipped (Headless Mode Active)")
+            return
+        from PIL import Image, ImageDraw, ImageFont
+        img = Image.new("RGB", (240, 240), (0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        try: 
+            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 18)
+            font_tiny = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 14)
+        except: 
+            font = ImageFont.load_default(); font_tiny = ImageFont.load_default()
+    except Exception as e:
+        # Missing hardware/libs: run without a screen rather than crash the loop
+        print(f"Display Init Failed: {e}")
+        display = None; draw = None
+
+_synth_lock = threading.Lock()
+
+def init_fluidsynth_lazy():
+    global fs
+    # Boot warm-up and a SOUND FONT pick can race here; only one creates it
+    with _synth_lock:
+        _init_fluidsynth()
+
+def _init_fluidsynth():
+    global fs
+    if fs is None:
+        try:
+            import fluidsynth as fs_lib
+            fs = fs_lib.Synth()
+            
+            # --- VOLUME CORRECTION ---
+            # Converts 0-100 scale back to 0.0-1.0 for FluidSynth
+            fs.setting('synth.gain', volume_level / 100.0)
+            
+            # Performance Settings
+            fs.setting('player.timing-source', 'sample')
+            fs.setting('synth.cpu-cores', 4) # Take advantage of Pi's cores
+            fs.setting('audio.alsa.device', 'default')
+            
+            # Start the driver
+            # Note: driver name can be "alsa", "pulse", or "jack" depending on your OS setup
+            fs.start(driver="alsa")
+            
+            # Initialize Metronome Volume (Internal Channel 9 / MIDI Ch 10)
+            # This ensures the metronome starts at your saved metro_vol level
+            fs.cc(9, 7, metro_vol)
+            
+            # Start with whatever the power governor currently wants
+            apply_power_profile(force=True)
+            
+        except Exception as e: 
+            print(f"Synth Init Fail: {e}")
+# ---------------------- SYNTH PROBES ----------------------
+# pyfluidsynth doesn't wrap these, so call libfluidsynth through its handle.
+# Extra arguments are (ctype, value) pairs after the synth pointer.
+_fl_funcs = {}
+
+def _fl_call(name, restype, *args):
+    import ctypes
+    fn = _fl_funcs.get(name)
+    if fn is None:
+        import fluidsynth as fs_lib
+        fn = getattr(fs_lib._fl, name)
+        fn.restype = restype; fn.argtypes = [ctypes.c_void_p] + [t for t, _ in args]
+        _fl_funcs[name] = fn
+    return fn(fs.synth, *[v for _, v in args])
+
+def synth_voice_count():
+    if fs is None: return 0
+    try:
+        import ctypes
+        return int(_fl_call("fluid_synth_get_active_voice_count", ctypes.c_int))
+    except: return 0
+
+def synth_cpu_load():
+    # Percent of the audio period spent rendering (0-100+)
+    if fs is None: return 0.0
+    try:
+        import ctypes
+        return float(_fl_call("fluid_synth_get_cpu_load", ctypes.c_double))
+    except: return 0.0
+
+# ---------------------- POWER GOVERNOR ----------------------
+# Picks a profile from synth load, MIDI activity and battery, every couple of
+# seconds. Stepping up is immediate (a note wakes it), stepping down waits
+# GOVERNOR_HOLD seconds. POWER in the menu cycles AUTO -> ECO -> MAX.
+POWER_PROFILES = {
+    "PERF": {"governor": "performance", "polyphony": 96, "effects": True,  "display": 0.06, "led": "mmc0", "eco": False},
+    "PLAY": {"governor": "ondemand",    "polyphony": 96, "effects": True,  "display": 0.06, "led": "mmc0", "eco": False},
+    "IDLE": {"governor": "powersave",   "polyphony": 64, "effects": False, "display": 0.15, "led": "mmc0", "eco": True},
+    "ECO":  {"governor": "powersave",   "polyphony": 48, "effects": False, "display": 0.15, "led": "none", "eco": True},
+}
+PROFILE_RANK = {"ECO": 0, "IDLE": 1, "PLAY": 2, "PERF": 3}
+POWER_MODES = ["AUTO", "ECO", "MAX"]
+GOVERNOR_INTERVAL = 2.0
+GOVERNOR_HOLD = 10.0 # seconds a lower profile must be wanted before switching down
+IDLE_AFTER = 60.0 # seconds without MIDI and voices before IDLE
+LOW_BATTERY_MINUTES = 30
+CPU_GOVERNOR_PATH = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor"
+POWER_LOG = os.path.join(BASE_DIR, "power_log.csv")
+
+power_mode = "AUTO"
+power_profile = "PLAY"
+DISPLAY_INTERVAL = 0.06
+last_midi_time = time.time()
+_applied_profile = None
+_profile_wanted_since = 0.0
+_governor_wake = threading.Event()
+_sysfs_denied = set()
+
+def write_sysfs(path, value):
+    # Direct write, no shell. Needs a udev rule or root; complain once per file.
+    try:
+        with open(path, "w") as f: f.write(value)
+        return True
+    except OSError as e:
+        if path not in _sysfs_denied:
+            _sysfs_denied.add(path); print(f"Power: can't write {path}: {e}")
+        return False
+
+def choose_power_profile(now, voices, load, battery_minutes):
+    if power_mode == "ECO": return "ECO", "manual"
+    if power_mode == "MAX": return "PERF", "manual"
+    if 0 < battery_minutes < LOW_BATTERY_MINUTES: return "ECO", "battery"
+    if load > 60: return "PERF", "load"
+    if voices > 0 or now - last_midi_time < IDLE_AFTER: return "PLAY", "active"
+    return "IDLE", "idle"
+
+def apply_power_profile(force=False):
+    global _applied_profile, LOW_POWER_MODE, DISPLAY_INTERVAL
+    p = POWER_PROFILES[power_profile]
+    if force or _applied_profile != power_profile:
+        write_sysfs(CPU_GOVERNOR_PATH, p["governor"])
+        write_sysfs(f"/sys/class/leds/{LED_NAME}/trigger", p["led"])
+        LOW_POWER_MODE = p["eco"]
+        DISPLAY_INTERVAL = p["display"]
+        invalidate_display() # accent colour follows the profile
+    apply_synth_settings(force)
+    _applied_profile = power_profile
+
+def log_power_transition(old, new, reason, voices, load, idle):
+    try:
+        new_file = not os.path.exists(POWER_LOG)
+        with open(POWER_LOG, "a") as f:
+            if new_file: f.write("time,from,to,reason,voices,cpu_load,idle_s,battery_min,voltage,current_ma\n")
+            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')},{old},{new},{reason},{voices},{load:.1f},{idle:.0f},"
+                    f"{ups.minutes_left:.0f},{ups.get_voltage():.3f},{ups.current_ma:.0f}\n")
+    except: pass
+
+def governor_step(now=None):
+    global power_profile, _profile_wanted_since
+    now = now or time.time()
+    voices, load = synth_voice_count(), synth_cpu_load()
+    # The switch and its publish go through ENGINE_LOCK like any handler
+    with ENGINE_LOCK:
+        want, reason = choose_power_profile(now, voices, load, ups.minutes_left)
+        if want == power_profile:
+            _profile_wanted_since = now
+            return
+        # Up right away, down only after the lower profile was wanted for a while
+        stepping_down = PROFILE_RANK[want] < PROFILE_RANK[power_profile]
+        if stepping_down and reason != "manual" and now - _profile_wanted_since < GOVERNOR_HOLD:
+            return
+        log_power_transition(power_profile, want, reason, voices, load, now - last_midi_time)
+        power_profile = want
+        _profile_wanted_since = now
+        apply_power_profile()
+        update_web_state()
+
+def governor_worker():
+    while True:
+        try: governor_step()
+        except Exception as e: print(f"Governor Error: {e}")
+        _governor_wake.wait(GOVERNOR_INTERVAL)
+        _governor_wake.clear()
+
+def note_midi_activity():
+    global last_midi_time
+    last_midi_time = time.time()
+    # Coming out of IDLE/ECO should not wait for the next governor tick
+    if power_profile == "IDLE": _governor_wake.set()
+
+# ---------------------- DSP BUDGET ----------------------
+# Guards against xruns: samples synth CPU load and voice count 4x a second.
+# Sustained overload steps the level up (effects off, fewer voices, cheaper
+# interpolation); it steps back down only after a quiet stretch, so it does
+# not flap. The governor profile is the ceiling, the level cuts below it.
+DSP_LEVELS = [
+    {"effects": True,  "polyphony": 1.0,  "interp": 4}, # 0: full (4th order interpolation)
+    {"effects": False, "polyphony": 1.0,  "interp": 4}, # 1: reverb/chorus off
+    {"effects": False, "polyphony": 0.66, "interp": 4}, # 2: fewer voices
+    {"effects": False, "polyphony": 0.5,  "interp": 1}, # 3: half the voices, linear interpolation
+]
+DSP_SAMPLE_INTERVAL = 0.25
+DSP_OVERLOAD = 80.0 # % load above which...
+DSP_OVERLOAD_SECONDS = 1.0 # ...for this long we step up
+DSP_RECOVER = 45.0 # % load below which...
+DSP_RECOVER_SECONDS = 5.0 # ...for this long we step down
+dsp_level = 0
+dsp_load = 0.0
+dsp_voices = 0
+_dsp_history = deque(maxlen=int(DSP_RECOVER_SECONDS / DSP_SAMPLE_INTERVAL))
+_dsp_changed_at = 0.0
+_synth_applied = {}
+
+def apply_synth_settings(force=False):
+    # Only touches settings whose value changed since last time
+    if fs is None: return
+    import ctypes
+    p, d = POWER_PROFILES[power_profile], DSP_LEVELS[dsp_level]
+    want = {"polyphony": max(16, int(p["polyphony"] * d["polyphony"])),
+            "effects": p["effects"] and d["effects"],
+            "interp": d["interp"]}
+    for key, value in want.items():
+        if not force and _synth_applied.get(key) == value: continue
+        try:
+            if key == "polyphony":
+                fs.setting('synth.polyphony', value)
+            elif key == "effects":
+                fs.setting('synth.reverb.active', int(value))
+                fs.setting('synth.chorus.active', int(value))
+            elif key == "interp":
+                _fl_call("fluid_synth_set_interp_method", ctypes.c_int, (ctypes.c_int, -1), (ctypes.c_int, value))
+            _synth_applied[key] = value
+        except Exception as e: print(f"DSP: can't set {key}: {e}")
+
+def dsp_budget_step(now=None):
+    global dsp_level, dsp_load, dsp_voices, _dsp_changed_at
+    now = now or time.time()
+    dsp_load, dsp_voices = synth_cpu_load(), synth_voice_count()
+    _dsp_history.append(dsp_load)
+    n_over = int(DSP_OVERLOAD_SECONDS / DSP_SAMPLE_INTERVAL)
+    recent = list(_dsp_history)[-n_over:]
+    level = dsp_level
+    if dsp_level < len(DSP_LEVELS) - 1 and len(recent) == n_over and min(recent) > DSP_OVERLOAD:
+        level += 1
+    elif dsp_level > 0 and len(_dsp_history) == _dsp_history.maxlen and max(_dsp_history) < DSP_RECOVER:
+        level -= 1
+    if level == dsp_level: return
+    print(f"DSP budget {dsp_level} -> {level} (load {dsp_load:.0f}%, {dsp_voices} voices)")
+    _dsp_history.clear() # judge the new level on fresh samples only
+    # Sampling stays unlocked; the synth change races user-driven ones otherwise
+    with ENGINE_LOCK:
+        dsp_level = level
+        _dsp_changed_at = now
+        apply_synth_settings()
+        invalidate_display()
+        update_web_state()
+
+def dsp_budget_worker():
+    while True:
+        if fs is not None:
+            try: dsp_budget_step()
+            except Exception as e: print(f"DSP Budget Error: {e}")
+        time.sleep(DSP_SAMPLE_INTERVAL)
+
+def toggle_power_mode():
+    global power_mode
+    power_mode = POWER_MODES[(POWER_MODES.index(power_mode) + 1) % len(POWER_MODES)]
+    set_message(f"Power: {power_mode}")
+    _governor_wake.set()
+
+# ---------------------- LATENCY METRICS ----------------------
+# One histogram per hot-path stage (metrics.py); web_app serves them at /metrics
+MIDI_NOTE_TIME = metrics.histogram("zompler_midi_note_seconds", "MIDI callback entry to fs.noteon return")
+COMMAND_TIME = metrics.histogram("zompler_command_seconds", "Command arrival to handler completion, state published")
+WEB_STATE_TIME = metrics.histogram("zompler_web_state_seconds", "update_web_state duration")
+RENDER_TIME = metrics.histogram("zompler_display_render_seconds", "update_display drawing, per redraw")
+PUSH_TIME = metrics.histogram("zompler_display_push_seconds", "Display push of the changed regions (SPI)")
+
+# ---------------------- MIDI ENGINE LOGIC ----------------------
+def get_internal_channel(monkey_ch): 
+    return 9 if monkey_ch == 0 else monkey_ch - 1
+
+# Preset index: sf2utils parses the whole RIFF tree, seconds on the Pi for a
+# big font. The result is kept per file name in sf2_index.json and reused
+# while size and mtime match, so only new or changed fonts are parsed.
+_sf2_index = None
+_sf2_index_lock = threading.Lock()
+
+def _sf2_stamp(sf2_path):
+    st = os.stat(sf2_path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _load_sf2_index():
+    global _sf2_index
+    if _sf2_index is None:
+        try:
+            with open(sf2_index_file, "r") as f: _sf2_index = json.load(f)
+        except: _sf2_index = {}
+    return _sf2_index
+
+def index_sf2(sf2_path, force=False):
+    # {(bank, preset): name} for one file, parsed only if the index is stale
+    with _sf2_index_lock:
+        index = _load_sf2_index()
+        key = os.path.basename(sf2_path)
+        stamp = _sf2_stamp(sf2_path)
+        entry = index.get(key)
+        if entry and entry.get("stamp") == stamp and not force:
+            return {(b, pr): n for b, pr, n in entry["presets"]}
+    from sf2utils.sf2parse import Sf2File
+    with open(sf2_path, 'rb') as f:
+        sf2 = Sf2File(f)
+        mapping = {}
+        for p in sf2.presets:
+            b = getattr(p, 'bank', getattr(getattr(p, 'header', object()), 'bank', 0))
+            pr = getattr(p, 'preset', getattr(getattr(p, 'header', object()), 'preset', 0))
+            mapping[(b, pr)] = p.name
+    with _sf2_index_lock:
+        index = _load_sf2_index()
+        index[key] = {"stamp": stamp, "presets": [[b, pr, n] for (b, pr), n in sorted(mapping.items())]}
+        # Forget fonts that are gone
+        for k in [k for k in index if not os.path.exists(os.path.join(soundfont_folder, k))]: del index[k]
+        try:
+            tmp = sf2_index_file + ".tmp"
+            with open(tmp, "w") as f: json.dump(index, f)
+            os.replace(tmp, sf2_index_file)
+        except: pass
+    return mapping
+
+def build_sf2_preset_map(sf2_path):
+    global sf2_mapping_cache
+    if not sf2_path or not os.path.exists(sf2_path):
+        return {}, False
+    try:
+        mapping = index_sf2(sf2_path)
+        sf2_mapping_cache = mapping
+        return mapping, True
+    except:
+        return {}, False
+
+def select_first_presets_for_monkey():
+    global channel_presets, sfid, fs, loaded_sf2_path, sf2_mapping_cache
+    if sfid is None or fs is None or not loaded_sf2_path: return
+    
+    # Force a fresh scan if cache is empty
+    mapping, ok = build_sf2_preset_map(loaded_sf2_path)
+        
+    channel_presets.clear() 
+    if ok and mapping:
+        # Find all available banks
+        available_banks = sorted(list(set(bank for bank, prog in mapping.keys())))
+        # Use first available bank if 0 isn't there
+        main_bank = 0 if 0 in available_banks else (available_banks[0] if available_banks else 0)
+        
+        # --- DRUMS (Monkey 0 -> MIDI Ch 10) ---
+        drum_bank = 128 if 128 in available_banks else (127 if 127 in available_banks else main_bank)
+        fs.program_select(9, sfid, drum_bank, 0)
+        channel_presets[9] = mapping.get((drum_bank, 0), "Drums")
+
+        # --- INSTRUMENTS (Monkey 1-9 -> MIDI Ch 1-9) ---
+        # Get all presets in our main bank
+        bank_presets = sorted([p for b, p in mapping.keys() if b == main_bank])
+        
+        for m_ch in range(1, 10):
+            f_ch = m_ch - 1 # Internal index
+            # Pick the next available preset in the bank
+            prog = bank_presets[m_ch-1] if len(bank_presets) >= m_ch else 0
+            fs.program_select(f_ch, sfid, main_bank, prog)
+            channel_presets[f_ch] = mapping.get((main_bank, prog), f"Patch {prog}")
+    else:
+        # Emergency Fallback if sf2utils failed
+        for i in range(16): channel_presets[i] = "Generic Patch"
+    
+    publish_state()
+
+def load_soundfont(path):
+    global sfid, loaded_sf2_path
+    try:
+        init_fluidsynth_lazy()
+        # Unload the old SF2 first to free RAM
+        if sfid is not None: fs.sfunload(sfid)
+        loaded_sf2_path = path
+        sfid = fs.sfload(loaded_sf2_path, True)
+        select_first_presets_for_monkey()
+        set_message("SF2 LOADED")
+        return True
+    except Exception as e:
+        set_message("Load Failed")
+        print(f"SF2 Error: {e}")
+        return False
+
+def apply_mixer_to_synth():
+    # CC7 per channel survives program changes, so once after synth start is enough
+    if fs is None: return
+    for ch, vol in channel_volumes.items(): fs.cc(ch, 7, vol)
+    fs.cc(9, 7, metro_vol) # click channel keeps its own level, as in init
+
+class SafeMidiIn:
+    def __init__(self):
+        import rtmidi as rt_lib
+        self.midiin = rt_lib.MidiIn(); self.port_name = None; self.callback = None
+    def set_callback(self, cb):
+        self.callback = cb
+        if self.midiin.is_port_open(): self.midiin.set_callback(self._cb)
+    def _cb(self, msg, ts):
+        if self.callback: self.callback(msg, ts)
+    def open_port_by_name_async(self, name):
+        def t():
+            ports = self.midiin.get_ports()
+            if name in ports:
+                if self.midiin.is_port_open(): self.midiin.close_port()
+                self.midiin.open_port(ports.index(name))
+                self.midiin.set_callback(self._cb); self.port_name = name
+                set_message("MIDI Connected")
+        threading.Thread(target=t, daemon=True).start()
+    def list_ports(self): return self.midiin.get_ports()
+
+def midi_callback(message_data, timestamp):
+    global sf2_mapping_cache, sfid, channel_presets, fs, loaded_sf2_path
+    t0 = time.perf_counter()
+    message, _ = message_data
+    status = message[0] & 0xF0
+    ch = message[0] & 0x0F
+    n1 = message[1] if len(message) > 1 else 0
+    n2 = message[2] if len(message) > 2 else 0
+
+    note_midi_activity()
+
+    if recorder.recording:
+        try:
+            import mido
+            mido_msg = mido.Message.from_bytes(bytes(message))
+            recorder.add_event(mido_msg)
+        except: pass
+
+    if not fs: return
+
+    if status == 0x90 and n2 > 0: fs.noteon(ch, n1, n2); MIDI_NOTE_TIME.since(t0)
+    elif status == 0x90 or status == 0x80: fs.noteoff(ch, n1)
+    elif status == 0xB0: 
+        fs.cc(ch, n1, n2)
+        if n1 == 7:
+            channel_volumes[ch] = n2 # Sync volume if keyboard sends CC7
+            if operation_mode == "MIXER": invalidate_display()
+    elif status == 0xE0: fs.pitch_bend(ch, (n2 << 7) + n1 - 8192)
+    elif status == 0xC0:
+        bank = 128 if ch == 9 else 0
+        if sfid is not None:
+            fs.program_select(ch, sfid, bank, n1)
+            name = sf2_mapping_cache.get((bank, n1), f"Patch {n1}")
+            channel_presets[ch] = name
+            publish_state()
+
+def scan_soundfonts():
+    global soundfont_paths, soundfont_names
+    p, l = [], []
+    if os.path.isdir(soundfont_folder):
+        for f in sorted(os.listdir(soundfont_folder)):
+            if f.endswith('.sf2'): p.append(os.path.join(soundfont_folder, f)); l.append(f.replace('.sf2', ''))
+    soundfont_paths, soundfont_names = p, l
+
+def scan_midifiles():
+    global midi_paths, midi_names
+    p, l = [], []
+    if os.path.isdir(midi_file_folder):
+        for f in sorted(os.listdir(midi_file_folder)):
+            if f.endswith('.mid'): p.append(os.path.join(midi_file_folder, f)); l.append(f.replace('.mid', ''))
+    midi_paths, midi_names = p, l
+
+# ---------------------- TRANSPORT ----------------------
+def play_midi_file(path):
+    # aplaymidi into FluidSynth's ALSA sequencer port
+    global _pending_play
+    if not sfid: 
+        set_message("LOAD SF2 FIRST")
+    else:
+        import subprocess
+        try:
+            # 1. Kill old processes
+            if _pending_play: _pending_play.cancel()
+            subprocess.run(["pkill", "-9", "aplaymidi"], capture_output=True)
+            
+            # 2. Reset synth
+            if fs:
+                for i in range(16): 
+                    fs.all_sounds_off(i)
+            
+            # 3. Robust Port Discovery
+            target_port = None
+            try:
+                port_data = subprocess.check_output(['aplaymidi', '-l']).decode()
+                for line in port_data.split('\n'):
+                    if "FLUID Synth" in line:
+                        # This splits the line and takes the first part (e.g., '128:0')
+                        target_port = line.strip().split(' ')[0]
+                        break
+            except:
+                target_port = "128:0" # Fallback if -l fails
+
+            if not target_port:
+                target_port = "128:0"
+
+            # 4. Start playback
+            # Added 'str()' and check if file exists
+            if os.path.exists(path):
+                cmd = ["aplaymidi", "--port", target_port, str(path)]
+                if tempo is not None and tempo.stats()["peers"]:
+                    # Other boxes in the session: start on the shared bar line
+                    _pending_play = threading.Timer(tempo.until_bar(), subprocess.Popen, [cmd])
+                    _pending_play.start()
+                else:
+                    subprocess.Popen(cmd)
+                set_message("Playing")
+            else:
+                set_message("File Not Found")
+            
+        except Exception as e:
+            print(f"CRITICAL PLAY ERROR: {e}") # This shows in your terminal/logs
+            set_message("Play Error")
+
+_pending_play = None # play_midi_file's start, waiting for the bar line
+
+def stop_playback():
+    import subprocess
+    if _pending_play: _pending_play.cancel()
+    subprocess.run(["pkill", "-9", "aplaymidi"], capture_output=True)
+    if fs:
+        for i in range(16): 
+            fs.all_sounds_off(i)
+        select_first_presets_for_monkey()
+    set_message("Stopped")
+
+def set_recording(on):
+    if on and not recorder.recording:
+        recorder.start(); set_message("Recording...")
+    elif not on and recorder.recording:
+        ts = datetime.datetime.now().strftime("%H%M%S")
+        path = os.path.join(midi_file_folder, f"rec_{ts}.mid")
+        recorder.stop(path); set_message("Saved Rec"); scan_midifiles()
+
+# ---------------------- BUTTON HANDLERS ----------------------
+def handle_back():
+    global operation_mode, files, pathes, selectedindex, rename_string, mixer_adjusting, metro_adjusting
+    if operation_mode == "MIXER":
+        if mixer_adjusting: mixer_adjusting = False; publish_state(); return
+        else: save_mixer() 
+    if operation_mode == "METRONOME" and metro_adjusting: metro_adjusting = False; publish_state(); return
+    
+    if operation_mode == "RENAME":
+        if len(rename_string) > 0: 
+            rename_string = rename_string[:-1]
+        else: 
+            operation_mode = "FILE ACTION"
+            files = FILE_ACTIONS.copy()
+            selectedindex = 2 # Highlight RENAME so you know where you came from
+    elif operation_mode == "FILE ACTION":
+        operation_mode = "MIDI FILE"
+        scan_midifiles()
+        files, pathes = midi_names.copy(), midi_paths.copy()
+        selectedindex = 0
+    else:
+        operation_mode = "main screen"
+        files = MAIN_MENU.copy()
+        selectedindex = 0
+    publish_state()
+    
+def handle_scroll(direction, steps=1):
+    # steps > 1 applies a whole burst (held button, queued presses) at once
+    global selectedindex, operation_mode, volume_level, bpm, rename_char_idx
+    global mixer_selected_ch, mixer_adjusting, metro_vol, metro_adjusting
+    move = -steps if direction == "UP" else steps # list position
+    amount = -move # value change: UP raises
+
+    # --- 1. NAVIGATION MODES (Main Menu & File Lists) ---
+    if operation_mode in ["main screen", "SOUND FONT", "MIDI FILE", "MIDI KEYBOARD", "FILE ACTION"]:
+        if files: selectedindex = (selectedindex + move) % len(files)
+
+    # --- 2. VOLUME MODE (Master Gain) ---
+    elif operation_mode == "VOLUME":
+        volume_level = max(0, min(100, volume_level + 5 * amount))
+        if fs:
+            fs.setting('synth.gain', volume_level / 100.0)
+
+    # --- 3. METRONOME MODE (Toggle, BPM, and Click Vol) ---
+    elif operation_mode == "METRONOME":
+        if not metro_adjusting:
+            # Scroll through the 3 rows: [0: Status, 1: BPM, 2: Vol]
+            selectedindex = (selectedindex + move) % 3
+        else:
+            # Adjust the actual values of the selected row
+            if selectedindex == 1: # BPM Row
+                bpm = max(40, min(250, bpm + 2 * amount))
+            elif selectedindex == 2: # Metronome Volume Row
+                metro_vol = max(0, min(127, metro_vol + 5 * amount))
+                if fs:
+                    fs.cc(9, 7, metro_vol)
+
+    # --- 4. MIXER MODE (Channel Volumes) ---
+    elif operation_mode == "MIXER":
+        if not mixer_adjusting:
+            # Choose which of the 10 channels to look at
+            mixer_selected_ch = (mixer_selected_ch + move) % 10
+        else:
+            # Adjust the volume of the chosen channel
+            f_ch = get_internal_channel(mixer_selected_ch)
+            vol = max(0, min(127, channel_volumes.get(f_ch, 100) + 5 * amount))
+            channel_volumes[f_ch] = vol
+            if fs:
+                fs.cc(f_ch, 7, vol)
+
+    # --- 5. RENAME MODE (Letter Picker) ---
+    elif operation_mode == "RENAME":
+        rename_char_idx = (rename_char_idx + move) % len(rename_chars)
+
+    # Always sync to the screen and web app/phone after a scroll
+    publish_state()
+    
+def handle_select():
+    global operation_mode, files, pathes, selectedindex
+    global fs, sfid, SHUTTING_DOWN, rename_string, rename_char_idx
+    global mixer_adjusting, selected_file_path, loaded_sf2_path, metronome_on, metro_adjusting
+    global volume_level, bpm, metro_vol
+
+    # --- 1. SPECIAL MODES (Mixer & Metronome) ---
+    if operation_mode == "MIXER": 
+        mixer_adjusting = not mixer_adjusting
+        publish_state()
+        return
+        
+    if operation_mode == "METRONOME":
+        if selectedindex == 0: 
+            metronome_on = not metronome_on
+            set_message("Metro: " + ("ON" if metronome_on else "OFF"))
+        else: 
+            # Toggles between "moving the cursor" and "changing the value"
+            metro_adjusting = not metro_adjusting
+            set_message("ADJUSTING..." if metro_adjusting else "CONFIRMED")
+        
+        publish_state()
+        return
+
+    # --- 2. VOLUME MODE ---
+    elif operation_mode == "VOLUME":
+        operation_mode = "main screen"
+        files = MAIN_MENU.copy()
+        selectedindex = MAIN_MENU.index("VOLUME") # Return focus to where we came from
+        set_message(f"Master: {int(volume_level)}%")
+        publish_state()
+        return
+        
+    # --- 3. VALIDATION ---
+    if not files and operation_mode != "RENAME": return
+    if operation_mode != "RENAME": sel = files[selectedindex]
+    
+    # --- 4. MAIN MENU LOGIC ---
+    if operation_mode == "main screen":
+        # Handle simple mode switches first
+        if sel in ["MIXER", "METRONOME", "VOLUME"]:
+            operation_mode = sel
+            selectedindex = 0
+            publish_state()
+            return
+        
+        if sel == "POWER": toggle_power_mode(); return
+
+        if sel == "RECORD":
+            set_recording(not recorder.recording)
+            publish_state(); return
+        
+        if sel == "SHUTDOWN":
+            SHUTTING_DOWN = True
+            if draw is not None:
+                draw.rectangle((0, 0, 240, 240), fill=(0, 0, 0))
+                draw.text((45, 100), "SYSTEM HALT", font=font, fill=(255, 0, 0))
+                push_frame(None)
+            print("System shutting down...")
+            if fs: fs.delete()
+            time.sleep(1.0); os.system("sudo /sbin/poweroff"); return
+
+        # Load Sub-Menus
+        operation_mode = sel
+        if sel == "SOUND FONT": 
+            scan_soundfonts()
+            files, pathes = soundfont_names.copy(), soundfont_paths.copy()
+        elif sel == "MIDI FILE": 
+            scan_midifiles()
+            files, pathes = midi_names.copy(), midi_paths.copy()
+        elif sel == "MIDI KEYBOARD": 
+            files = pathes = midi_manager.list_ports()
+        selectedindex = 0
+
+    # --- 5. MIDI FILE & FILE ACTIONS ---
+    elif operation_mode == "MIDI FILE":
+        selected_file_path = pathes[selectedindex]
+        operation_mode = "FILE ACTION"
+        files = FILE_ACTIONS.copy()
+        selectedindex = 0
+
+    elif operation_mode == "FILE ACTION":
+        if sel == "PLAY": play_midi_file(selected_file_path)
+        elif sel == "STOP": stop_playback()
+
+        elif sel == "RENAME":
+            operation_mode = "RENAME"
+            rename_string = os.path.basename(selected_file_path).replace(".mid", "")
+            rename_char_idx = 0
+
+        elif sel == "DELETE":
+            try:
+                if os.path.exists(selected_file_path): 
+                    os.remove(selected_file_path)
+                set_message("Deleted")
+                scan_midifiles()
+                files, pathes = midi_names.copy(), midi_paths.copy()
+                operation_mode = "MIDI FILE"
+                selectedindex = 0
+            except:
+                set_message("Delete Error")
+
+        elif sel == "BACK":
+            operation_mode = "MIDI FILE"
+            selectedindex = 0
+
+    # --- 6. RENAME & SOUNDFONT LOADING ---
+    elif operation_mode == "RENAME":
+        char = rename_chars[rename_char_idx]
+        if char == "OK":
+            new_path = os.path.join(midi_file_folder, rename_string.strip() + ".mid")
+            try: os.rename(selected_file_path, new_path); set_message("Renamed")
+            except: set_message("Error")
+            operation_mode = "MIDI FILE"
+            scan_midifiles(); files, pathes = midi_names.copy(), midi_paths.copy()
+            selectedindex = 0
+        else:
+            rename_string += char
+
+    elif operation_mode == "SOUND FONT":
+        set_message("Loading...")
+        update_display(force=True) # Show "Loading" immediately
+        load_soundfont(pathes[selectedindex])
+        operation_mode = "main screen"; files = MAIN_MENU.copy(); selectedindex = MAIN_MENU.index("SOUND FONT")
+
+    elif operation_mode == "MIDI KEYBOARD":
+        midi_manager.open_port_by_name_async(pathes[selectedindex])
+        operation_mode = "main screen"; files = MAIN_MENU.copy(); selectedindex = MAIN_MENU.index("MIDI KEYBOARD")
+
+    publish_state()
+# ---------------------- WEB CONNECTIVITY ----------------------
+# One lock around every UI action, whoever triggers it: buttons, the main
+# loop's cmd_* files, or the embedded web server's threads.
+ENGINE_LOCK = threading.RLock()
+WEB_EMBEDDED = False # True: web_app runs in this process (--web)
+_web_sink = None     # web_app.push_state when embedded
+
+def run_command(btn):
+    # A single button press, from GPIO, a cmd_<btn> file or the web remote
+    if btn in ("up", "down"): queue_scroll(btn.upper()); return True
+    if btn in ("select", "back"): apply_command({"op": btn}); return True
+    return False
+
+# --- SCROLL COALESCING ---
+# Presses are added to a net step count before waiting for the engine lock.
+# Whoever gets the lock first applies everything queued so far as one
+# handle_scroll (one state update, one frame); the rest find nothing to do.
+_scroll_lock = threading.Lock()
+_scroll_net = 0 # positive = DOWN
+
+# Held buttons repeat every SCROLL_REPEAT s after SCROLL_HOLD_DELAY, moving
+# more steps per repeat the longer they're held: (held seconds, steps)
+SCROLL_HOLD_DELAY = 0.4
+SCROLL_REPEAT = 0.1
+SCROLL_ACCEL = [(0.0, 1), (1.0, 2), (2.0, 4), (3.5, 8)]
+
+def hold_steps(held):
+    # held: seconds since the button started repeating
+    steps = 1
+    for t, n in SCROLL_ACCEL:
+        if held >= t: steps = n
+    return steps
+
+def held_scroll(direction, held):
+    if held >= SCROLL_HOLD_DELAY: queue_scroll(direction, hold_steps(held - SCROLL_HOLD_DELAY))
+
+def queue_scroll(direction, steps=1):
+    global _scroll_net
+    t0 = time.perf_counter()
+    with _scroll_lock: _scroll_net += steps if direction == "DOWN" else -steps
+    with ENGINE_LOCK: drain_scrolls()
+    COMMAND_TIME.since(t0)
+
+def drain_scrolls():
+    # Caller holds ENGINE_LOCK
+    global _scroll_net
+    with _scroll_lock: net, _scroll_net = _scroll_net, 0
+    if net: handle_scroll("DOWN" if net > 0 else "UP", abs(net))
+
+# ---------------------- COMMAND API ----------------------
+# Typed commands from the web remote, e.g. {"op": "set_volume", "value": 80},
+# or a list of them applied as one batch. publish_state() is held back for
+# the whole batch, so a jump straight to file 150 or "scroll down x12" is
+# one state update and one redraw.
+LIST_MODES = ["main screen", "SOUND FONT", "MIDI FILE", "MIDI KEYBOARD", "FILE ACTION"]
+FILE_ACTIONS = ["PLAY", "STOP", "RENAME", "DELETE", "BACK"]
+
+def _clamp(value, lo, hi):
+    return max(lo, min(hi, int(value)))
+
+def op_set_index(index):
+    global selectedindex, mixer_selected_ch
+    if operation_mode in LIST_MODES and files: selectedindex = _clamp(index, 0, len(files) - 1)
+    elif operation_mode == "MIXER" and not mixer_adjusting: mixer_selected_ch = _clamp(index, 0, 9)
+    elif operation_mode == "METRONOME" and not metro_adjusting: selectedindex = _clamp(index, 0, 2)
+    else: raise ValueError(f"no list in {operation_mode}")
+
+def op_set_volume(value):
+    global volume_level
+    volume_level = _clamp(value, 0, 100)
+    if fs: fs.setting('synth.gain', volume_level / 100.0)
+
+def op_set_bpm(value):
+    global bpm
+    bpm = _clamp(value, 40, 250)
+
+def op_set_metro_vol(value):
+    global metro_vol
+    metro_vol = _clamp(value, 0, 127)
+    if fs: fs.cc(9, 7, metro_vol)
+
+def op_set_channel_volume(channel, value):
+    # channel as shown in the MIXER list (0 = drums)
+    global mixer_selected_ch
+    mixer_selected_ch = _clamp(channel, 0, 9)
+    f_ch = get_internal_channel(mixer_selected_ch)
+    channel_volumes[f_ch] = _clamp(value, 0, 127)
+    if fs: fs.cc(f_ch, 7, channel_volumes[f_ch])
+
+def _find(name, names, paths):
+    # Match on the list name or the file name; never a path from the client
+    name = os.path.basename(str(name))
+    for n, p in zip(names, paths):
+        if name in (n, os.path.basename(p)): return p
+    raise KeyError(name)
+
+def op_select_path(name):
+    # Open FILE ACTION for a MIDI file, as if it had been picked in the list
+    global operation_mode, files, selectedindex, selected_file_path
+    scan_midifiles()
+    selected_file_path = _find(name, midi_names, midi_paths)
+    operation_mode = "FILE ACTION"
+    files = FILE_ACTIONS.copy()
+    selectedindex = 0
+
+def op_load_sf2(name):
+    scan_soundfonts()
+    path = _find(name, soundfont_names, soundfont_paths)
+    set_message("Loading...")
+    load_soundfont(path)
+
+# --- FILE OPERATIONS ---
+# Rename/delete/move work on names in the MIDI folder. The catalog (and the
+# list on screen) is rescanned once at the end of the batch, not per file.
+_catalog_dirty = False
+
+def _midi_file(name):
+    path = os.path.join(midi_file_folder, os.path.basename(str(name)))
+    if not path.endswith(".mid"): path += ".mid"
+    if not os.path.isfile(path): raise ValueError(f"{os.path.basename(path)} not found")
+    return path
+
+def _midi_name(new_name):
+    name = os.path.basename(str(new_name).strip())
+    if name.endswith(".mid"): name = name[:-4]
+    if not name.strip(" ."): raise ValueError("empty name")
+    return name + ".mid"
+
+def _each(items, fn, verb):
+    # Apply fn to every item; one bad file doesn't stop the rest
+    global _catalog_dirty
+    failed = []
+    for item in items:
+        try: fn(item); _catalog_dirty = True
+        except (OSError, ValueError) as e: failed.append(f"{item[0] if isinstance(item, (list, tuple)) and item else item}: {e}")
+    set_message(f"{verb} {len(items) - len(failed)}/{len(items)}" if len(items) > 1 or failed else verb)
+    if failed: raise ValueError("; ".join(failed))
+
+def _rename(src, new_name):
+    global selected_file_path
+    dst = os.path.join(midi_file_folder, _midi_name(new_name))
+    if dst == src: return
+    if os.path.exists(dst): raise ValueError(f"{os.path.basename(dst)} exists")
+    os.rename(src, dst)
+    if src == selected_file_path: selected_file_path = dst
+
+def op_rename_file(new_name, name=None):
+    # Free-text rename; without a name it renames the file being edited
+    global operation_mode
+    src = _midi_file(name) if name else selected_file_path
+    if not src or not os.path.isfile(src): raise ValueError("no file selected")
+    _each([new_name], lambda n: _rename(src, n), "Renamed")
+    if operation_mode == "RENAME": operation_mode = "MIDI FILE" # same exit as the picker's OK
+
+def _rename_pair(pair):
+    # One [name, new_name] entry of a rename_files batch, as sent by a client
+    if not isinstance(pair, (list, tuple)) or len(pair) != 2 or not all(isinstance(n, str) for n in pair):
+        raise ValueError(f"expected [name, new_name], got {pair!r}")
+    _rename(_midi_file(pair[0]), pair[1])
+
+def op_rename_files(renames):
+    _each(list(renames), _rename_pair, "Renamed")
+
+def op_delete_files(names):
+    _each(list(names), lambda n: os.remove(_midi_file(n)), "Deleted")
+
+def op_move_files(names, to):
+    # Into a sub-folder of the MIDI folder (out of the catalog, e.g. "archive")
+    folder = str(to).strip()
+    if not folder or folder != os.path.basename(folder) or folder.startswith("."):
+        raise ValueError(f"bad folder {to!r}")
+    dest = os.path.join(midi_file_folder, folder)
+    os.makedirs(dest, exist_ok=True)
+    def move(n):
+        src = _midi_file(n); dst = os.path.join(dest, os.path.basename(src))
+        if os.path.exists(dst): raise ValueError(f"exists in {folder}")
+        os.rename(src, dst)
+    _each(list(names), move, "Moved")
+
+def refresh_midi_catalog():
+    global files, pathes, selectedindex, operation_mode
+    scan_midifiles()
+    if operation_mode in ("FILE ACTION", "RENAME") and not os.path.isfile(selected_file_path):
+        operation_mode = "MIDI FILE"; selectedindex = 0
+    if operation_mode == "MIDI FILE":
+        files, pathes = midi_names.copy(), midi_paths.copy()
+        if selected_file_path in pathes: selectedindex = pathes.index(selected_file_path)
+        selectedindex = min(selectedindex, max(0, len(files) - 1))
+
+def op_catalog_add(kind, name):
+    # One file arrived (web upload): insert it into its sorted list instead of
+    # rescanning the folder, and index a new SF2's presets in the background
+    global files, pathes, selectedindex
+    folder, ext = {"midi": (midi_file_folder, ".mid"), "sf2": (soundfont_folder, ".sf2")}[kind]
+    path = os.path.join(folder, os.path.basename(str(name)))
+    if not path.endswith(ext) or not os.path.isfile(path): raise ValueError(f"{os.path.basename(path)} not found")
+    paths, names = (midi_paths, midi_names) if kind == "midi" else (soundfont_paths, soundfont_names)
+    if path not in paths:
+        # scan_* sort by file name, and paths share the folder prefix
+        i = bisect.bisect(paths, path)
+        paths.insert(i, path); names.insert(i, os.path.basename(path).replace(ext, ''))
+    on_screen = "MIDI FILE" if kind == "midi" else "SOUND FONT"
+    if operation_mode == on_screen:
+        current = pathes[selectedindex] if 0 <= selectedindex < len(pathes) else None
+        files, pathes = names.copy(), paths.copy()
+        if current in pathes: selectedindex = pathes.index(current)
+    if kind == "sf2":
+        def index():
+            try: index_sf2(path) # doesn't touch the loaded font's presets
+            except Exception as e: print(f"SF2 index: {e}")
+        threading.Thread(target=index, daemon=True).start()
+    set_message(f"Added {os.path.basename(path)}")
+
+def op_play(name=None):
+    # A MIDI file by name, else the one last picked in the list
+    path = _find(name, midi_names, midi_paths) if name else selected_file_path
+    if not path: raise ValueError("no file selected")
+    play_midi_file(path)
+
+def op_set_metronome(on):
+    global metronome_on
+    metronome_on = bool(on)
+    set_message("Metro: " + ("ON" if metronome_on else "OFF"))
+
+def op_scroll(direction, steps=1, held=None):
+    # held: seconds the remote's button has been repeating; the engine's curve decides the steps
+    steps = hold_steps(float(held)) if held is not None else _clamp(steps, 1, 1000)
+    handle_scroll("UP" if str(direction).upper() == "UP" else "DOWN", steps)
+
+COMMAND_OPS = {
+    "up": lambda: handle_scroll("UP"),
+    "down": lambda: handle_scroll("DOWN"),
+    "select": lambda: handle_select(),
+    "back": lambda: handle_back(),
+    "scroll": op_scroll,
+    "set_index": op_set_index,
+    "set_volume": op_set_volume,
+    "set_bpm": op_set_bpm,
+    "set_metro_vol": op_set_metro_vol,
+    "set_channel_volume": op_set_channel_volume,
+    "select_path": op_select_path,
+    "load_sf2": op_load_sf2,
+    "rename_file": op_rename_file,
+    "rename_files": op_rename_files,
+    "delete_files": op_delete_files,
+    "move_files": op_move_files,
+    "catalog_add": op_catalog_add,
+    "play": op_play,
+    "stop": lambda: stop_playback(),
+    "set_metronome": op_set_metronome,
+    "set_recording": lambda on: set_recording(bool(on)),
+}
+
+_batch_depth = 0    # > 0 while apply_command runs; publish_state waits for the end
+_batch_dirty = False
+
+def apply_command(cmds, arrival=None):
+    # One command or a list. Returns None, or an error string for the sender;
+    # a bad command is skipped, the rest of the batch still applies.
+    # arrival: perf_counter() when it reached the engine, if before this call
+    global _batch_depth, _batch_dirty, _catalog_dirty
+    t0 = time.perf_counter() if arrival is None else arrival
+    errors = []
+    with ENGINE_LOCK:
+        drain_scrolls() # presses queued before this batch come first
+        _batch_depth += 1
+        try:
+            for cmd in (cmds if isinstance(cmds, list) else [cmds]):
+                op = cmd.get("op") if isinstance(cmd, dict) else None
+                fn = COMMAND_OPS.get(op)
+                if fn is None: errors.append(f"unknown op {op!r}"); continue
+                _batch_dirty = True # even a failed op may have done part of its work
+                try:
+                    fn(**{k: v for k, v in cmd.items() if k != "op"})
+                except Exception as e: # anything a client can send must not reach the main loop
+                    print(f"Command {op} failed: {e}")
+                    errors.append(f"{op}: {e}")
+        finally:
+            _batch_depth -= 1
+            if not _batch_depth and _catalog_dirty:
+                _catalog_dirty = False
+                refresh_midi_catalog()
+            if not _batch_depth and _batch_dirty:
+                _batch_dirty = False
+                publish_state()
+    COMMAND_TIME.since(t0)
+    return "; ".join(errors) or None
+
+def poll_command_files():
+    # Two-process mode: web_app drops cmd_<button> and cmd_op_<ns>.json files
+    # in BASE_DIR. One directory scan per tick; everything found is applied
+    # as one batch, oldest first.
+    try: names = sorted(e.name for e in os.scandir(BASE_DIR) if e.name.startswith("cmd_") and not e.name.endswith(".tmp"))
+    except OSError: return False
+    batch = []
+    written = time.time()
+    for name in names:
+        path = os.path.join(BASE_DIR, name)
+        try:
+            written = min(written, os.path.getmtime(path))
+            if name.startswith("cmd_op_"):
+                with open(path, "r") as f: cmd = json.load(f)
+                batch.extend(cmd if isinstance(cmd, list) else [cmd])
+            else:
+                batch.append({"op": name[4:]})
+        except Exception as e:
+            print(f"Bad command file {name}: {e}")
+        finally:
+            try: os.remove(path)
+            except: pass
+    # Arrival is when web_app wrote the oldest file, so the poll wait counts too
+    if batch: apply_command(batch, time.perf_counter() - max(0.0, time.time() - written))
+    return bool(batch)
+
+# ---------------------- NOTE PAD ----------------------
+# Notes from the remote's pad skip the command path entirely. Embedded,
+# web_app calls play_note() from its socket handler. Two-process, it sends one
+# UDP datagram to 127.0.0.1:NOTE_PORT and note_server() answers with the
+# delay, which web_app forwards to the page. t_recv is web_app's
+# time.monotonic_ns() at receipt; CLOCK_MONOTONIC is shared by both processes.
+NOTE_PORT = 5010
+NOTE_PACKET = struct.Struct("<BBBxIQ") # status, note, velocity, id, t_recv (web_app.NOTE_PACKET)
+NOTE_REPLY = struct.Struct("<Iq")      # id, receive-to-noteon ns (-1: no synth)
+
+def play_note(status, note, velocity, t_recv):
+    # Same handling as a keyboard note (recorder, activity, channel)
+    if status & 0xF0 not in (0x80, 0x90) or fs is None: return None
+    midi_callback(([status, note & 0x7F, velocity & 0x7F], 0.0), None)
+    return time.monotonic_ns() - t_recv
+
+def note_server(sock):
+    while not SHUTTING_DOWN:
+        try:
+            data, addr = sock.recvfrom(64)
+            status, note, velocity, note_id, t_recv = NOTE_PACKET.unpack_from(data)
+            dt = play_note(status, note, velocity, t_recv)
+            sock.sendto(NOTE_REPLY.pack(note_id, -1 if dt is None else dt), addr)
+        except Exception as e:
+            print(f"Note pad: {e}")
+
+def boot_note_pad():
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", NOTE_PORT)) # a second engine fails this step, not the thread
+    threading.Thread(target=note_server, args=(sock,), daemon=True, name="notes").start()
+
+# ---------------------- OSC CONTROL ----------------------
+# Open Sound Control on UDP OSC_PORT for tablets and DAWs; off unless
+# ZOMPLER_OSC_PORT is set, since it listens on every interface. Codec and
+# dispatcher in osc.py. Notes, CC and program changes go straight to
+# midi_callback like a keyboard's; the rest are commands, applied under the
+# engine lock and published like the remote's. MIDI channels are 1-16, mixer
+# channels as in the MIXER list (0 = drums).
+OSC_PORT = int(os.environ.get("ZOMPLER_OSC_PORT", "0")) # 9000 is the usual one
+
+def _osc_midi(status, ch, *data):
+    midi_callback(([status | (int(ch) - 1) & 0x0F] + [int(d) & 0x7F for d in data], 0.0), None)
+
+def _osc_command(op, **args):
+    err = apply_command(dict(args, op=op))
+    if err: print(f"OSC: {err}")
+
+OSC_ADDRESSES = {
+    "/note/on": lambda ch, note, vel=100: _osc_midi(0x90, ch, note, vel),
+    "/note/off": lambda ch, note, vel=0: _osc_midi(0x80, ch, note, 0),
+    "/cc": lambda ch, num, value: _osc_midi(0xB0, ch, num, value),
+    "/program": lambda ch, prog: _osc_midi(0xC0, ch, prog),
+    "/volume": lambda value: _osc_command("set_volume", value=value),
+    "/bpm": lambda value: _osc_command("set_bpm", value=value),
+    "/metronome": lambda on: _osc_command("set_metronome", on=on),
+    "/metronome/volume": lambda value: _osc_command("set_metro_vol", value=value),
+    "/mixer/volume": lambda ch, value: _osc_command("set_channel_volume", channel=ch, value=value),
+    "/transport/play": lambda name=None: _osc_command("play", name=name),
+    "/transport/stop": lambda: _osc_command("stop"),
+    "/transport/record": lambda on: _osc_command("set_recording", on=on),
+}
+
+def boot_osc():
+    import osc
+    osc.OscServer(OSC_ADDRESSES, OSC_PORT).start()
+
+# ---------------------- NETWORK MIDI ----------------------
+# RTP-MIDI from a laptop over the hotspot, another input next to SafeMidiIn
+# (netmidi.py). Events come out of its jitter buffer into midi_callback;
+# NETMIDI_LATENCY_MS caps the delay it may add (0 = play on arrival). Off
+# unless ZOMPLER_NETMIDI_PORT is set, since it listens on every interface.
+NETMIDI_PORT = int(os.environ.get("ZOMPLER_NETMIDI_PORT", "0")) # 5004 is the usual one; data on +1
+NETMIDI_LATENCY_MS = float(os.environ.get("ZOMPLER_NETMIDI_LATENCY_MS", "10"))
+net_midi = None
+
+def boot_net_midi():
+    global net_midi
+    import netmidi
+    net_midi = netmidi.RtpMidiServer(lambda msg: midi_callback((msg, 0.0), None),
+                                     NETMIDI_PORT, "Zompler", NETMIDI_LATENCY_MS).start()
+
+# ---------------------- TEMPO SYNC ----------------------
+# BPM, beat phase and metronome start/stop shared with other Zomplers on the
+# network (tempo_sync.py, UDP multicast on SYNC_PORT). Off unless
+# ZOMPLER_SYNC_PORT is set, like the other network listeners. Local changes
+# go out from publish_state; a peer's change lands in _tempo_changed.
+SYNC_PORT = int(os.environ.get("ZOMPLER_SYNC_PORT", "0")) # 20809 is the usual one
+
+def _tempo_changed(new_bpm, playing):
+    global bpm, metronome_on
+    with ENGINE_LOCK:
+        bpm = _clamp(round(new_bpm), 40, 250)
+        if metronome_on != playing: set_message("Metro: " + ("ON" if playing else "OFF"))
+        metronome_on = playing
+        publish_state()
+
+def boot_tempo_sync():
+    global tempo
+    import tempo_sync
+    tempo = tempo_sync.TempoSync(bpm, _tempo_changed, SYNC_PORT).start()
+
+def build_web_state():
+    display_list = []
+    current_idx = selectedindex
+    
+    # 1. Determine the 'List View' content
+    if operation_mode == "RENAME":
+        display_list = [f"Building: {rename_string}", f"Char: {rename_chars[rename_char_idx]}"]
+        current_idx = 1
+    elif operation_mode == "MIXER":
+        current_idx = mixer_selected_ch
+        for m_ch in range(10):
+            f_ch = get_internal_channel(m_ch)
+            name = channel_presets.get(f_ch, f"CH {f_ch}")
+            vol = channel_volumes.get(f_ch, 100)
+            display_list.append(f"{m_ch}: {name[:10]} ({vol}%)")
+    elif operation_mode in ["VOLUME", "METRONOME"]:
+        # We clear the list so the web app shows its specialized UI overlays
+        display_list = []
+    else:
+        display_list = files if files else ["No Files"]
+
+    # 2. Package everything for the Web App
+    state_data = {
+        "mode": str(operation_mode),
+        "index": int(current_idx), # Use the smart index we calculated
+        "files": display_list,     # Use the smart list we built
+        "msg": MESSAGE if (time.time() - msg_start_time < 2.0) else "",
+        "battery": ups.get_time_left(),
+        "is_eco": bool(LOW_POWER_MODE),
+        "power_mode": power_mode,
+        "power_profile": power_profile,
+        "dsp_level": int(dsp_level),
+        "dsp_load": round(dsp_load, 1),
+        "rename_tmp": str(rename_string),
+        "volume": int(volume_level),
+        "bpm": int(bpm),
+        "metronome_on": bool(metronome_on),
+        "metro_vol": int(metro_vol),
+        "mixer_idx": int(mixer_selected_ch),
+        "is_adjusting": bool(metro_adjusting or mixer_adjusting),
+        "sf2": loaded_sf2_path or "",
+        "net_midi": net_midi.stats() if net_midi else None, # None until a laptop connects
+    }
+    return state_data
+
+_state_writer = None
+_state_write_lock = threading.Lock() # called from the main loop, handlers and boot steps
+
+def update_web_state():
+    t0 = time.perf_counter()
+    try:
+        state_data = build_web_state()
+        if WEB_EMBEDDED:
+            # Same process: hand the dict over, nothing touches the disk
+            if _web_sink is not None: _web_sink(state_data)
+            WEB_STATE_TIME.since(t0)
+            return
+
+        # 3. Shared memory block for web_app.py (see shm_state.py)
+        global _state_writer
+        with _state_write_lock:
+            if _state_writer is None:
+                import shm_state
+                _state_writer = shm_state.StateWriter()
+            _state_writer.publish(state_data)
+        WEB_STATE_TIME.since(t0)
+        
+    except Exception as e:
+        # print(f"Web Update Error: {e}") 
+        pass
+
+# ---------------------- FRAME OUTPUT ----------------------
+def push_frame(regions):
+    # regions: list of (x0, y0, x1, y1) boxes that were redrawn, None = all
+    if display is not None: display.show(img, regions)
+
+# Pre-rendered strips for the menu fonts. Menu rows only come in a few
+# (text, highlight, accent) combinations, so scrolling is mostly pastes.
+
+@lru_cache(maxsize=256)
+def _row_bitmap(text, selected, accent):
+    from PIL import Image, ImageDraw
+    row = Image.new("RGB", (240, 28), (0, 0, 0))
+    d = ImageDraw.Draw(row)
+    if selected:
+        d.rectangle([10, 0, 230, 26], fill=accent)
+        d.text((15, 2), text, font=font, fill=(0, 0, 0))
+    else:
+        d.text((15, 2), text, font=font, fill=accent)
+    return row
+
+@lru_cache(maxsize=64)
+def _bar_bitmap(text, height, bg, text_y, use_tiny, accent, right=""):
+    from PIL import Image, ImageDraw
+    bar = Image.new("RGB", (240, height), bg)
+    d = ImageDraw.Draw(bar)
+    d.text((10, text_y), text, font=font_tiny if use_tiny else font, fill=accent)
+    if right: d.text((165, text_y), right, font=font_tiny if use_tiny else font, fill=(255, 120, 0))
+    return bar
+
+# ---------------------- DISPLAY INVALIDATION ----------------------
+# The screen is only redrawn when something on it changed. Handlers bump
+# _display_version; things that change with time (toast expiry, battery)
+# are queued as timed invalidations instead of being polled every frame.
+TOAST_SECONDS = 2.0
+BATTERY_REFRESH = 30.0
+_display_version = 1
+_drawn_version = 0
+_display_timers = [] # heap of wall-clock times at which the screen goes stale
+_display_lock = threading.Lock()
+_display_wake = threading.Event()
+battery_text = "--:--"
+_next_battery_time = 0.0
+_frame_keys = {} # region name -> what it showed when last pushed
+
+def invalidate_display(delay=0.0):
+    global _display_version
+    with _display_lock:
+        if delay > 0:
+            heapq.heappush(_display_timers, time.time() + delay)
+            return
+        _display_version += 1
+    _display_wake.set()
+
+def set_message(text):
+    global MESSAGE, msg_start_time
+    MESSAGE = text
+    msg_start_time = time.time()
+    invalidate_display()
+    invalidate_display(TOAST_SECONDS) # Redraw once more to clear the toast
+
+def publish_state():
+    # A handler changed something: redraw the screen and sync the phone
+    global _batch_dirty
+    if _batch_depth: _batch_dirty = True; return # apply_command publishes at the end
+    invalidate_display()
+    update_web_state()
+    note_session_change()
+    if tempo is not None: tempo.update(bpm, metronome_on)
+
+def _expire_display_timers(now):
+    global _display_version, battery_text, _next_battery_time
+    if now >= _next_battery_time:
+        _next_battery_time = now + BATTERY_REFRESH
+        text = ups.get_time_left()
+        if text != battery_text:
+            battery_text = text
+            invalidate_display()
+    if _display_timers and _display_timers[0] <= now:
+        with _display_lock:
+            while _display_timers and _display_timers[0] <= now:
+                heapq.heappop(_display_timers)
+            _display_version += 1
+
+# ---------------------- DISPLAY ENGINE ----------------------
+def update_display(force=False):
+    global _last_display_time, _drawn_version
+    if SHUTTING_DOWN or draw is None: return 
+    
+    now = time.time()
+    _expire_display_timers(now)
+    # Nothing changed since the last push: no drawing, no SPI
+    if _display_version == _drawn_version and not force: return
+    # Throttle display updates to save CPU
+    if not force and now - _last_display_time < DISPLAY_INTERVAL: return
+    _last_display_time = now
+    _drawn_version = _display_version
+    t0 = time.perf_counter()
+    dirty = []
+    
+    # Yellow accent for ECO mode, White for MAX
+    accent = (255, 255, 0) if LOW_POWER_MODE else (255, 255, 255)
+    toast = MESSAGE if (MESSAGE and now - msg_start_time < TOAST_SECONDS) else None
+
+    def blit(name, box, key, render):
+        # Repaint one region only if what it shows changed since last frame
+        if _frame_keys.get(name) == key: return
+        img.paste(render(), box[:2])
+        _frame_keys[name] = key
+        dirty.append(box)
+    
+    # 1. Header and Mode Title (cached strips)
+    dsp_tag = f"DSP -{dsp_level}" if dsp_level else ""
+    blit("header", (0, 0, 240, 26), (battery_text, accent, dsp_tag),
+         lambda: _bar_bitmap(f"BAT: {battery_text}", 26, (30, 30, 30), 4, True, accent, dsp_tag))
+    title = operation_mode.upper()
+    blit("title", (0, 26, 240, 56), (title, accent),
+         lambda: _bar_bitmap(title, 30, (50, 50, 50), 5, False, accent))
+
+    # 2. Body. A toast coming or going, or a new layout, repaints all of it
+    layout = "list" if operation_mode not in ("VOLUME", "METRONOME", "MIXER", "RENAME") else operation_mode
+    if _frame_keys.get("layout") != layout or _frame_keys.get("toast") != toast or toast:
+        for k in [k for k in _frame_keys if k.startswith("row")]: del _frame_keys[k]
+        _frame_keys["layout"] = layout
+        draw.rectangle((0, 56, 240, 240), fill=(0, 0, 0))
+        dirty.append((0, 56, 240, 240))
+    elif layout != "list":
+        # Small fixed screens: redraw the body, the panel diff trims the SPI push
+        draw.rectangle((0, 56, 240, 240), fill=(0, 0, 0))
+        dirty.append((0, 56, 240, 240))
+
+    # --- MODE: VOLUME ---
+    if operation_mode == "VOLUME":
+        draw.text((30, 90), "MASTER GAIN", font=font, fill=accent)
+        draw.rectangle((20, 120, 220, 150), outline=accent, width=2)
+        # Standardized for 0-100 scale: 196 pixels wide max
+        bar_width = int(1.96 * volume_level)
+        draw.rectangle((22, 122, 22 + bar_width, 148), fill=(0, 255, 0))
+        draw.text((100, 160), f"{int(volume_level)}%", font=font, fill=accent)
+
+    # --- MODE: METRONOME ---
+    elif operation_mode == "METRONOME":
+        metro_lines = [
+            f"STATUS: {'ACTIVE' if metronome_on else 'OFF'}",
+            f"BPM: {bpm}",
+            f"CLICK VOL: {metro_vol}"
+        ]
+        for i, text in enumerate(metro_lines):
+            y = 75 + (i * 35)
+            is_selected = (i == selectedindex)
+            
+            # Draw a green box if we are actually turning the knob to change the value
+            if is_selected:
+                box_color = (0, 255, 0) if metro_adjusting else accent
+                draw.rectangle([10, y-4, 230, y+28], fill=box_color)
+                draw.text((20, y), text, font=font, fill=(0, 0, 0))
+            else:
+                draw.text((20, y), text, font=font, fill=accent)
+
+    # --- MODE: MIXER ---
+    elif operation_mode == "MIXER":
+        for i in range(10):
+            y = 60 + (i * 18)
+            f_ch = get_internal_channel(i)
+            color = accent if i == mixer_selected_ch else (200, 200, 200)
+            
+            # Highlight current channel; Green outline if adjusting
+            if i == mixer_selected_ch:
+                if mixer_adjusting:
+                    draw.rectangle((5, y, 235, y+16), outline=(0, 255, 0), width=1)
+                else:
+                    draw.rectangle((5, y, 235, y+16), outline=accent, width=1)
+            
+            name = channel_presets.get(f_ch, f"CH {f_ch}")
+            draw.text((10, y), f"{i}:{name[:10]}", font=font_tiny, fill=color)
+            vol = channel_volumes.get(f_ch, 100)
+            # Volume bar for channel
+            draw.rectangle((150, y+4, 150 + int(vol/1.6), y+12), fill=color)
+
+    # --- MODE: RENAME ---
+    elif operation_mode == "RENAME":
+        draw.text((10, 80), "Rename to:", font=font_tiny, fill=accent)
+        draw.text((10, 105), rename_string + "_", font=font, fill=(0, 255, 0))
+        
+        # Character Picker Box
+        draw.rectangle((100, 150, 140, 190), outline=accent, width=2)
+        draw.text((112, 158), rename_chars[rename_char_idx], font=font, fill=accent)
+
+    # --- MODE: DEFAULT LIST (Main Menu, Files, etc.) ---
+    else:
+        view = 5
+        start = max(0, min(selectedindex - 2, len(files) - view))
+        shown = files[start:start+view]
+        for r in range(view):
+            y = 62 + r * 28
+            if r < len(shown):
+                i = start + r
+                key = (shown[r][:22], i == selectedindex, accent)
+                blit(f"row{r}", (0, y, 240, y + 28), key, lambda: _row_bitmap(*key))
+            elif _frame_keys.get(f"row{r}") is not None:
+                draw.rectangle((0, y, 240, y + 28), fill=(0, 0, 0))
+                _frame_keys[f"row{r}"] = None
+                dirty.append((0, y, 240, y + 28))
+
+    # 3. Draw Toast Notifications (Overlay)
+    _frame_keys["toast"] = toast
+    if toast:
+        draw.rectangle((20, 90, 220, 140), fill=(200, 0, 0), outline=(255, 255, 255), width=2)
+        draw.text((35, 105), toast, font=font_tiny, fill=(255, 255, 255))
+
+    # 4. Push only the redrawn regions to the ST7789
+    RENDER_TIME.since(t0)
+    if dirty:
+        t0 = time.perf_counter()
+        push_frame(dirty)
+        PUSH_TIME.since(t0)
+
+# ---------------------- STATUS LED ----------------------
+class LedPattern:
+    # Plays brightness patterns on the ACT LED from its own thread, so boot
+    # and the main loop never wait for the blinking to finish.
+    READY = [(255, 1.0), (0, 1.0)] * 3 # 3 long pulses
+    ERROR = [(255, 0.15), (0, 0.15)] * 5 # a boot step failed
+
+    def __init__(self, name=LED_NAME):
+        # On Pi Zero 2W / Pi 4 / Pi 5, 'ACT' is the standard directory;
+        # older OS versions still call it led0
+        base = f"/sys/class/leds/{name}"
+        if not os.path.exists(base): base = "/sys/class/leds/led0"
+        self.brightness = os.path.join(base, "brightness")
+        self.trigger = os.path.join(base, "trigger")
+        self.lock = threading.Lock()
+
+    def play(self, pattern):
+        threading.Thread(target=self._play, args=(pattern,), daemon=True).start()
+
+    def _play(self, pattern):
+        with self.lock:
+            try:
+                # Take control away from the system, then hand it back to
+                # 'mmc0' so it flickers during SD card activity again
+                if os.path.exists(self.trigger):
+                    with open(self.trigger, "w") as f: f.write("none")
+                for level, seconds in pattern:
+                    with open(self.brightness, "w") as f: f.write(str(level))
+                    time.sleep(seconds)
+                if os.path.exists(self.trigger):
+                    with open(self.trigger, "w") as f: f.write("mmc0")
+            except Exception as e:
+                print(f"LED Signal Error: {e}")
+
+# ---------------------- MAIN BOOT ----------------------
+BOOT_REPORT = os.path.join(BASE_DIR, "boot_timeline.json")
+
+class BootOrchestrator:
+    # Each step runs on its own thread as soon as the steps it depends on
+    # have finished. Start/end of every step is recorded relative to the
+    # first line of main.py and written to boot_timeline.json.
+    def __init__(self, t0=_BOOT_T0):
+        self.t0 = t0
+        self.steps = [] # (name, fn, after)
+        self.done = {}
+        self.timeline = []
+        self.lock = threading.Lock()
+
+    def step(self, name, fn, after=()):
+        self.steps.append((name, fn, tuple(after)))
+        self.done[name] = threading.Event()
+
+    def _run_step(self, name, fn, after):
+        for dep in after: self.done[dep].wait()
+        start = time.time()
+        error = None
+        try: fn()
+        except Exception as e:
+            error = str(e)
+            print(f"Boot step {name} failed: {e}")
+        end = time.time()
+        with self.lock:
+            self.timeline.append({"name": name, "after": list(after), "error": error,
+                                  "start": round(start - self.t0, 3), "end": round(end - self.t0, 3),
+                                  "duration": round(end - start, 3)})
+        self.done[name].set()
+
+    def run(self, on_done=None):
+        for name, fn, after in self.steps:
+            threading.Thread(target=self._run_step, args=(name, fn, after), daemon=True, name=f"boot-{name}").start()
+        def finish():
+            for ev in self.done.values(): ev.wait()
+            report = self.report()
+            self.write(report)
+            if on_done: on_done(report)
+        threading.Thread(target=finish, daemon=True).start()
+
+    def report(self):
+        with self.lock: steps = sorted(self.timeline, key=lambda s: s["start"])
+        try:
+            # Seconds since the kernel started, for the cold-boot target
+            with open("/proc/uptime") as f: uptime = float(f.read().split()[0])
+        except: uptime = None
+        total = max((s["end"] for s in steps), default=0.0)
+        return {"written": time.time(), "total": round(total, 3),
+                "kernel_uptime_at_ready": round(uptime, 2) if uptime is not None else None,
+                "failed": [s["name"] for s in steps if s["error"]], "steps": steps}
+
+    def write(self, report):
+        try:
+            tmp = BOOT_REPORT + ".tmp"
+            with open(tmp, "w") as f: json.dump(report, f, indent=1)
+            os.replace(tmp, BOOT_REPORT)
+        except: pass
+
+def boot_midi_in():
+    global midi_manager
+    midi_manager = SafeMidiIn(); midi_manager.set_callback(midi_callback)
+
+def boot_buttons():
+    init_buttons()
+    button_up.when_pressed = lambda: run_command("up")
+    button_down.when_pressed = lambda: run_command("down")
+    # Holding UP/DOWN repeats with acceleration (SCROLL_ACCEL). gpiozero
+    # uses one interval for the first hold and the repeats, so repeat fast
+    # and skip the ticks before SCROLL_HOLD_DELAY.
+    for b, direction in ((button_up, "UP"), (button_down, "DOWN")):
+        b.hold_time = SCROLL_REPEAT; b.hold_repeat = True
+        b.when_held = lambda b=b, d=direction: held_scroll(d, b.held_time or 0.0)
+    button_select.when_pressed = lambda: run_command("select")
+    button_back.when_pressed = lambda: run_command("back")
+
+def boot_web():
+    # Single-process mode: web_app's Socket.IO server on a thread of this
+    # process, calling run_command() directly and fed by update_web_state()
+    global _web_sink
+    os.environ["ZOMPLER_EMBEDDED"] = "1" # web_app: threading mode, no monkey_patch
+    import web_app
+    _web_sink = web_app.push_state
+    threading.Thread(target=web_app.serve, args=(sys.modules[__name__],), daemon=True, name="web").start()
+
+def boot_synth():
+    init_fluidsynth_lazy()
+    if fs is None: raise RuntimeError("synth not started")
+    # Saved gain/metronome are applied by init; the mixer goes on right after
+    apply_mixer_to_synth()
+
+def boot_restore_sf2():
+    path = _session_saved.get("sf2") if _session_saved else None
+    if not isinstance(path, str) or not os.path.exists(path): return
+    with ENGINE_LOCK:
+        # A SOUND FONT pick from the web or the buttons during boot wins
+        if loaded_sf2_path: return
+        load_soundfont(path)
+
+def boot_restore_midi_port():
+    port = _session_saved.get("midi_port") if _session_saved else None
+    if port and midi_manager and port in midi_manager.list_ports():
+        midi_manager.open_port_by_name_async(port)
+
+def boot(ready_led=False):
+    import importlib
+    boot_t = time.time()
+    orch = BootOrchestrator()
+    # Module import is stdlib only; everything heavy is a step below
+    orch.timeline.append({"name": "import main.py", "after": [], "error": None, "start": 0.0,
+                          "end": round(boot_t - orch.t0, 3), "duration": round(boot_t - orch.t0, 3)})
+    orch.step("import PIL", lambda: [importlib.import_module(m) for m in ("PIL.Image", "PIL.ImageDraw", "PIL.ImageFont")])
+    orch.step("import rtmidi", lambda: importlib.import_module("rtmidi"))
+    orch.step("import mido", lambda: importlib.import_module("mido")) # recorder only, off the critical path
+    orch.step("display", init_display, after=["import PIL"])
+    orch.step("midi in", boot_midi_in, after=["import rtmidi"])
+    orch.step("buttons", boot_buttons)
+    orch.step("scan sf2", scan_soundfonts)
+    orch.step("scan midi", scan_midifiles)
+    # Warm-up: synth created and ALSA driver running before anyone picks a SF2
+    orch.step("fluidsynth", boot_synth)
+    orch.step("restore sf2", boot_restore_sf2, after=["fluidsynth"])
+    orch.step("restore midi port", boot_restore_midi_port, after=["midi in"])
+    if WEB_EMBEDDED: orch.step("web server", boot_web)
+    else: orch.step("note pad", boot_note_pad)
+    if OSC_PORT: orch.step("osc", boot_osc)
+    if NETMIDI_PORT: orch.step("net midi", boot_net_midi)
+    if SYNC_PORT: orch.step("tempo sync", boot_tempo_sync)
+    orch.step("web state", update_web_state, after=["scan sf2", "scan midi", "midi in"] + (["web server"] if WEB_EMBEDDED else []))
+    led = LedPattern() if ready_led else None
+
+    def ready(report):
+        print(f"Monkey Pi Synth is Ready. Boot {report['total']:.2f}s")
+        for st in report["steps"]:
+            print(f"  {st['start']:6.2f} -> {st['end']:6.2f}  {st['name']}" + (f"  FAILED: {st['error']}" if st["error"] else ""))
+        if led: led.play(LedPattern.ERROR if report["failed"] else LedPattern.READY)
+        update_web_state()
+    orch.run(on_done=ready)
+    return orch
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Zompler MIDI engine")
+    ap.add_argument("--display", default=None,
+                    help="Display backends, comma separated: st7789, null, virtual, png:DIR, mirror "
+                         "(default: $ZOMPLER_DISPLAY or st7789,mirror)")
+    ap.add_argument("--ready-led", action="store_true", help="Pulse the ACT LED three times once booted")
+    ap.add_argument("--web", action="store_true", default=os.environ.get("ZOMPLER_WEB") == "embedded",
+                    help="Run the web remote inside this process instead of web_app.py")
+    return ap.parse_args(argv)
+
+def main(argv=None):
+    global DISPLAY_SPEC, WEB_EMBEDDED
+    args = parse_args(argv)
+    if args.display: DISPLAY_SPEC = args.display
+    WEB_EMBEDDED = args.web
+    load_session()
+    boot(args.ready_led)
+    threading.Thread(target=governor_worker, daemon=True).start()
+    threading.Thread(target=dsp_budget_worker, daemon=True).start()
+    last_web_sync = 0.0
+    while True:
+        if not SHUTTING_DOWN:
+            update_display()
+            
+            # Web Command Check (two-process mode only; embedded calls in directly)
+            # Files are deleted before they are applied, so a bad one is gone after this
+            try: cmd_found = False if WEB_EMBEDDED else poll_command_files()
+            except Exception as e:
+                print(f"Command poll failed: {e}"); cmd_found = True
+            
+            # If a command was processed or 1s has passed
+            if cmd_found or time.time() - last_web_sync >= 1.0:
+                update_web_state()
+                last_web_sync = time.time()
+                try: metrics.write() # for web_app's /metrics; skipped if nothing moved
+                except: pass
+            note_session_change() # also catches MIDI port / SF2 changes from threads
+            flush_session()
+                
+        # Sleep until the next poll, or wake early when the screen goes stale
+        _display_wake.wait(0.1)
+        _display_wake.clear()
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nStopping Synth...")
+    finally:
+        flush_session(force=True)
+        if fs: fs.delete()
@@ -13,6 +13,7 @@ rm -f $BASE_DIR/cmd_*
 echo "Resetting JSON state..."
 rm -f $BASE_DIR/monkey_state.json
 rm -f $BASE_DIR/monkey_state.json.tmp
+rm -f /dev/shm/zompler_state /dev/shm/zompler_state.*.json*
 
 # 3. Ensure permissions are correct (allows Web and Main script to talk)
 echo "Fixing permissions..."
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# Network MIDI input: RTP-MIDI (RFC 6295) with the AppleMIDI session protocol,
+# as spoken by macOS "Network" MIDI, rtpMIDI on Windows and most DAWs.
+#
+# The laptop opens a session to port 5004 (control) / 5005 (data); MIDI
+# arrives as RTP packets whose timestamps carry the sender's timing. Events
+# go through a jitter buffer: each is played at
+#
+#   sender time + offset + delay
+#
+# where offset is the smallest transit seen recently (the "fast path"
+# through the network), and delay is JITTER_FACTOR x the measured
+# interarrival jitter, capped at the configured latency. A steady link gets
+# close to zero added latency; a jittery one is evened out up to the cap.
+# With latency 0 events play on arrival.
+#
+# Loopback test, no network needed:
+#
+#   python3 netmidi.py --listen                       # print what arrives
+#   python3 netmidi.py --send --jitter-ms 8 --loss 0.02
+#
+# Not implemented: the recovery journal (lost notes stay lost; a lost
+# note-off is the sender's all-notes-off problem, as with a cable pulled),
+# SysEx (skipped), and initiating sessions from this end.
+import sys, os, socket, select, struct, threading, heapq, time, random, argparse
+from collections import deque
+
+DEFAULT_PORT = 5004 # control; data is +1
+CLOCK_RATE = 10000  # RTP-MIDI timestamp units per second (AppleMIDI)
+JITTER_FACTOR = 3.0
+OFFSET_WINDOW = 128 # packets over which the fastest transit is tracked
+SESSION_TIMEOUT = 60.0 # no packet for this long: the session is gone
+LATE_MARGIN = 0.001    # an event counts as late if it arrives this long after its slot
+MISSING_WINDOW = 256   # skipped sequence numbers remembered, so a late one can be told from a dupe
+
+APPLEMIDI = struct.Struct(">H2sIII")   # 0xFFFF, command, version, token, ssrc
+CLOCK_SYNC = struct.Struct(">H2sIB3xQQQ") # 0xFFFF, "CK", ssrc, count, ts1..ts3
+RTP = struct.Struct(">BBHII")          # V/P/X/CC, M/PT, seq, timestamp, ssrc
+PROTOCOL_VERSION = 2
+
+def now_units():
+    return int(time.monotonic() * CLOCK_RATE)
+
+def _data_len(status):
+    if status < 0xF0: return 1 if status & 0xF0 in (0xC0, 0xD0) else 2
+    return {0xF1: 1, 0xF2: 2, 0xF3: 1}.get(status, 0)
+
+def parse_commands(payload):
+    # MIDI command section -> [(delta in clock units from the RTP timestamp, [bytes])]
+    if not payload: return []
+    flags = payload[0]
+    if flags & 0x80: # B: 12-bit length
+        length = ((flags & 0x0F) << 8) | payload[1]; pos = 2
+    else:
+        length = flags & 0x0F; pos = 1
+    end = min(len(payload), pos + length)
+    out, delta, status, first = [], 0, None, True
+    while pos < end:
+        if not first or flags & 0x20: # Z: the first command has a delta time too
+            d = 0
+            for _ in range(4):
+                b = payload[pos]; pos += 1
+                d = (d << 7) | (b & 0x7F)
+                if not b & 0x80: break
+            delta += d
+        first = False
+        if pos >= end: break
+        b = payload[pos]
+        if b == 0xF0 or b == 0xF7: # SysEx (or a segment of one): skip to its end
+            pos += 1
+            while pos < end and payload[pos] not in (0xF0, 0xF7): pos += 1
+            pos += 1
+            continue
+        if b & 0x80:
+            pos += 1
+            if b >= 0xF8: out.append((delta, [b])); continue # realtime keeps running status
+            status = b if b < 0xF0 else None
+            s = b
+        elif status is None:
+            break # data byte without a status: give up on this packet
+        else:
+            s = status
+        n = _data_len(s)
+        out.append((delta, [s] + list(payload[pos:pos + n]))); pos += n
+    return out
+
+def encode_commands(events):
+    # [(delta, [bytes])] -> command section, for the test sender
+    body = b""
+    for i, (delta, msg) in enumerate(events):
+        if i:
+            vlq = [delta & 0x7F]; delta >>= 7
+            while delta: vlq.insert(0, 0x80 | (delta & 0x7F)); delta >>= 7
+            body += bytes(vlq)
+        body += bytes(msg)
+    if len(body) < 16: return bytes([len(body)]) + body
+    return bytes([0x80 | (len(body) >> 8), len(body) & 0xFF]) + body
+
+# ---------------------- RECEIVER ----------------------
+class Session:
+    def __init__(self, ssrc, name, addr):
+        self.ssrc = ssrc; self.name = name; self.addr = addr
+        self.last_seen = time.monotonic()
+        self.seq = None; self.ts_ext = None
+        self.transit = deque(maxlen=OFFSET_WINDOW)
+        self.prev = None # (arrival, sender time) of the previous packet, for jitter
+        self.jitter = 0.0 # seconds, RFC 3550 estimator
+        self.packets = self.lost = self.reordered = self.dupes = 0
+        self.missing = {} # skipped sequence numbers (ordered), counted in lost until they turn up
+        self.late = 0 # events that arrived after their play time
+
+    def unwrap(self, ts):
+        if self.ts_ext is None: self.ts_ext = ts
+        else: self.ts_ext += ((ts - self.ts_ext) + 0x80000000) % 0x100000000 - 0x80000000
+        return self.ts_ext
+
+class RtpMidiServer:
+    def __init__(self, callback, port=DEFAULT_PORT, name="Zompler", latency_ms=10.0, host="0.0.0.0"):
+        self.callback = callback # callback(list_of_midi_bytes)
+        self.name = name
+        self.max_delay = max(0.0, latency_ms / 1000.0)
+        self.ssrc = random.getrandbits(32)
+        self.ctrl = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ctrl.bind((host, port))
+        self.data = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.data.bind((host, port + 1))
+        self.sessions = {} # sender ssrc -> Session
+        self.ended = None  # last session that closed, still shown in stats()
+        self.queue = []    # heap of (play time, n, msg)
+        self.counter = 0
+        self.last_play = 0.0
+        self.cv = threading.Condition()
+        self.running = False
+
+    # --- session protocol ---
+    def _applemidi(self, sock, data, addr):
+        cmd = data[2:4]
+        if cmd == b"CK":
+            _, _, ssrc, count, t1, t2, t3 = CLOCK_SYNC.unpack_from(data)
+            if count == 0: sock.sendto(CLOCK_SYNC.pack(0xFFFF, b"CK", self.ssrc, 1, t1, now_units(), 0), addr)
+            elif count == 1: sock.sendto(CLOCK_SYNC.pack(0xFFFF, b"CK", self.ssrc, 2, t1, t2, now_units()), addr)
+            s = self.sessions.get(ssrc)
+            if s: s.last_seen = time.monotonic()
+            return
+        if len(data) < APPLEMIDI.size: return
+        _, cmd, version, token, ssrc = APPLEMIDI.unpack_from(data)
+        if cmd == b"IN":
+            name = data[APPLEMIDI.size:].split(b"\0")[0].decode("utf-8", "replace")
+            sock.sendto(APPLEMIDI.pack(0xFFFF, b"OK", PROTOCOL_VERSION, token, self.ssrc) + self.name.encode() + b"\0", addr)
+            if sock is self.data:
+                with self.cv: self.sessions[ssrc] = Session(ssrc, name, addr)
+                print(f"Net MIDI: session from {name} ({addr[0]})")
+        elif cmd == b"BY":
+            with self.cv:
+                s = self.sessions.pop(ssrc, None)
+                if s: self.ended = s
+            if s: print(f"Net MIDI: {s.name} left")
+
+    # --- RTP MIDI ---
+    def _rtp(self, data, arrival):
+        if len(data) < RTP.size + 1: return
+        vpxcc, mpt, seq, ts, ssrc = RTP.unpack_from(data)
+        if vpxcc >> 6 != 2 or mpt & 0x7F != 0x61: return
+        s = self.sessions.get(ssrc)
+        if s is None: return # no session (yet)
+        s.last_seen = time.monotonic()
+        if s.seq is not None:
+            gap = (seq - s.seq) & 0xFFFF
+            if gap == 0: s.dupes += 1; return
+            if gap >= 0x8000:
+                # Older than one already seen: a late one fills its gap, anything else is a dupe
+                if s.missing.pop(seq, None) is None: s.dupes += 1; return
+                s.lost -= 1; s.reordered += 1 # still played in order below
+            else:
+                s.lost += gap - 1
+                for n in range(max(1, gap - MISSING_WINDOW), gap): s.missing[(s.seq + n) & 0xFFFF] = True
+                while len(s.missing) > MISSING_WINDOW: del s.missing[next(iter(s.missing))]
+                s.seq = seq
+        else:
+            s.seq = seq
+        s.packets += 1
+        sender = s.unwrap(ts) / CLOCK_RATE
+        s.transit.append(arrival - sender)
+        if s.prev is not None and sender > s.prev[1]:
+            d = (arrival - s.prev[0]) - (sender - s.prev[1])
+            s.jitter += (abs(d) - s.jitter) / 16.0
+        if s.prev is None or sender > s.prev[1]: s.prev = (arrival, sender)
+        events = parse_commands(data[RTP.size + 4 * (vpxcc & 0x0F):])
+        delay = min(self.max_delay, JITTER_FACTOR * s.jitter)
+        if self.max_delay <= 0:
+            for _, msg in events: self.callback(msg)
+            return
+        base = sender + min(s.transit) + delay
+        with self.cv:
+            for d, msg in events:
+                # Never earlier than what is already queued: keeps note-on/off order
+                at = base + d / CLOCK_RATE
+                if at < arrival - LATE_MARGIN: s.late += 1
+                at = max(at, self.last_play)
+                self.last_play = at
+                self.counter += 1
+                heapq.heappush(self.queue, (at, self.counter, msg))
+            self.cv.notify()
+
+    def _player(self):
+        while self.running:
+            with self.cv:
+                while not self.queue and self.running: self.cv.wait()
+                if not self.running: return
+                wait = self.queue[0][0] - time.monotonic()
+                if wait > 0:
+                    self.cv.wait(wait); continue
+                _, _, msg = heapq.heappop(self.queue)
+            try: self.callback(msg)
+            except Exception as e: print(f"Net MIDI: {e}")
+
+    def _receiver(self):
+        socks = [self.ctrl, self.data]
+        while self.running:
+            ready, _, _ = select.select(socks, [], [], 1.0)
+            for sock in ready:
+                try:
+                    data, addr = sock.recvfrom(2048)
+                    arrival = time.monotonic()
+                    if data[:2] == b"\xff\xff": self._applemidi(sock, data, addr)
+                    elif sock is self.data: self._rtp(data, arrival)
+                except Exception as e:
+                    print(f"Net MIDI: {e}")
+            now = time.monotonic()
+            for ssrc, s in list(self.sessions.items()):
+                if now - s.last_seen > SESSION_TIMEOUT:
+                    with self.cv: self.sessions.pop(ssrc, None); self.ended = s
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._receiver, daemon=True, name="netmidi").start()
+        threading.Thread(target=self._player, daemon=True, name="netmidi play").start()
+        return self
+
+    def stats(self):
+        # Most recently active session (else the last one), rounded so an
+        # idle link doesn't churn
+        with self.cv: # the receiver adds and drops sessions
+            s = max(self.sessions.values(), key=lambda x: x.last_seen) if self.sessions else self.ended
+            active = s is not None and s.ssrc in self.sessions
+        if s is None: return None
+        expected = s.packets + s.lost
+        return {
+            "peer": s.name,
+            "active": active,
+            "packets": s.packets,
+            "lost": s.lost,
+            "loss_pct": round(100.0 * s.lost / expected, 1) if expected else 0.0,
+            "reordered": s.reordered,
+            "late": s.late,
+            "jitter_ms": round(s.jitter * 1000, 1),
+            "buffer_ms": round(min(self.max_delay, JITTER_FACTOR * s.jitter) * 1000, 1),
+        }
+
+# ---------------------- TEST SENDER ----------------------
+def send_test(host, port, notes, interval_ms, jitter_ms, loss, name="netmidi test"):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); sock.settimeout(2.0)
+    data = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); data.settimeout(2.0)
+    ssrc, token = random.getrandbits(32), random.getrandbits(32)
+    invite = APPLEMIDI.pack(0xFFFF, b"IN", PROTOCOL_VERSION, token, ssrc) + name.encode() + b"\0"
+    for s, p in ((sock, port), (data, port + 1)):
+        s.sendto(invite, (host, p))
+        reply = s.recv(256)
+        if reply[2:4] != b"OK": print("Invitation refused"); return 1
+    peer = reply[APPLEMIDI.size:].split(b"\0")[0].decode()
+    data.sendto(CLOCK_SYNC.pack(0xFFFF, b"CK", ssrc, 0, now_units(), 0, 0), (host, port + 1))
+    ck = CLOCK_SYNC.unpack(data.recv(256))
+    data.sendto(CLOCK_SYNC.pack(0xFFFF, b"CK", ssrc, 2, ck[4], ck[5], now_units()), (host, port + 1))
+    print(f"Session with {peer}; sending {notes} notes every {interval_ms} ms, jitter {jitter_ms} ms, loss {loss:.0%}")
+    seq, start = random.getrandbits(16), time.monotonic()
+    for i in range(notes):
+        due = start + i * interval_ms / 1000.0
+        # The RTP timestamp is the intended time; the network delay is simulated
+        ts = int(due * CLOCK_RATE) & 0xFFFFFFFF
+        note = 60 + i % 12
+        payload = encode_commands([(0, [0x90, note, 100]), (int(interval_ms / 2000.0 * CLOCK_RATE), [0x80, note, 0])])
+        packet = RTP.pack(0x80, 0x61, seq, ts, ssrc) + payload
+        seq = (seq + 1) & 0xFFFF
+        time.sleep(max(0.0, due + random.uniform(0, jitter_ms / 1000.0) - time.monotonic()))
+        if random.random() >= loss: data.sendto(packet, (host, port + 1))
+    sock.sendto(APPLEMIDI.pack(0xFFFF, b"BY", PROTOCOL_VERSION, token, ssrc), (host, port))
+    return 0
+
+def listen(port, latency_ms, seconds):
+    last = [None]
+    def show(msg):
+        t = time.monotonic()
+        gap = f"+{(t - last[0]) * 1000:6.1f} ms" if last[0] else ""
+        last[0] = t
+        print(" ".join(f"{b:02X}" for b in msg), gap)
+    server = RtpMidiServer(show, port, "netmidi listen", latency_ms).start()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(1.0)
+        if server.stats(): print(server.stats())
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="RTP-MIDI receiver test tools.")
+    ap.add_argument("--send", action="store_true", help="Open a session and send test notes")
+    ap.add_argument("--listen", action="store_true", help="Receive and print (instead of the engine)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("ZOMPLER_NETMIDI_PORT", DEFAULT_PORT)))
+    ap.add_argument("--notes", type=int, default=100)
+    ap.add_argument("--interval-ms", type=float, default=50.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra send delay per packet")
+    ap.add_argument("--loss", type=float, default=0.0, help="Fraction of packets dropped")
+    ap.add_argument("--latency-ms", type=float, default=10.0, help="--listen: jitter buffer cap")
+    ap.add_argument("--seconds", type=float, default=30.0, help="--listen: how long")
+    args = ap.parse_args(argv)
+    if args.send: return send_test(args.host, args.port, args.notes, args.interval_ms, args.jitter_ms, args.loss)
+    if args.listen: return listen(args.port, args.latency_ms, args.seconds)
+    ap.print_help(); return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
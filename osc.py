@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Open Sound Control over UDP: message/bundle codec, a dispatcher with a
+# precompiled address table, and a small client for testing from the shell.
+#
+# The engine (main.py) builds its table once at boot and, when started with
+# ZOMPLER_OSC_PORT=9000, runs OscServer on a daemon thread. To drive it from
+# the same machine, no network needed:
+#
+#   python3 osc.py /bpm 96
+#   python3 osc.py /note/on 1 60 100
+#   python3 osc.py --host 192.168.4.1 /transport/play "My Song"
+#   python3 osc.py --bench                  # decode + dispatch cost per packet
+#
+# Supported argument types: i (int32), f (float32), s (string), b (blob),
+# h (int64), d (double), T/F/N (true/false/nil). Address patterns
+# (* ? [ ] { }) are not matched: clients send the exact addresses, which is
+# what makes a plain dict lookup enough. Bundles are unpacked and their
+# messages run at once; time tags are ignored.
+import sys, socket, struct, threading, time, argparse
+
+DEFAULT_PORT = 9000
+BUNDLE = b"#bundle\0"
+
+def _pad(n):
+    return (n + 4) & ~3 # NUL-terminated, padded to 4 bytes
+
+def _read_str(data, pos):
+    end = data.index(b"\0", pos)
+    return data[pos:end], pos + _pad(end - pos)
+
+# Fixed-size argument types; a type tag string made only of these decodes
+# with one precompiled struct
+_FIXED = {"i": "i", "f": "f", "h": "q", "d": "d"}
+_FIXED_ONE = {t: struct.Struct(">" + c) for t, c in _FIXED.items()}
+_CONST = {"T": True, "F": False, "N": None}
+
+class ArgDecoder:
+    # Type tag string -> decode function, built on first sight and reused
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, tags):
+        fn = self.cache.get(tags)
+        if fn is None:
+            fn = self.cache[tags] = self._compile(tags)
+        return fn
+
+    def _compile(self, tags):
+        if all(t in _FIXED for t in tags):
+            st = struct.Struct(">" + "".join(_FIXED[t] for t in tags))
+            return lambda data, pos: st.unpack_from(data, pos)
+        def decode(data, pos):
+            args = []
+            for t in tags:
+                if t in _FIXED:
+                    st = _FIXED_ONE[t]
+                    args.append(st.unpack_from(data, pos)[0]); pos += st.size
+                elif t == "s":
+                    raw, pos = _read_str(data, pos)
+                    args.append(raw.decode("utf-8", "replace"))
+                elif t == "b":
+                    n = struct.unpack_from(">i", data, pos)[0]
+                    args.append(data[pos + 4:pos + 4 + n]); pos += 4 + ((n + 3) & ~3)
+                elif t in _CONST:
+                    args.append(_CONST[t])
+                else:
+                    raise ValueError(f"unsupported OSC type {t!r}")
+            return args
+        return decode
+
+class Dispatcher:
+    # table: {"/address": handler(*args)}. Keys are kept as bytes, so a
+    # packet's address is looked up without being decoded.
+    def __init__(self, table):
+        self.table = {addr.encode("ascii"): fn for addr, fn in table.items()}
+        self.args = ArgDecoder()
+        self.unknown = set()
+
+    def dispatch(self, data):
+        if data.startswith(BUNDLE):
+            pos = 16 # "#bundle\0" + 8-byte time tag
+            while pos + 4 <= len(data):
+                n = struct.unpack_from(">i", data, pos)[0]
+                self.dispatch(data[pos + 4:pos + 4 + n])
+                pos += 4 + n
+            return
+        addr, pos = _read_str(data, 0)
+        fn = self.table.get(addr)
+        if fn is None:
+            if addr not in self.unknown and len(self.unknown) < 100:
+                self.unknown.add(addr); print(f"OSC: no handler for {addr.decode('ascii', 'replace')}")
+            return
+        if pos < len(data) and data[pos:pos + 1] == b",":
+            tags, pos = _read_str(data, pos)
+            args = self.args.get(tags[1:].decode("ascii"))(data, pos)
+        else:
+            args = () # very old clients send no type tags
+        fn(*args)
+
+class OscServer:
+    def __init__(self, table, port=DEFAULT_PORT, host="0.0.0.0"):
+        self.dispatcher = Dispatcher(table)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.running = False
+
+    def serve(self):
+        self.running = True
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(65536)
+                self.dispatcher.dispatch(data)
+            except Exception as e:
+                print(f"OSC: {e}")
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True, name="osc").start()
+        return self
+
+# ---------------------- CLIENT ----------------------
+def _str(s):
+    raw = s.encode("utf-8")
+    return raw + b"\0" * (_pad(len(raw)) - len(raw))
+
+def encode_message(address, *args):
+    tags, body = ",", b""
+    for a in args:
+        if a is True or a is False or a is None:
+            tags += {True: "T", False: "F", None: "N"}[a]
+        elif isinstance(a, int):
+            tags += "i"; body += struct.pack(">i", a)
+        elif isinstance(a, float):
+            tags += "f"; body += struct.pack(">f", a)
+        elif isinstance(a, (bytes, bytearray)):
+            tags += "b"; body += struct.pack(">i", len(a)) + bytes(a) + b"\0" * (-len(a) % 4)
+        else:
+            tags += "s"; body += _str(str(a))
+    return _str(address) + _str(tags) + body
+
+def encode_bundle(messages):
+    return BUNDLE + struct.pack(">Q", 1) + b"".join(struct.pack(">i", len(m)) + m for m in messages)
+
+def send(address, *args, host="127.0.0.1", port=DEFAULT_PORT):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try: sock.sendto(encode_message(address, *args), (host, port))
+    finally: sock.close()
+
+def _cli_arg(text):
+    for kind in (int, float):
+        try: return kind(text)
+        except ValueError: pass
+    return {"true": True, "false": False}.get(text.lower(), text)
+
+def bench(n=100000):
+    hits = [0]
+    def handler(*args): hits[0] += 1
+    d = Dispatcher({"/note/on": handler, "/bpm": handler, "/transport/play": handler})
+    for name, packet in [("/note/on iii", encode_message("/note/on", 1, 60, 100)),
+                         ("/bpm f", encode_message("/bpm", 96.0)),
+                         ("/transport/play s", encode_message("/transport/play", "My Song"))]:
+        t0 = time.perf_counter()
+        for _ in range(n): d.dispatch(packet)
+        print(f"{name:<20}{(time.perf_counter() - t0) / n * 1e6:8.2f} us/packet")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Send one OSC message over UDP (default: the engine on this machine).")
+    ap.add_argument("address", nargs="?")
+    ap.add_argument("args", nargs="*", help="ints, floats, true/false, anything else is a string")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--bench", action="store_true", help="Time decode + dispatch in-process and exit")
+    args = ap.parse_args(argv)
+    if args.bench:
+        bench(); return 0
+    if not args.address or not args.address.startswith("/"):
+        ap.error("an address starting with / is required")
+    send(args.address, *[_cli_arg(a) for a in args.args], host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# Engine state shared between main.py and web_app.py through shared memory.
+#
+# The small, fixed-size part of what update_web_state publishes (mode, index,
+# volume, bpm, flags, battery...) lives in one fixed-layout block in tmpfs
+# that both processes mmap. The engine rewrites it in place; web_app polls a
+# sequence number straight out of the mapping, so an unchanged state costs it
+# no syscall and no parsing.
+#
+# Variable-length data goes to JSON side files next to the block, one per
+# group in SIDE: the file list and SF2 path; the toast and rename text, which
+# must not be cut (SAVE NAME renames to what the page shows); and the network
+# MIDI counters, which move on every heartbeat of a session. A group's
+# file is only rewritten when it changes; the block carries one version per
+# group, so readers load a file only when its number moves.
+#
+# Seqlock: the writer makes seq odd, writes the fields, then makes it even
+# again. A reader retries if seq was odd or changed while it copied.
+#
+# The header also carries the writer's time.monotonic() at publish
+# (CLOCK_MONOTONIC is shared by both processes), so web_app can time the
+# hand-over from engine change to broadcast.
+import os, json, mmap, struct, time
+
+SHM_FILE = "/dev/shm/zompler_state" if os.path.isdir("/dev/shm") else "/tmp/zompler_state"
+MAGIC = b"ZST4"
+
+# (key, struct code). Strings are UTF-8, cut to fit, NUL padded, so only short
+# values with a known bound belong here.
+LAYOUT = [
+    ("mode", "24s"),
+    ("index", "i"),
+    ("volume", "h"),
+    ("bpm", "h"),
+    ("metro_vol", "h"),
+    ("mixer_idx", "h"),
+    ("dsp_level", "h"),
+    ("flags", "H"),
+    ("dsp_load", "f"),
+    ("power_mode", "8s"),
+    ("power_profile", "8s"),
+    ("battery", "24s"),
+    ("list_version", "I"),
+    ("text_version", "I"),
+    ("net_version", "I"),
+]
+FLAGS = ["metronome_on", "is_eco", "is_adjusting"] # bit 0, 1, 2 of "flags"
+# (group, keys): variable length, one side file per group; "<group>_version"
+# in the block
+SIDE = [
+    ("list", ["files", "sf2"]),
+    ("text", ["msg", "rename_tmp"]),
+    ("net", ["net_midi"]),
+]
+
+HEADER = struct.Struct("<4sId") # magic, seq, published
+BLOCK = struct.Struct("<" + "".join(code for _, code in LAYOUT))
+SIZE = HEADER.size + BLOCK.size
+SEQ_OFFSET = 4
+STAMP_OFFSET = 8
+REOPEN_CHECK = 1.0 # seconds between checks that the file wasn't replaced
+
+def _fit(text, size):
+    raw = str(text).encode("utf-8")[:size]
+    return raw.decode("utf-8", "ignore").encode("utf-8") # don't cut a character in half
+
+def _side_file(path, group):
+    return f"{path}.{group}.json"
+
+def pack(state, versions):
+    values = []
+    for key, code in LAYOUT:
+        if key == "flags":
+            values.append(sum(1 << i for i, f in enumerate(FLAGS) if state.get(f)))
+        elif key.endswith("_version"):
+            values.append(versions[key[:-len("_version")]])
+        elif code.endswith("s"):
+            values.append(_fit(state.get(key, ""), int(code[:-1])))
+        else:
+            values.append(state.get(key, 0))
+    return BLOCK.pack(*values)
+
+def unpack(raw):
+    state = {}
+    for (key, code), v in zip(LAYOUT, BLOCK.unpack(raw)):
+        if key == "flags":
+            for i, f in enumerate(FLAGS): state[f] = bool(v >> i & 1)
+        elif code.endswith("s"):
+            state[key] = v.rstrip(b"\0").decode("utf-8", "ignore")
+        elif key == "dsp_load":
+            state[key] = round(v, 1)
+        else:
+            state[key] = v
+    return state
+
+# ---------------------- WRITER (main.py) ----------------------
+class StateWriter:
+    def __init__(self, path=SHM_FILE):
+        self.path = path
+        # Reuse the file instead of replacing it, so a web_app that mapped it
+        # before an engine restart keeps seeing updates
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE: os.ftruncate(fd, SIZE)
+            self.mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        magic, seq, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC: seq = 0
+        self.seq = (seq + 1) & ~1 # even, and past whatever readers last saw
+        old = unpack(self.mm[HEADER.size:]) if magic == MAGIC else {}
+        self.versions = {g: (old.get(g + "_version", 0) + 1) & 0xFFFFFFFF for g, _ in SIDE}
+        self.last_side = {}
+        self.last_block = None
+
+    def publish(self, state):
+        for group, keys in SIDE:
+            part = {k: state.get(k) for k in keys}
+            if part == self.last_side.get(group): continue
+            tmp = _side_file(self.path, group) + ".tmp"
+            with open(tmp, "w") as f: json.dump(part, f)
+            os.replace(tmp, _side_file(self.path, group))
+            self.last_side[group] = part
+            self.versions[group] = (self.versions[group] + 1) & 0xFFFFFFFF
+        block = pack(state, self.versions)
+        if block == self.last_block: return False
+        self.seq = (self.seq + 1) & 0xFFFFFFFF # odd: write in progress
+        struct.pack_into("<I", self.mm, SEQ_OFFSET, self.seq)
+        stamp = time.monotonic()
+        struct.pack_into("<d", self.mm, STAMP_OFFSET, stamp)
+        self.mm[HEADER.size:SIZE] = block
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        HEADER.pack_into(self.mm, 0, MAGIC, self.seq, stamp)
+        self.last_block = block
+        return True
+
+# ---------------------- READER (web_app.py, bounce.py) ----------------------
+class StateReader:
+    def __init__(self, path=SHM_FILE):
+        self.path = path
+        self.mm = None
+        self.ino = None
+        self.checked = 0.0
+        self.seq = None
+        self.versions = {g: None for g, _ in SIDE}
+        self.side = {k: None for _, keys in SIDE for k in keys}
+        self.state = None
+        self.published = None # writer's time.monotonic() for self.state
+
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_size < SIZE: return False
+                self.mm = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+            self.ino = st.st_ino; self.seq = None; self.versions = dict.fromkeys(self.versions)
+            return True
+        except OSError:
+            return False
+
+    def poll(self):
+        # New state dict if the engine published since the last call, else None
+        now = time.monotonic()
+        if self.mm is not None and now - self.checked >= REOPEN_CHECK:
+            # Someone deleted the file (cleanup script) and the engine made a
+            # new one: our mapping would be stale forever
+            self.checked = now
+            try: stale = os.stat(self.path).st_ino != self.ino
+            except OSError: stale = False
+            if stale: self.mm.close(); self.mm = None
+        if self.mm is None and not self._open(): return None
+        for _ in range(100):
+            magic, s1, stamp = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC: return None
+            if s1 == self.seq: return None
+            if s1 & 1: continue # writer mid-update
+            raw = self.mm[HEADER.size:SIZE]
+            if struct.unpack_from("<I", self.mm, SEQ_OFFSET)[0] != s1: continue
+            break
+        else:
+            return None
+        state = unpack(raw)
+        for group, _ in SIDE:
+            version = state.pop(group + "_version")
+            if version == self.versions[group]: continue
+            try:
+                with open(_side_file(self.path, group), "r") as f: self.side.update(json.load(f))
+                self.versions[group] = version
+            except (OSError, ValueError):
+                return None # not there yet; seq left alone so the next poll retries
+        state.update(self.side)
+        self.seq = s1
+        self.state = state
+        self.published = stamp
+        return state
+
+    def snapshot(self):
+        # Latest state, whether or not it changed
+        self.poll()
+        return self.state
+
+def read_state(path=SHM_FILE):
+    # One-off read for short-lived tools
+    return StateReader(path).snapshot()
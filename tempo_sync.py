@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# Tempo, beat phase and transport shared between Zomplers on one network,
+# peer to peer over UDP multicast. Same idea as Ableton Link, own (JSON)
+# wire format: no server, any peer can change the tempo or start/stop.
+#
+# Every peer keeps the same timeline in a shared "session clock":
+#
+#   beat(t) = (t - origin) * bpm / 60
+#
+# The peer with the lowest id is the clock reference. The others measure
+# their offset to it with ping/pong timestamps (t0 sent, t1 received there,
+# t2 replied, t3 back) and keep the sample with the shortest round trip of
+# the last SAMPLES; its error is at most half that round trip (~0.1 ms on a
+# quiet hotspot, µs on one host). When the reference leaves, the next lowest
+# takes over and everyone moves their timeline into its clock.
+#
+# A tempo change keeps the current beat where it is (only origin moves), so
+# running metronomes don't jump. Starting the transport picks the next bar
+# as the start beat, far enough ahead that every peer hears about it in
+# time. Conflicting changes: the later one (in session time) wins; a peer
+# that was never touched defers to the group it joins.
+#
+# Several instances on one host (SO_REUSEPORT + multicast loopback):
+#
+#   python3 tempo_sync.py --node                  # one peer, print beats and offset
+#   python3 tempo_sync.py --test 4 --seconds 12   # 4 peers with skewed clocks; tick spread
+import sys, os, socket, select, struct, threading, json, math, time, random, argparse, subprocess
+
+GROUP = "239.255.77.77"
+DEFAULT_PORT = 20809
+QUANTUM = 4          # beats per bar; transport starts on a bar line
+ANNOUNCE_EVERY = 0.5 # timeline + liveness
+PING_EVERY = 0.25
+PEER_TIMEOUT = 2.0
+SAMPLES = 16         # offset samples kept; the shortest round trip wins
+
+def _key(ver):
+    # Newest user change wins; among untouched timelines the oldest does
+    changed, t, node = ver
+    return (changed, t if changed else -t, node)
+
+class Timeline:
+    # Tempo (bpm, origin) and transport (playing, start_beat) carry their own
+    # versions, (changed by a user, session time of the change, node id), so
+    # a tempo change and a start from two peers at once both survive
+    def __init__(self, bpm, origin, playing=False, start_beat=0.0, tver=(0, 0.0, ""), pver=(0, 0.0, "")):
+        self.bpm = float(bpm)
+        self.origin = origin
+        self.playing = playing
+        self.start_beat = start_beat
+        self.tver = tuple(tver)
+        self.pver = tuple(pver)
+
+    def beat_at(self, t):
+        return (t - self.origin) * self.bpm / 60.0
+
+    def time_at(self, beat):
+        return self.origin + beat * 60.0 / self.bpm
+
+    def merge(self, other):
+        # Take whichever half of other is newer; True if anything changed
+        changed = False
+        if _key(other.tver) > _key(self.tver):
+            self.bpm, self.origin, self.tver = other.bpm, other.origin, other.tver; changed = True
+        if _key(other.pver) > _key(self.pver):
+            self.playing, self.start_beat, self.pver = other.playing, other.start_beat, other.pver; changed = True
+        return changed
+
+    def shift(self, d):
+        # Same timeline, session clock moved by d
+        self.origin += d
+        self.tver = (self.tver[0], self.tver[1] + d, self.tver[2])
+        self.pver = (self.pver[0], self.pver[1] + d, self.pver[2])
+
+    def to_msg(self):
+        return {"bpm": self.bpm, "origin": self.origin, "playing": self.playing,
+                "start": self.start_beat, "tver": list(self.tver), "pver": list(self.pver)}
+
+    @classmethod
+    def from_msg(cls, m):
+        return cls(m["bpm"], m["origin"], bool(m["playing"]), m["start"], m["tver"], m["pver"])
+
+def _socket(group, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"): # several peers on one host
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0")))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+class TempoSync:
+    # on_change(bpm, playing) runs on the receiver thread when a peer's change
+    # is adopted. clock is this peer's local clock (tests pass skewed ones).
+    def __init__(self, bpm=120.0, on_change=None, port=DEFAULT_PORT, group=GROUP,
+                 quantum=QUANTUM, clock=time.monotonic, node_id=None):
+        self.id = node_id or os.urandom(4).hex()
+        self.on_change = on_change
+        self.addr = (group, port)
+        self.quantum = quantum
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sock = _socket(group, port)
+        self.ref = self.id     # clock reference
+        self.offset = 0.0      # session time = local time + offset
+        self.synced = True     # offset to ref is known
+        self.rebase_from = 0.0 # offset the timeline is in while re-syncing to a new ref
+        self.samples = []      # (rtt, offset)
+        self.peers = {}        # id -> local time last heard
+        now = clock()
+        self.tl = Timeline(bpm, now, tver=(0, now, self.id), pver=(0, now, self.id))
+        self.running = False
+
+    # --- timeline, in this peer's local clock ---
+    def beat_at(self, t=None):
+        with self.lock: return self.tl.beat_at((self.clock() if t is None else t) + self.offset)
+
+    def time_at(self, beat):
+        with self.lock: return self.tl.time_at(beat) - self.offset
+
+    def next_beat(self, after=None):
+        # (beat, local time) of the first beat after `after` (now) the transport plays
+        t = self.clock() if after is None else after
+        with self.lock:
+            beat = max(math.floor(self.tl.beat_at(t + self.offset)) + 1, math.ceil(self.tl.start_beat - 1e-9))
+            return beat, self.tl.time_at(beat) - self.offset
+
+    def until_bar(self):
+        # Seconds to the next bar line
+        now = self.clock()
+        with self.lock:
+            bar = math.floor(self.tl.beat_at(now + self.offset) / self.quantum + 1) * self.quantum
+            return self.tl.time_at(bar) - self.offset - now
+
+    def state(self):
+        with self.lock: return self.tl.bpm, self.tl.playing
+
+    # --- local changes ---
+    def _announce(self):
+        self._send(dict(self.tl.to_msg(), k="tl", id=self.id))
+
+    def set_tempo(self, bpm):
+        with self.lock:
+            now = self.clock() + self.offset
+            beat = self.tl.beat_at(now)
+            self.tl.bpm = float(bpm)
+            self.tl.origin = now - beat * 60.0 / self.tl.bpm
+            self.tl.tver = (1, now, self.id)
+            self._announce()
+
+    def set_playing(self, on):
+        with self.lock:
+            now = self.clock() + self.offset
+            if on and not self.tl.playing:
+                if self._alive(self.clock()):
+                    # Next bar line at least a beat away: late peers still make it
+                    self.tl.start_beat = math.ceil((self.tl.beat_at(now) + 1) / self.quantum) * self.quantum
+                else:
+                    # Alone: start right away, on beat 0
+                    self.tl.origin = now + 0.05
+                    self.tl.start_beat = 0.0
+                    self.tl.tver = (1, now, self.id)
+            self.tl.playing = bool(on)
+            self.tl.pver = (1, now, self.id)
+            self._announce()
+
+    def update(self, bpm, playing):
+        # The engine's current values; only differences count as changes
+        cur_bpm, cur_playing = self.state()
+        if round(cur_bpm) != round(bpm): self.set_tempo(bpm)
+        if cur_playing != bool(playing): self.set_playing(playing)
+
+    # --- network ---
+    def _send(self, msg):
+        try: self.sock.sendto(json.dumps(msg, separators=(",", ":")).encode(), self.addr)
+        except OSError as e: print(f"Tempo sync: {e}")
+
+    def _alive(self, now):
+        return [p for p, seen in self.peers.items() if now - seen < PEER_TIMEOUT]
+
+    def _handle(self, msg, t_recv):
+        kind, sender = msg.get("k"), msg.get("id")
+        if sender == self.id or not sender: return # our own, looped back
+        adopted = None
+        with self.lock:
+            if sender not in self.peers: print(f"Tempo sync: peer {sender} joined")
+            self.peers[sender] = t_recv
+            if kind == "ping" and msg.get("to") == self.id:
+                self._send({"k": "pong", "id": self.id, "to": sender, "t0": msg["t0"], "t1": t_recv, "t2": self.clock()})
+            elif kind == "pong" and msg.get("to") == self.id and sender == self.ref:
+                t0, t1, t2 = msg["t0"], msg["t1"], msg["t2"]
+                self.samples = (self.samples + [((t_recv - t0) - (t2 - t1), ((t1 - t0) + (t2 - t_recv)) / 2)])[-SAMPLES:]
+                self.offset = min(self.samples)[1]
+                if not self.synced:
+                    self.tl.shift(self.offset - self.rebase_from)
+                    self.synced = True
+            elif kind == "tl" and self.synced:
+                before = (round(self.tl.bpm), self.tl.playing)
+                if self.tl.merge(Timeline.from_msg(msg)):
+                    if (round(self.tl.bpm), self.tl.playing) != before: adopted = (self.tl.bpm, self.tl.playing)
+        if adopted and self.on_change: self.on_change(*adopted)
+
+    def _tick(self, now):
+        with self.lock:
+            for p in [p for p, seen in self.peers.items() if now - seen >= PEER_TIMEOUT]:
+                del self.peers[p]; print(f"Tempo sync: peer {p} left")
+            ref = min(self._alive(now) + [self.id])
+            if ref != self.ref:
+                if self.synced: self.rebase_from = self.offset
+                self.ref, self.samples = ref, []
+                if ref == self.id: # we are the clock now
+                    self.tl.shift(-self.rebase_from)
+                    self.offset, self.synced = 0.0, True
+                else:
+                    self.synced = False
+            if self.ref != self.id:
+                self._send({"k": "ping", "id": self.id, "to": self.ref, "t0": self.clock()})
+            if self.synced and now >= self.next_announce:
+                self._announce()
+                self.next_announce = now + ANNOUNCE_EVERY
+            # Quick burst until the offset is known, then steady
+            return PING_EVERY if self.synced and len(self.samples) >= 4 or self.ref == self.id else 0.03
+
+    def _run(self):
+        self.next_announce = 0.0
+        next_tick = 0.0
+        while self.running:
+            now = self.clock()
+            if now >= next_tick:
+                next_tick = now + self._tick(now)
+            try:
+                ready, _, _ = select.select([self.sock], [], [], max(0.0, next_tick - now))
+                if not ready: continue
+                data, _ = self.sock.recvfrom(2048)
+                t_recv = self.clock()
+                self._handle(json.loads(data), t_recv)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self.running: print(f"Tempo sync: {e}")
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True, name="tempo-sync").start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+    def stats(self):
+        with self.lock:
+            best = min(self.samples) if self.samples else None
+            return {"peers": len(self._alive(self.clock())), "reference": self.ref == self.id,
+                    "synced": self.synced, "bpm": self.tl.bpm, "playing": self.tl.playing,
+                    "offset_ms": round(self.offset * 1000, 3),
+                    "rtt_ms": round(best[0] * 1000, 3) if best else None}
+
+# ---------------------- TEST TOOLS ----------------------
+def run_node(port, seconds, skew, script, report):
+    # One peer with a clock `skew` seconds off. It ticks like the engine's
+    # metronome and, with --report, prints the true (unskewed) time of each
+    # tick as JSON at the end.
+    clock = lambda: time.monotonic() + skew
+    sync = TempoSync(120.0, port=port, clock=clock).start()
+    end = time.monotonic() + seconds
+    actions = sorted((float(at), what) for at, what in (a.split(":", 1) for a in script))
+    ticks, last = {}, None
+    start = time.monotonic()
+    while time.monotonic() < end:
+        while actions and time.monotonic() - start >= actions[0][0]:
+            what = actions.pop(0)[1]
+            if what == "play": sync.set_playing(True)
+            elif what == "stop": sync.set_playing(False)
+            else: sync.set_tempo(float(what))
+        bpm, playing = sync.state()
+        if not playing:
+            time.sleep(0.05); continue
+        beat, t = sync.next_beat()
+        if last is not None and beat <= last: beat, t = last + 1, sync.time_at(last + 1)
+        wait = t - clock()
+        if wait > 0.1: time.sleep(0.1); continue
+        if wait > 0: time.sleep(wait)
+        ticks[beat] = time.monotonic()
+        last = beat
+        if not report: print(f"beat {beat:5d}  bpm {bpm:6.1f}  {sync.stats()}")
+    if report: print(json.dumps({"id": sync.id, "ticks": ticks, "stats": sync.stats()}))
+    sync.stop()
+
+def run_test(n, port, seconds):
+    # n peers in subprocesses, clocks skewed by up to +-5 s; the first starts
+    # the transport, the second changes tempo twice. Ticks from the last
+    # third of the run are compared across peers.
+    procs = []
+    for i in range(n):
+        script = {0: ["1.5:play"], 1: [f"{seconds * 0.4:.1f}:133", f"{seconds * 0.55:.1f}:90"]}.get(i, [])
+        cmd = [sys.executable, os.path.abspath(__file__), "--node", "--report", "--port", str(port),
+               "--seconds", str(seconds), "--skew", f"{random.uniform(-5, 5):.6f}"] + [f"--at={a}" for a in script]
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True))
+    results = []
+    for p in procs:
+        out = p.communicate()[0].strip().splitlines()
+        results.append(json.loads(out[-1]))
+    beats = set.intersection(*[set(r["ticks"]) for r in results])
+    settled = sorted(beats, key=int)[len(beats) * 2 // 3:]
+    spreads = sorted((max(r["ticks"][b] for r in results) - min(r["ticks"][b] for r in results)) * 1000 for b in settled)
+    for r in results:
+        s = r["stats"]
+        print(f"peer {r['id']}  ref={s['reference']!s:<5} bpm {s['bpm']:.1f}  ticks {len(r['ticks']):3d}  "
+              f"offset {s['offset_ms']:10.3f} ms  rtt {s['rtt_ms']} ms")
+    if not spreads:
+        print("no common ticks"); return 1
+    print(f"{len(settled)} beats ticked by all {n} peers: spread median {spreads[len(spreads) // 2]:.3f} ms, "
+          f"max {spreads[-1]:.3f} ms")
+    return 0 if spreads[-1] < 1.0 else 1
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tempo sync test tools (several peers can share one host).")
+    ap.add_argument("--node", action="store_true", help="Run one peer that ticks on the shared beat")
+    ap.add_argument("--test", type=int, metavar="N", help="Run N peers and report how well their ticks line up")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("ZOMPLER_SYNC_PORT", DEFAULT_PORT)))
+    ap.add_argument("--seconds", type=float, default=12.0)
+    ap.add_argument("--skew", type=float, default=0.0, help="--node: offset this peer's clock")
+    ap.add_argument("--at", action="append", default=[], metavar="SEC:ACTION",
+                    help="--node: play, stop or a bpm, SEC seconds after start (repeatable)")
+    ap.add_argument("--report", action="store_true", help="--node: print tick times as JSON at the end")
+    args = ap.parse_args(argv)
+    if args.test:
+        return run_test(args.test, args.port, args.seconds)
+    if args.node:
+        run_node(args.port, args.seconds, args.skew, args.at if args.at or args.report else ["1:play"], args.report); return 0
+    ap.error("--node or --test")
+
+if __name__ == "__main__":
+    sys.exit(main())
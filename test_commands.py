@@ -0,0 +1,31 @@
+# Malformed remote commands must be reported, not crash the engine:
+#
+#   python3 -m pytest -q test_commands.py
+import os, tempfile
+
+os.environ["ZOMPLER_HOME"] = tempfile.mkdtemp(prefix="zompler-test-")
+os.environ["ZOMPLER_FAKE_UPS"] = "1"
+import main
+
+def midi(name):
+    path = os.path.join(main.midi_file_folder, name + ".mid")
+    with open(path, "wb") as f: f.write(b"MThd")
+    return path
+
+def test_malformed_rename_entry_is_reported_and_the_rest_applies():
+    midi("a"); midi("c")
+    err = main.apply_command({"op": "rename_files", "renames": [["d"], ["a", "b"], 5, ["c", 7]]})
+    assert err and "expected [name, new_name]" in err
+    assert sorted(os.listdir(main.midi_file_folder)) == ["b.mid", "c.mid"]
+
+def test_out_of_range_number_is_reported():
+    before = main.volume_level
+    err = main.apply_command([{"op": "set_volume", "value": 1e999}, {"op": "set_bpm", "value": 100}])
+    assert err.startswith("set_volume:")
+    assert main.volume_level == before and main.bpm == 100
+
+def test_bad_command_file_is_consumed():
+    path = os.path.join(main.BASE_DIR, "cmd_op_1.json")
+    with open(path, "w") as f: f.write('{"op": "rename_files", "renames": [["d"]]}')
+    assert main.poll_command_files()
+    assert not os.path.exists(path)
@@ -0,0 +1,77 @@
+# RTP-MIDI parsing, loss counting and the jitter buffer, on loopback:
+#
+#   python3 -m pytest -q test_netmidi.py
+import queue, socket, time
+import netmidi
+
+SSRC = 0x1234
+
+def server(latency_ms=0.0):
+    # Receiver on a free loopback port pair; played events land in got
+    got = queue.Queue()
+    for _ in range(20):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(("127.0.0.1", 0)); port = probe.getsockname()[1]; probe.close()
+        try: return got, netmidi.RtpMidiServer(got.put, port, "test", latency_ms, "127.0.0.1")
+        except (OSError, OverflowError): pass # port + 1 taken
+    raise OSError("no free port pair")
+
+def rtp(seq, payload, ts=0):
+    return netmidi.RTP.pack(0x80, 0x61, seq & 0xFFFF, ts, SSRC) + payload
+
+def note(n):
+    return bytes([3, 0x90, n, 100])
+
+def drain(got):
+    out = []
+    while not got.empty(): out.append(got.get())
+    return out
+
+def test_running_status_and_multi_byte_delta():
+    body = bytes([0x90, 60, 100, 0x81, 0x00, 62, 100, 0x00, 0xF8, 0x00, 64, 100])
+    assert netmidi.parse_commands(bytes([len(body)]) + body) == [
+        (0, [0x90, 60, 100]),
+        (128, [0x90, 62, 100]), # running status
+        (128, [0xF8]),          # realtime in between...
+        (128, [0x90, 64, 100]), # ...keeps it
+    ]
+
+def test_long_header_first_delta_and_sysex_skip():
+    body = bytes([5, 0xB0, 7, 100])
+    for n in range(5): body += bytes([10, 0x91, 48 + n, 90])
+    body += bytes([0, 0xF0, 0x7D, 0x01, 0xF7, 0, 0xC2, 5])
+    events = netmidi.parse_commands(bytes([0x80 | 0x20 | len(body) >> 8, len(body) & 0xFF]) + body)
+    assert events[0] == (5, [0xB0, 7, 100]) # Z: the first command has a delta too
+    assert [d for d, _ in events[1:6]] == [15, 25, 35, 45, 55]
+    assert events[6] == (55, [0xC2, 5])
+    assert len(events) == 7
+
+def test_gap_late_packet_and_dupes_across_wraparound():
+    got, srv = server()
+    srv.sessions[SSRC] = netmidi.Session(SSRC, "laptop", ("127.0.0.1", 1))
+    for seq, n in [(0xFFFE, 60), (0xFFFF, 61), (2, 64), (0, 62), (0, 62), (2, 64)]:
+        srv._rtp(rtp(seq, note(n)), time.monotonic())
+    assert [m[1] for m in drain(got)] == [60, 61, 64, 62] # the late one still plays, dupes don't
+    st = srv.stats()
+    assert (st["packets"], st["lost"], st["reordered"]) == (4, 1, 1)
+    assert st["loss_pct"] == 20.0
+    assert srv.sessions[SSRC].dupes == 2
+
+def test_session_over_loopback_plays_events_at_their_timestamps():
+    got, srv = server(latency_ms=50)
+    srv.start()
+    ctrl, data = (socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2))
+    ctrl.settimeout(2); data.settimeout(2)
+    invite = netmidi.APPLEMIDI.pack(0xFFFF, b"IN", netmidi.PROTOCOL_VERSION, 1, SSRC) + b"laptop\0"
+    for sock, sock_srv in ((ctrl, srv.ctrl), (data, srv.data)):
+        sock.sendto(invite, sock_srv.getsockname())
+        assert sock.recv(256)[2:4] == b"OK"
+    # Note on now, note off 20 ms later by the sender's clock, in one packet
+    payload = netmidi.encode_commands([(0, [0x90, 60, 100]), (200, [0x80, 60, 0])])
+    data.sendto(rtp(7, payload), srv.data.getsockname())
+    first = got.get(timeout=2); t_first = time.monotonic()
+    second = got.get(timeout=2); spacing = time.monotonic() - t_first
+    assert (first, second) == ([0x90, 60, 100], [0x80, 60, 0])
+    assert 0.015 < spacing < 0.5
+    assert srv.stats()["peer"] == "laptop" and srv.stats()["packets"] == 1
+    srv.running = False
@@ -0,0 +1,38 @@
+# OSC from a local UDP client reaches the dispatcher's handlers:
+#
+#   python3 -m pytest -q test_osc.py
+import queue, socket
+import osc
+
+def serve(addresses):
+    # Server on an ephemeral loopback port; each handler call lands in got
+    got = queue.Queue()
+    table = {addr: (lambda addr: lambda *args: got.put((addr, tuple(args))))(addr) for addr in addresses}
+    server = osc.OscServer(table, 0, "127.0.0.1").start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return got, lambda packet: sock.sendto(packet, server.sock.getsockname())
+
+def test_message_reaches_its_handler():
+    got, send = serve(["/note/on", "/transport/stop"])
+    send(osc.encode_message("/note/on", 1, 60, 100))
+    assert got.get(timeout=2) == ("/note/on", (1, 60, 100))
+    send(osc.encode_message("/transport/stop"))
+    assert got.get(timeout=2) == ("/transport/stop", ())
+
+def test_bundle_runs_every_message_in_order():
+    got, send = serve(["/bpm", "/transport/play", "/metronome"])
+    send(osc.encode_bundle([osc.encode_message("/bpm", 96.0),
+                            osc.encode_message("/transport/play", "My Song"),
+                            osc.encode_message("/metronome", True)]))
+    assert got.get(timeout=2) == ("/bpm", (96.0,))
+    assert got.get(timeout=2) == ("/transport/play", ("My Song",))
+    assert got.get(timeout=2) == ("/metronome", (True,))
+
+def test_bad_packets_do_not_stop_the_server():
+    got, send = serve(["/volume"])
+    send(b"/volume") # no terminator
+    send(osc.encode_message("/nowhere", 1))
+    send(osc.encode_message("/volume", 1)[:-2]) # int cut short
+    send(osc.encode_message("/volume", 80))
+    assert got.get(timeout=2) == ("/volume", (80,))
+    assert got.empty()
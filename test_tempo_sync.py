@@ -0,0 +1,86 @@
+# Timeline merge (last user change wins) and the clock offset choice
+# (shortest round trip wins), without a second peer:
+#
+#   python3 -m pytest -q test_tempo_sync.py
+import socket
+import tempo_sync
+from tempo_sync import Timeline
+
+def test_newer_user_change_wins_each_half_on_its_own():
+    a = Timeline(100, 0.0, False, 0.0, tver=(1, 10.0, "a"), pver=(1, 13.0, "a"))
+    b = Timeline(130, 2.0, True, 8.0, tver=(1, 12.0, "b"), pver=(1, 11.0, "b"))
+    assert a.merge(b)
+    assert (a.bpm, a.origin) == (130, 2.0) # b's tempo is newer...
+    assert (a.playing, a.start_beat) == (False, 0.0) # ...a's stop is newer
+    assert b.merge(a) and (b.bpm, b.playing) == (130, False)
+    assert a.to_msg() == b.to_msg() # both ends agree
+
+def test_untouched_timelines_defer_to_the_oldest():
+    young = Timeline(120, 50.0, tver=(0, 50.0, "a"), pver=(0, 50.0, "a"))
+    old = Timeline(90, 20.0, tver=(0, 20.0, "b"), pver=(0, 20.0, "b"))
+    assert young.merge(old) and young.bpm == 90
+    assert not old.merge(Timeline(120, 50.0, tver=(0, 50.0, "a"), pver=(0, 50.0, "a")))
+
+def test_any_user_change_beats_an_untouched_timeline():
+    touched = Timeline(100, 0.0, tver=(1, 5.0, "z"))
+    untouched = Timeline(140, 0.0, tver=(0, 1.0, "a"))
+    assert not touched.merge(untouched)
+    assert untouched.merge(touched) and untouched.bpm == 100
+
+def test_same_time_ties_go_to_the_higher_id_on_both_peers():
+    a = Timeline(100, 0.0, tver=(1, 10.0, "a"))
+    b = Timeline(110, 0.0, tver=(1, 10.0, "b"))
+    a.merge(b); b.merge(a)
+    assert a.bpm == b.bpm == 110
+
+def peer(now):
+    # A peer on a free port whose clock reads now[0]; "a" is its reference
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(("", 0)); port = probe.getsockname()[1]; probe.close()
+    sync = tempo_sync.TempoSync(120, port=port, clock=lambda: now[0], node_id="b")
+    sync.ref = "a"
+    return sync
+
+def pong(sync, now, t0, offset, up, down):
+    # Reference clock = ours + offset; up/down are the one-way delays
+    t1 = t0 + up + offset
+    t2 = t1 + 0.0001
+    now[0] = t2 - offset + down
+    sync._handle({"k": "pong", "id": "a", "to": "b", "t0": t0, "t1": t1, "t2": t2}, now[0])
+
+def test_offset_comes_from_the_shortest_round_trip():
+    now = [0.0]
+    sync = peer(now)
+    try:
+        pong(sync, now, 1.0, 5.0, 0.020, 0.001) # slow and lopsided: 9.5 ms off
+        pong(sync, now, 2.0, 5.0, 0.0005, 0.0005) # fast: exact
+        pong(sync, now, 3.0, 5.0, 0.001, 0.009)
+        assert abs(sync.offset - 5.0) < 1e-9
+        assert abs(sync.stats()["rtt_ms"] - 1.0) < 1e-6
+        # The fast one ages out after SAMPLES newer ones
+        for i in range(tempo_sync.SAMPLES):
+            pong(sync, now, 10.0 + i, 5.0, 0.004, 0.002)
+        assert abs(sync.offset - 5.001) < 1e-9
+    finally:
+        sync.stop()
+
+def test_pongs_from_anyone_but_the_reference_are_ignored():
+    now = [0.0]
+    sync = peer(now)
+    try:
+        sync._handle({"k": "pong", "id": "c", "to": "b", "t0": 0.0, "t1": 7.0, "t2": 7.0}, 0.001)
+        assert sync.offset == 0.0 and not sync.samples
+    finally:
+        sync.stop()
+
+def test_first_offset_to_a_new_reference_moves_the_timeline_with_it():
+    now = [0.0]
+    sync = peer(now)
+    try:
+        origin = sync.tl.origin
+        sync.synced, sync.rebase_from = False, 0.0
+        pong(sync, now, 1.0, 5.0, 0.0005, 0.0005)
+        assert sync.synced
+        assert abs(sync.tl.origin - (origin + 5.0)) < 1e-9 # same beats, new clock
+    finally:
+        sync.stop()
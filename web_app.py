@@ -1,224 +1,1370 @@
-
-import eventlet
-eventlet.monkey_patch() 
-
-import json, os, time
-from flask import Flask, render_template_string, send_from_directory
-from flask_socketio import SocketIO
-
-# 1. DEFINE PATHS FIRST
-BASE_DIR = "/home/pi/midifileplayer"
-STATE_FILE = os.path.join(BASE_DIR, "monkey_state.json")
-
-app = Flask(__name__)
-# Removing explicit eventlet here often helps stability on Pi Zero 2W
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# 2. DEFINE ROUTES
-@app.route('/socket.io.js')
-def serve_socket_io():
-    return send_from_directory(BASE_DIR, 'socket.io.min.js')
-
-IS_BUSY = False
-
-# ... rest of your code and render_template_string ...
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Monkey MIDI Remote</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-    <script src="/socket.io.js"></script>
-    <style>
-        body { background: #111; color: white; font-family: sans-serif; text-align: center; margin: 0; padding: 0; overflow: hidden; }
-        #status-bar { 
-            background: #222; color: #0f0; padding: 12px; font-weight: bold; 
-            border-bottom: 2px solid #444; display: flex; justify-content: space-between;
-        }
-        #menu-container { height: 55vh; overflow-y: auto; scroll-behavior: smooth; border-bottom: 1px solid #333; }
-        .menu-item { padding: 16px; border-bottom: 1px solid #222; font-size: 1.1em; transition: 0.1s; }
-        .controls { display: grid; grid-template-columns: 1fr 1fr; gap: 10px; padding: 15px; }
-        button { 
-            padding: 20px; font-size: 1.2em; background: #333; color: white; 
-            border: 1px solid #555; border-radius: 10px; outline: none;
-        }
-        button:active { background: #007bff; transform: scale(0.98); }
-        .sel-btn { background: #0062cc; grid-column: span 2; font-weight: bold; }
-        .back-btn { background: #a51d2d; grid-column: span 2; }
-        .bar-container { width: 80%; background: #333; height: 15px; margin: 10px auto; border-radius: 10px; overflow: hidden; }
-        .bar-fill { height: 100%; background: #007bff; transition: width 0.2s; }
-    </style>
-</head>
-<body>
-    <div id="status-bar">
-        <span id="mode-text">CONNECTING...</span>
-        <span id="batt-text" style="color: #aaa;">--:--</span>
-    </div>
-    <div id="menu-container"></div>
-    <div class="controls">
-        <button onclick="sendCmd('up')">UP</button>
-        <button onclick="sendCmd('down')">DOWN</button>
-        <button class="sel-btn" onclick="sendCmd('select')">SELECT / OK</button>
-        <button class="back-btn" onclick="sendCmd('back')">BACK / MENU</button>
-    </div>
-
-    <script>
-    // Using io() without parameters tells it to use the current URL and Port automatically
-    var socket = io({
-        transports: ['polling', 'websocket'],
-        upgrade: true,
-        reconnection: true,
-        reconnectionAttempts: Infinity, // Keep trying until the Pi wakes up
-        reconnectionDelay: 1000,        // Try every 1 second
-        timeout: 2000                  // Wait 2s before timing out an attempt
-    });
-
-    function sendCmd(name) { 
-        socket.emit('control', {btn: name}); 
-    }
-
-    // Triggered the very second the Pi and Phone shake hands
-    socket.on('connect', function() {
-        console.log("Websocket Connected!");
-        const modeEl = document.getElementById('mode-text');
-        if (modeEl && modeEl.innerText === "CONNECTING...") {
-            modeEl.innerText = "LOADING DATA...";
-        }
-    });
-
-    socket.on('state_update', function(data) {
-        if(!data) return;
-
-        // --- SAFETY: HIDE OVERLAY IF IT EXISTS ---
-        // If you have a <div> with id="overlay", this hides it.
-        const overlay = document.getElementById('overlay');
-        if(overlay) overlay.style.display = 'none';
-
-        // 1. Update Battery
-        document.getElementById('batt-text').innerText = data.battery || "0:00";
-        
-        const modeEl = document.getElementById('mode-text');
-        const menuContainer = document.getElementById('menu-container');
-        
-        // 2. Header/Mode Logic
-        // This overwrites "CONNECTING..." with the actual state from the Pi
-        if (data.msg) {
-            modeEl.innerText = data.msg;
-            modeEl.style.color = "#ff4444";
-        } else {
-            modeEl.innerText = (data.mode || "MAIN").toUpperCase();
-            modeEl.style.color = data.is_eco ? "#fbff00" : "#00ff00";
-        }
-
-        // 3. Specialized Screen Logic
-        let html = '';
-        
-        if (data.mode === "VOLUME") {
-            html = `
-                <div style="padding: 40px;">
-                    <h2 style="color: #aaa;">MASTER VOLUME</h2>
-                    <div style="font-size: 5em; font-weight: bold; color: #00ff00;">${data.volume}%</div>
-                    <div class="bar-container">
-                        <div class="bar-fill" style="width: ${data.volume}%; background: #00ff00;"></div>
-                    </div>
-                </div>`;
-        } 
-        else if (data.mode === "METRONOME") {
-            let statusColor = data.metronome_on ? "#00ff00" : "#ff4444";
-            let sel = parseInt(data.index);
-            html = `
-                <div style="padding: 20px;">
-                    <h2 style="color: #aaa;">METRONOME</h2>
-                    <div style="padding: 10px; border-radius: 10px; ${sel === 0 ? 'border: 2px solid yellow; background: #222;' : ''}">
-                        <div style="font-size: 1.5em; color: ${statusColor}; font-weight: bold;">
-                            ${data.metronome_on ? "● ACTIVE" : "○ OFF"}
-                        </div>
-                    </div>
-                    <div style="margin-top: 15px; padding: 10px; border-radius: 10px; ${sel === 1 ? 'border: 2px solid #007bff; background: #222;' : ''}">
-                        <div style="font-size: 0.8em; color: #888;">TEMPO</div>
-                        <div style="font-size: 3em; font-weight: bold;">${data.bpm} <span style="font-size: 0.4em;">BPM</span></div>
-                    </div>
-                    <div style="margin-top: 15px; padding: 10px; border-radius: 10px; ${sel === 2 ? 'border: 2px solid #007bff; background: #222;' : ''}">
-                        <div style="font-size: 0.8em; color: #888;">CLICK VOLUME</div>
-                        <div style="font-size: 2em; font-weight: bold; color: #007bff;">${data.metro_vol}</div>
-                        <div class="bar-container" style="width: 60%;">
-                            <div class="bar-fill" style="width: ${(data.metro_vol/127)*100}%"></div>
-                        </div>
-                    </div>
-                </div>`;
-        }
-        else {
-            // Default Menu List Logic
-            (data.files || []).forEach((item, i) => {
-                let isSel = (parseInt(i) === parseInt(data.index));
-                let style = isSel ? 'background: #007bff; color: white; font-weight: bold; border-left: 8px solid yellow;' : 'color: #888;';
-                html += `<div id="item-${i}" class="menu-item" style="${style}">${item}</div>`;
-            });
-        }
-
-        menuContainer.innerHTML = html;
-
-        // 4. Scrolling Logic
-        if (data.mode !== "VOLUME" && data.mode !== "METRONOME") {
-            const active = document.getElementById(`item-${data.index}`);
-            if (active) active.scrollIntoView({ block: 'center', behavior: 'smooth' });
-        }
-    });
-
-    // Error logging for debugging
-    socket.on('connect_error', (err) => {
-        console.log("Connection Error: ", err.message);
-    });
-</script>
-</body>
-</html>
-"""
-
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-def force_emit():
-    try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, 'r') as f:
-                data = json.load(f)
-                socketio.emit('state_update', data)
-    except:
-        pass
-
-@socketio.on('control')
-def handle_control(data):
-    global IS_BUSY
-    btn = data.get('btn')
-    cmd_file = os.path.join(BASE_DIR, f"cmd_{btn}")
-    try:
-        IS_BUSY = True 
-        with open(cmd_file, "w") as f:
-            f.write("1")
-        socketio.sleep(0.15) 
-        force_emit()
-    finally:
-        IS_BUSY = False
-
-def broadcast_loop():
-    last_mtime = 0
-    while True:
-        if not IS_BUSY:
-            try:
-                if os.path.exists(STATE_FILE):
-                    mtime = os.path.getmtime(STATE_FILE)
-                    if mtime != last_mtime:
-                        force_emit()
-                        last_mtime = mtime
-            except:
-                pass
-        socketio.sleep(0.2)
-
-if __name__ == '__main__':
-    if not os.path.exists(BASE_DIR):
-        os.makedirs(BASE_DIR)
-    
-    socketio.start_background_task(broadcast_loop)
-    # Added allow_unsafe_werkzeug for better stability on the Pi
-    socketio.run(app, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
+
+import os
+# Embedded (main.py --web): this module runs inside the synth engine, whose
+# rtmidi/FluidSynth/GPIO threads must stay real threads. No monkey_patch there;
+# Flask-SocketIO runs in threading mode instead of eventlet.
+EMBEDDED = os.environ.get("ZOMPLER_EMBEDDED") == "1"
+if not EMBEDDED:
+    # The remote is reached by IP on the LAN; skip eventlet's green DNS resolver
+    # (dnspython), which is most of eventlet's import time on the Pi.
+    os.environ.setdefault("EVENTLET_NO_GREENDNS", "yes")
+    import eventlet
+    eventlet.monkey_patch() 
+
+# PIL (LCD mirror) and subprocess (bounce) are imported on first use;
+# bench_startup.py guards the import budget.
+import json, sys, time, threading, collections, struct
+import shm_state, metrics
+from flask import Flask, render_template_string
+from flask import request, jsonify, Response
+from flask_socketio import SocketIO, emit, join_room
+
+# 1. DEFINE PATHS FIRST
+HOME_DIR = os.environ.get("ZOMPLER_HOME", "/home/pi")
+BASE_DIR = os.path.join(HOME_DIR, "midifileplayer")
+BOUNCE_FILE = os.path.join(BASE_DIR, "bounce_state.json")
+BOOT_FILE = os.path.join(BASE_DIR, "boot_timeline.json")
+MIDI_DIR = os.path.join(HOME_DIR, "midifiles")
+SF2_DIR = os.path.join(HOME_DIR, "sf2")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Raw RGB frame written by main.py's "mirror" display backend
+LCD_FILE = "/dev/shm/zompler_lcd.rgb" if os.path.isdir("/dev/shm") else "/tmp/zompler_lcd.rgb"
+
+app = Flask(__name__)
+# Removing explicit eventlet here often helps stability on Pi Zero 2W
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading" if EMBEDDED else None)
+
+# 2. DEFINE ROUTES
+@app.route('/socket.io.js')
+def serve_socket_io():
+    return send_asset('socket.io.js')
+
+BOUNCE_PROC = None
+_engine = None # the main module when embedded; see serve()
+
+# ... rest of your code and render_template_string ...
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Monkey MIDI Remote</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
+    <script src="/socket.io.js?v={{ sio_version }}"></script>
+    <style>
+        body { background: #111; color: white; font-family: sans-serif; text-align: center; margin: 0; padding: 0; overflow: hidden; }
+        #status-bar { 
+            background: #222; color: #0f0; padding: 12px; font-weight: bold; 
+            border-bottom: 2px solid #444; display: flex; justify-content: space-between;
+        }
+        #menu-container { height: 55vh; overflow-y: auto; scroll-behavior: smooth; border-bottom: 1px solid #333; }
+        .menu-item { padding: 16px; border-bottom: 1px solid #222; font-size: 1.1em; transition: 0.1s; }
+        .controls { display: grid; grid-template-columns: 1fr 1fr; gap: 10px; padding: 15px; }
+        button { 
+            padding: 20px; font-size: 1.2em; background: #333; color: white; 
+            border: 1px solid #555; border-radius: 10px; outline: none;
+        }
+        button:active { background: #007bff; transform: scale(0.98); }
+        .sel-btn { background: #0062cc; grid-column: span 2; font-weight: bold; }
+        .back-btn { background: #a51d2d; grid-column: span 2; }
+        .bar-container { width: 80%; background: #333; height: 15px; margin: 10px auto; border-radius: 10px; overflow: hidden; }
+        .bar-fill { height: 100%; background: #007bff; transition: width 0.2s; }
+        #bounce-panel { display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: #111; overflow-y: auto; padding: 10px; text-align: left; }
+        .bounce-row { padding: 8px; border-bottom: 1px solid #222; display: flex; justify-content: space-between; }
+        #files-panel { display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: #111; overflow-y: auto; padding: 10px; text-align: left; }
+        .rename-input { width: 80%; padding: 14px; font-size: 1.3em; margin: 10px auto; display: block; background: #222; color: white; border: 1px solid #555; border-radius: 8px; }
+        #boot-panel { display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: #111; overflow-y: auto; padding: 10px; text-align: left; }
+        .boot-bar { height: 6px; background: #007bff; position: relative; }
+        #lcd-wrap { display: none; height: 55vh; border-bottom: 1px solid #333; align-items: center; justify-content: center; }
+        #lcd { height: 100%; max-width: 100%; aspect-ratio: 1; image-rendering: pixelated; background: #000; }
+        .screen-btn { padding: 12px; font-size: 1em; }
+        .hold-btn { touch-action: none; user-select: none; -webkit-user-select: none; }
+        #pad-panel { display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: #111; overflow-y: auto; padding: 10px; }
+        .pad-grid { display: grid; grid-template-columns: repeat(4, 1fr); gap: 8px; }
+        .pad { height: 18vw; background: #333; border: 1px solid #555; border-radius: 10px; display: flex; align-items: center; justify-content: center; touch-action: none; user-select: none; -webkit-user-select: none; }
+        .pad.on { background: #007bff; }
+        #diag-panel { display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: #111; overflow-y: auto; padding: 10px; text-align: left; }
+        .slider { width: 80%; height: 40px; margin: 10px auto; display: block; accent-color: #007bff; }
+    </style>
+</head>
+<body>
+    <div id="status-bar">
+        <span id="mode-text">CONNECTING...</span>
+        <span id="dsp-text" style="color: #ff7800;"></span>
+        <span id="batt-text" style="color: #aaa;">--:--</span>
+    </div>
+    <div id="net-text" style="display: none; padding: 4px 10px; font-size: 0.8em; color: #aaa; text-align: left;"></div>
+    <div id="menu-container"></div>
+    <div id="boot-panel">
+        <h3>BOOT TIMELINE</h3>
+        <div id="boot-report">No report yet</div>
+        <div class="controls"><button class="back-btn" onclick="document.getElementById('boot-panel').style.display = 'none'">CLOSE</button></div>
+    </div>
+    <div id="lcd-wrap"><canvas id="lcd" width="240" height="240"></canvas></div>
+    <div class="controls">
+        <button class="hold-btn" onpointerdown="holdStart('up')" onpointerup="holdEnd()" onpointerleave="holdEnd()" onpointercancel="holdEnd()" oncontextmenu="return false">UP</button>
+        <button class="hold-btn" onpointerdown="holdStart('down')" onpointerup="holdEnd()" onpointerleave="holdEnd()" onpointercancel="holdEnd()" oncontextmenu="return false">DOWN</button>
+        <button class="sel-btn" onclick="sendCmd('select')">SELECT / OK</button>
+        <button class="back-btn" onclick="sendCmd('back')">BACK / MENU</button>
+        <button class="screen-btn" onclick="toggleMirror()">SCREEN / LIST</button>
+        <button class="screen-btn" style="background: #2d6a2d;" onclick="openBounce()">BOUNCE</button>
+        <button class="screen-btn" onclick="openFiles()">FILES</button>
+        <button class="screen-btn" onclick="openBoot()">BOOT TIMELINE</button>
+        <button class="screen-btn" onclick="openPads()">PADS</button>
+        <button class="screen-btn" onclick="openDiag()">DIAGNOSTICS</button>
+    </div>
+    <div id="files-panel">
+        <h3>MIDI FILES</h3>
+        <div id="files-list"></div>
+        <div class="controls">
+            <button onclick="filesRename()">RENAME</button>
+            <button onclick="filesMove()">MOVE</button>
+            <button class="back-btn" style="grid-column: auto;" onclick="filesDelete()">DELETE</button>
+            <button onclick="document.getElementById('files-panel').style.display = 'none'">CLOSE</button>
+        </div>
+        <h3>UPLOAD</h3>
+        <input type="file" multiple accept=".mid,.sf2" class="rename-input" onchange="uploadFiles(this)">
+        <div id="upload-status" class="bounce-row"></div>
+    </div>
+    <div id="pad-panel">
+        <h3>PADS <span id="pad-stats" style="color: #aaa; font-size: 0.7em;"></span></h3>
+        <div id="pads" class="pad-grid"></div>
+        <div class="controls"><button class="back-btn" onclick="document.getElementById('pad-panel').style.display = 'none'">CLOSE</button></div>
+    </div>
+    <div id="diag-panel">
+        <h3>LATENCY</h3>
+        <div id="diag-list">Loading...</div>
+        <div class="controls"><button class="back-btn" onclick="closeDiag()">CLOSE</button></div>
+    </div>
+    <div id="bounce-panel">
+        <h3>BOUNCE MIDI TO AUDIO</h3>
+        <div id="bounce-files"></div>
+        <div class="controls">
+            <select id="bounce-format" style="padding: 12px; font-size: 1.1em;"><option>wav</option><option>flac</option></select>
+            <button onclick="startBounce()">RENDER</button>
+            <button class="back-btn" onclick="closeBounce()">CLOSE</button>
+        </div>
+        <div id="bounce-progress"></div>
+    </div>
+
+    <script>
+    // Using io() without parameters tells it to use the current URL and Port automatically
+    // JSON by default; ?codec=msgpack on the page URL opts in to binary state
+    var lastSeq = 0, epoch = ''; // journal position, see web_app.sync_client
+    var socket = io({
+        auth: function(cb) { cb({seq: lastSeq, epoch: epoch}); }, // read on every (re)connect
+        query: {codec: location.search.indexOf('codec=msgpack') >= 0 ? 'msgpack' : 'json'},
+        transports: ['polling', 'websocket'],
+        upgrade: true,
+        reconnection: true,
+        reconnectionAttempts: Infinity, // Keep trying until the Pi wakes up
+        reconnectionDelay: 1000,        // Try every 1 second
+        timeout: 2000                  // Wait 2s before timing out an attempt
+    });
+
+    function sendCmd(name) { 
+        socket.emit('control', {btn: name}); 
+    }
+
+    // File names end up in markup, as text and in attribute values
+    function esc(text) {
+        return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+
+    // --- TYPED COMMANDS (one round trip per change, see main.COMMAND_OPS) ---
+    function sendOp(op, args) {
+        socket.emit('command', Object.assign({op: op}, args || {}));
+    }
+    // Tap a row to highlight it, tap the highlighted row to open it
+    var lastState = null;
+    function tapRow(i) {
+        if (lastState && parseInt(lastState.index) === i && lastState.mode !== "MIXER") sendCmd('select');
+        else sendOp('set_index', {index: i});
+    }
+    // Sliders send while dragging (at most every 100 ms) and once on release;
+    // state updates don't redraw the panel under the finger meanwhile
+    var dragging = false, slideTimer = null, slidePending = null;
+    function slide(op, args, done) {
+        slidePending = [op, args];
+        dragging = !done;
+        if (done) { clearTimeout(slideTimer); slideTimer = null; sendOp(op, args); return; }
+        if (!slideTimer) slideTimer = setTimeout(() => { slideTimer = null; sendOp(...slidePending); }, 100);
+    }
+    function slider(op, value, min, max, extra) {
+        return `<input type="range" class="slider" min="${min}" max="${max}" value="${value}"
+            data-op="${op}" data-extra="${esc(JSON.stringify(extra || {}))}">`;
+    }
+    // One listener for every slider: the op's args are data-extra plus the value
+    function onSlide(e, done) {
+        let el = e.target;
+        if (!el.dataset || !el.dataset.op) return;
+        slide(el.dataset.op, Object.assign(JSON.parse(el.dataset.extra), {value: +el.value}), done);
+    }
+    document.addEventListener('input', e => onSlide(e, false));
+    document.addEventListener('change', e => onSlide(e, true));
+    socket.on('command_error', (e) => console.log("Command error: ", e.error));
+
+    // Held UP/DOWN: one step at once, then after HOLD_DELAY a scroll command
+    // every 100 ms carrying how long it has been repeating. The engine turns
+    // that into steps (main.SCROLL_ACCEL) and merges whatever queues up.
+    const HOLD_DELAY = 0.4;
+    var holdTimer = null;
+    function holdStart(dir) {
+        holdEnd();
+        sendCmd(dir);
+        let t0 = performance.now();
+        holdTimer = setInterval(() => {
+            let held = (performance.now() - t0) / 1000 - HOLD_DELAY;
+            if (held >= 0) sendOp('scroll', {direction: dir, held: held});
+        }, 100);
+    }
+    function holdEnd() {
+        if (holdTimer) { clearInterval(holdTimer); holdTimer = null; }
+    }
+
+    // --- BOUNCE PANEL ---
+    function openBounce() {
+        document.getElementById('bounce-panel').style.display = 'block';
+        socket.emit('bounce_list');
+    }
+    function closeBounce() { document.getElementById('bounce-panel').style.display = 'none'; }
+    function startBounce() {
+        let names = [];
+        document.querySelectorAll('.bounce-pick:checked').forEach(el => names.push(el.value));
+        if (!names.length) return;
+        socket.emit('bounce_start', {files: names, format: document.getElementById('bounce-format').value});
+    }
+    socket.on('bounce_list', function(data) {
+        let html = '';
+        (data.files || []).forEach(name => {
+            html += `<label class="bounce-row"><span>${esc(name)}</span><input type="checkbox" class="bounce-pick" value="${esc(name)}"></label>`;
+        });
+        document.getElementById('bounce-files').innerHTML = html || '<div class="bounce-row">No MIDI files</div>';
+    });
+    socket.on('bounce_update', function(data) {
+        if (!data) return;
+        let head = data.error ? `<div style="color: #ff4444;">${esc(data.error)}</div>` :
+            `<div class="bounce-row"><b>${data.done}/${data.total} ${data.running ? 'RENDERING' : 'DONE'}</b><span>${data.elapsed}s</span></div>`;
+        let rows = (data.files || []).map(f => {
+            let color = f.status === 'done' ? '#0f0' : (f.status === 'error' ? '#f44' : (f.status === 'rendering' ? '#ff0' : '#888'));
+            return `<div class="bounce-row" style="color: ${color};"><span>${esc(f.name)}</span><span>${f.status === 'done' ? f.seconds + 's' : f.status}</span></div>`;
+        }).join('');
+        document.getElementById('bounce-progress').innerHTML = head + rows;
+    });
+
+    // --- FILE MANAGER (multi-select; one batch command per action) ---
+    function openFiles() {
+        document.getElementById('files-panel').style.display = 'block';
+        socket.emit('file_list');
+    }
+    function relistFiles() { setTimeout(() => socket.emit('file_list'), 300); }
+    function pickedFiles() {
+        let names = [];
+        document.querySelectorAll('.file-pick:checked').forEach(el => names.push(el.value));
+        return names;
+    }
+    socket.on('file_list', function(data) {
+        let html = '';
+        (data.files || []).forEach(name => {
+            html += `<label class="bounce-row"><span>${esc(name)}</span><input type="checkbox" class="file-pick" value="${esc(name)}"></label>`;
+        });
+        document.getElementById('files-list').innerHTML = html || '<div class="bounce-row">No MIDI files</div>';
+    });
+    function filesDelete() {
+        let names = pickedFiles();
+        if (!names.length || !confirm(`Delete ${names.length} file(s)?`)) return;
+        sendOp('delete_files', {names: names});
+        relistFiles();
+    }
+    function filesRename() {
+        let renames = [];
+        for (const name of pickedFiles()) {
+            let base = name.slice(0, -4); // ".mid"
+            let to = prompt(`New name for ${base}`, base);
+            if (to && to !== base) renames.push([name, to]);
+        }
+        if (!renames.length) return;
+        sendOp('rename_files', {renames: renames});
+        relistFiles();
+    }
+    function filesMove() {
+        let names = pickedFiles();
+        if (!names.length) return;
+        let to = prompt(`Move ${names.length} file(s) to folder`, 'archive');
+        if (!to) return;
+        sendOp('move_files', {names: names, to: to});
+        relistFiles();
+    }
+
+    // --- UPLOAD (resumable; SHA-256 in plain JS since crypto.subtle needs https) ---
+    class Sha256 {
+        constructor() {
+            if (!Sha256.K) {
+                // Fractional bits of the cube roots (K) and square roots (H) of the first primes
+                let primes = [], n = 2;
+                while (primes.length < 64) { if (primes.every(p => n % p)) primes.push(n); n++; }
+                let frac = x => (x - Math.floor(x)) * 4294967296 >>> 0;
+                Sha256.K = Uint32Array.from(primes, p => frac(Math.cbrt(p)));
+                Sha256.H = Uint32Array.from(primes.slice(0, 8), p => frac(Math.sqrt(p)));
+            }
+            this.h = Uint32Array.from(Sha256.H);
+            this.w = new Uint32Array(64);
+            this.buf = new Uint8Array(64);
+            this.fill = 0;
+            this.len = 0;
+        }
+        block(bytes, o) {
+            let w = this.w, K = Sha256.K;
+            for (let i = 0; i < 16; i++, o += 4) w[i] = bytes[o] << 24 | bytes[o + 1] << 16 | bytes[o + 2] << 8 | bytes[o + 3];
+            for (let i = 16; i < 64; i++) {
+                let x = w[i - 15], y = w[i - 2];
+                w[i] = w[i - 16] + w[i - 7] + ((x >>> 7 | x << 25) ^ (x >>> 18 | x << 14) ^ x >>> 3)
+                     + ((y >>> 17 | y << 15) ^ (y >>> 19 | y << 13) ^ y >>> 10);
+            }
+            let [a, b, c, d, e, f, g, h] = this.h;
+            for (let i = 0; i < 64; i++) {
+                let t1 = h + ((e >>> 6 | e << 26) ^ (e >>> 11 | e << 21) ^ (e >>> 25 | e << 7)) + (e & f ^ ~e & g) + K[i] + w[i] | 0;
+                let t2 = ((a >>> 2 | a << 30) ^ (a >>> 13 | a << 19) ^ (a >>> 22 | a << 10)) + (a & b ^ a & c ^ b & c) | 0;
+                h = g; g = f; f = e; e = d + t1 | 0; d = c; c = b; b = a; a = t1 + t2 | 0;
+            }
+            let H = this.h;
+            H[0] += a; H[1] += b; H[2] += c; H[3] += d; H[4] += e; H[5] += f; H[6] += g; H[7] += h;
+        }
+        update(bytes) {
+            let i = 0;
+            this.len += bytes.length;
+            if (this.fill) {
+                i = Math.min(64 - this.fill, bytes.length);
+                this.buf.set(bytes.subarray(0, i), this.fill);
+                this.fill += i;
+                if (this.fill < 64) return;
+                this.block(this.buf, 0); this.fill = 0;
+            }
+            for (; i + 64 <= bytes.length; i += 64) this.block(bytes, i);
+            this.buf.set(bytes.subarray(i), 0);
+            this.fill = bytes.length - i;
+        }
+        hex() {
+            let bits = this.len * 8, pad = new Uint8Array((this.fill < 56 ? 64 : 128) - this.fill);
+            pad[0] = 0x80;
+            for (let i = 0; i < 8; i++) pad[pad.length - 1 - i] = Math.floor(bits / 2 ** (8 * i)) & 255;
+            this.update(pad);
+            return Array.from(this.h, v => v.toString(16).padStart(8, '0')).join('');
+        }
+    }
+    const UPLOAD_CHUNK = 1024 * 1024;
+    function setUpload(text) { document.getElementById('upload-status').innerText = text; }
+    async function uploadJson(url, opts) {
+        let r = await fetch(url, opts);
+        let data = await r.json().catch(() => ({}));
+        if (!r.ok) throw new Error(data.error || ('HTTP ' + r.status));
+        return data;
+    }
+    async function uploadOne(file) {
+        let kind = file.name.toLowerCase().endsWith('.sf2') ? 'sf2' : 'midi';
+        let url = `/upload/${kind}/${encodeURIComponent(file.name)}`;
+        // Whatever the Pi already has (an interrupted earlier try) is only hashed here, not re-sent
+        let offset = (await uploadJson(`${url}?size=${file.size}`)).offset;
+        let hash = new Sha256(), pos = 0, tries = 0;
+        while (pos < file.size) {
+            let end = Math.min(pos + UPLOAD_CHUNK, pos < offset ? offset : file.size);
+            let buf = new Uint8Array(await file.slice(pos, end).arrayBuffer());
+            let ok = pos < offset;
+            if (!ok) {
+                try { ok = (await fetch(`${url}?offset=${pos}`, {method: 'PUT', body: buf})).ok; } catch (e) {}
+            }
+            if (ok) {
+                hash.update(buf); pos = end; tries = 0;
+                setUpload(`${file.name}: ${Math.floor(pos * 100 / file.size)}%`);
+                continue;
+            }
+            // Dropped or refused: ask the Pi where its copy ends and hash up to there again
+            if (++tries > 5) throw new Error('upload failed');
+            setUpload(`${file.name}: retrying...`);
+            await new Promise(res => setTimeout(res, 1000 * tries));
+            offset = (await uploadJson(url)).offset; hash = new Sha256(); pos = 0;
+        }
+        setUpload(`${file.name}: verifying...`);
+        await uploadJson(`${url}/finish`, {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                           body: JSON.stringify({size: file.size, sha256: hash.hex()}) });
+        setUpload(`${file.name}: done`);
+    }
+    async function uploadFiles(input) {
+        for (const file of Array.from(input.files)) {
+            try { await uploadOne(file); } catch (e) { setUpload(`${file.name}: ${e.message}`); return; }
+        }
+        input.value = '';
+        relistFiles();
+    }
+
+    // --- NOTE PAD (binary 'note' events straight to the synth; see web_app.handle_note) ---
+    // Drums on MIDI channel 10, then an octave of notes on channel 1
+    const PADS = [['KICK', 0x99, 36], ['SNARE', 0x99, 38], ['CLAP', 0x99, 39], ['HAT', 0x99, 42],
+                  ['OPEN HAT', 0x99, 46], ['TOM', 0x99, 45], ['CRASH', 0x99, 49], ['RIDE', 0x99, 51]];
+    ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'].forEach((n, i) => PADS.push([n, 0x90, 60 + i]));
+    var padRtt = [], padEngine = [];
+    function padSend(i, on) {
+        let pad = PADS[i], buf = new ArrayBuffer(12), view = new DataView(buf);
+        view.setUint8(0, on ? pad[1] : (pad[1] & 0x0F) | 0x80);
+        view.setUint8(1, pad[2]);
+        view.setUint8(2, on ? 100 : 0);
+        view.setUint8(3, i);
+        view.setFloat64(4, performance.now(), true);
+        socket.emit('note', buf);
+        document.getElementById('pad-' + i).classList.toggle('on', on);
+    }
+    function openPads() {
+        document.getElementById('pad-panel').style.display = 'block';
+        document.getElementById('pads').innerHTML = PADS.map((p, i) =>
+            `<div class="pad" id="pad-${i}" onpointerdown="padSend(${i}, true)" onpointerup="padSend(${i}, false)" onpointerleave="if (this.classList.contains('on')) padSend(${i}, false)" onpointercancel="padSend(${i}, false)" oncontextmenu="return false">${p[0]}</div>`).join('');
+    }
+    function median(a) { let s = a.slice().sort((x, y) => x - y); return s[Math.floor(s.length / 2)]; }
+    socket.on('note_ack', function(ack) {
+        padRtt.push(performance.now() - ack[0]); padEngine.push(ack[1]);
+        if (padRtt.length > 50) { padRtt.shift(); padEngine.shift(); }
+        document.getElementById('pad-stats').innerText = ack[1] < 0 ? 'no synth' :
+            `round trip ${median(padRtt).toFixed(1)} ms, engine ${median(padEngine)} us`;
+    });
+
+    // --- DIAGNOSTICS (the /metrics histograms, refreshed while open; see metrics.py) ---
+    var diagTimer = null;
+    function openDiag() {
+        document.getElementById('diag-panel').style.display = 'block';
+        loadDiag();
+        diagTimer = setInterval(loadDiag, 2000);
+    }
+    function closeDiag() {
+        document.getElementById('diag-panel').style.display = 'none';
+        clearInterval(diagTimer); diagTimer = null;
+    }
+    function parseMetrics(text) {
+        // Prometheus text -> {name: {help, bounds, counts (cumulative), sum, count}}
+        let out = {};
+        text.split(String.fromCharCode(10)).forEach(line => {
+            if (line.startsWith('# HELP ')) {
+                let words = line.slice(7).split(' ');
+                out[words[0]] = {help: words.slice(1).join(' '), bounds: [], counts: [], sum: 0, count: 0};
+                return;
+            }
+            if (!line || line[0] === '#') return;
+            let sp = line.lastIndexOf(' '), key = line.slice(0, sp), value = parseFloat(line.slice(sp + 1));
+            let b = key.indexOf('_bucket{');
+            if (b >= 0) {
+                let h = out[key.slice(0, b)], le = key.split('"')[1];
+                if (h) { h.bounds.push(le === '+Inf' ? Infinity : parseFloat(le)); h.counts.push(value); }
+            } else if (key.endsWith('_sum') && out[key.slice(0, -4)]) out[key.slice(0, -4)].sum = value;
+            else if (key.endsWith('_count') && out[key.slice(0, -6)]) out[key.slice(0, -6)].count = value;
+        });
+        return out;
+    }
+    function fmtTime(s) { return s < 1e-3 ? (s * 1e6).toFixed(0) + ' us' : (s * 1e3).toFixed(1) + ' ms'; }
+    function quantile(h, q) {
+        // Linear within the bucket, as Prometheus' histogram_quantile does
+        let rank = q * h.count;
+        for (let i = 0; i < h.counts.length; i++) {
+            if (h.counts[i] < rank) continue;
+            if (h.bounds[i] === Infinity) return '> ' + fmtTime(h.bounds[i - 1]);
+            let lo = i ? h.bounds[i - 1] : 0, below = i ? h.counts[i - 1] : 0;
+            return fmtTime(lo + (h.bounds[i] - lo) * (rank - below) / Math.max(h.counts[i] - below, 1));
+        }
+        return '-';
+    }
+    function loadDiag() {
+        fetch('/metrics').then(r => r.text()).then(text => {
+            let m = parseMetrics(text), html = '';
+            Object.keys(m).forEach(name => {
+                let h = m[name], label = name.replace('zompler_', '').replace('_seconds', '').split('_').join(' ');
+                html += `<div class="bounce-row"><b>${label}</b><span>${h.count} samples</span></div>` +
+                    `<div style="color: #888; font-size: 0.8em; padding: 0 8px;">${h.help}</div>` +
+                    (h.count ? `<div class="bounce-row" style="color: #ccc;"><span>mean ${fmtTime(h.sum / h.count)}</span>` +
+                        `<span>p50 ${quantile(h, 0.5)}</span><span>p90 ${quantile(h, 0.9)}</span><span>p99 ${quantile(h, 0.99)}</span></div>` : '');
+            });
+            document.getElementById('diag-list').innerHTML = html || 'No metrics yet';
+        }).catch(() => { document.getElementById('diag-list').innerText = 'Engine metrics unavailable'; });
+    }
+
+    // --- BOOT TIMELINE ---
+    function openBoot() {
+        document.getElementById('boot-panel').style.display = 'block';
+        socket.emit('boot_report');
+    }
+    socket.on('boot_report', function(r) {
+        if (!r || !r.steps) return;
+        let scale = 100 / Math.max(r.total, 0.001);
+        let html = `<div class="bounce-row"><b>Engine ready after ${r.total.toFixed(2)}s</b>` +
+            (r.kernel_uptime_at_ready ? `<span>${r.kernel_uptime_at_ready.toFixed(1)}s since power-on</span>` : '') + `</div>`;
+        r.steps.forEach(s => {
+            html += `<div class="bounce-row" style="color: ${s.error ? '#f44' : '#ccc'};"><span>${s.name}</span><span>${s.duration.toFixed(2)}s</span></div>` +
+                `<div class="boot-bar" style="margin-left: ${s.start * scale}%; width: ${Math.max(s.duration * scale, 0.5)}%; ${s.error ? 'background: #f44;' : ''}"></div>`;
+        });
+        document.getElementById('boot-report').innerHTML = html;
+    });
+
+    // --- LIVE LCD MIRROR ---
+    // The server sends changed tiles as PNGs, one update in flight at a time:
+    // drawing and acking each update is what paces the frame rate to the link.
+    var mirrorOn = localStorage.getItem('mirror') !== 'off';
+    const lcdCtx = document.getElementById('lcd').getContext('2d');
+    function showMirror() {
+        document.getElementById('lcd-wrap').style.display = mirrorOn ? 'flex' : 'none';
+        document.getElementById('menu-container').style.display = mirrorOn ? 'none' : 'block';
+        if (socket.connected) socket.emit(mirrorOn ? 'mirror_on' : 'mirror_off');
+    }
+    function toggleMirror() {
+        mirrorOn = !mirrorOn;
+        localStorage.setItem('mirror', mirrorOn ? 'on' : 'off');
+        showMirror();
+    }
+    socket.on('lcd', async function(msg) {
+        for (const t of msg.tiles) {
+            const bmp = await createImageBitmap(new Blob([t[4]], {type: 'image/png'}));
+            lcdCtx.drawImage(bmp, t[0], t[1]);
+        }
+        socket.emit('mirror_ack', {seq: msg.seq});
+    });
+
+    // Triggered the very second the Pi and Phone shake hands
+    socket.on('connect', function() {
+        console.log("Websocket Connected!");
+        showMirror();
+        const modeEl = document.getElementById('mode-text');
+        if (modeEl && modeEl.innerText === "CONNECTING...") {
+            modeEl.innerText = "LOADING DATA...";
+        }
+    });
+
+    function showState(data) {
+        let editing = document.activeElement && document.activeElement.id === 'rename-input';
+        let redraw = !((dragging || editing) && lastState && lastState.mode === data.mode);
+        lastState = data;
+
+        // --- SAFETY: HIDE OVERLAY IF IT EXISTS ---
+        // If you have a <div> with id="overlay", this hides it.
+        const overlay = document.getElementById('overlay');
+        if(overlay) overlay.style.display = 'none';
+
+        // 1. Update Battery
+        document.getElementById('batt-text').innerText = (data.battery || "0:00") + (data.power_profile ? " " + data.power_profile : "");
+        const dspEl = document.getElementById('dsp-text');
+        dspEl.innerText = data.dsp_level ? `DSP -${data.dsp_level} (${Math.round(data.dsp_load)}%)` : "";
+        // Network MIDI session (laptop over the hotspot), if any
+        const net = data.net_midi, netEl = document.getElementById('net-text');
+        netEl.style.display = net ? 'block' : 'none';
+        if (net) netEl.innerText = `NET MIDI ${net.peer}${net.active ? '' : ' (ended)'}: ${net.packets} pkts, ${net.lost} lost (${net.loss_pct}%), ` +
+            `jitter ${net.jitter_ms} ms, buffer ${net.buffer_ms} ms, ${net.late} late`;
+        
+        const modeEl = document.getElementById('mode-text');
+        const menuContainer = document.getElementById('menu-container');
+        
+        // 2. Header/Mode Logic
+        // This overwrites "CONNECTING..." with the actual state from the Pi
+        if (data.msg) {
+            modeEl.innerText = data.msg;
+            modeEl.style.color = "#ff4444";
+        } else {
+            modeEl.innerText = (data.mode || "MAIN").toUpperCase();
+            modeEl.style.color = data.is_eco ? "#fbff00" : "#00ff00";
+        }
+
+        // 3. Specialized Screen Logic
+        let html = '';
+        
+        if (data.mode === "VOLUME") {
+            html = `
+                <div style="padding: 40px;">
+                    <h2 style="color: #aaa;">MASTER VOLUME</h2>
+                    <div style="font-size: 5em; font-weight: bold; color: #00ff00;">${data.volume}%</div>
+                    ${slider('set_volume', data.volume, 0, 100)}
+                </div>`;
+        } 
+        else if (data.mode === "METRONOME") {
+            let statusColor = data.metronome_on ? "#00ff00" : "#ff4444";
+            let sel = parseInt(data.index);
+            html = `
+                <div style="padding: 20px;">
+                    <h2 style="color: #aaa;">METRONOME</h2>
+                    <div style="padding: 10px; border-radius: 10px; ${sel === 0 ? 'border: 2px solid yellow; background: #222;' : ''}">
+                        <div style="font-size: 1.5em; color: ${statusColor}; font-weight: bold;">
+                            ${data.metronome_on ? "● ACTIVE" : "○ OFF"}
+                        </div>
+                    </div>
+                    <div style="margin-top: 15px; padding: 10px; border-radius: 10px; ${sel === 1 ? 'border: 2px solid #007bff; background: #222;' : ''}">
+                        <div style="font-size: 0.8em; color: #888;">TEMPO</div>
+                        <div style="font-size: 3em; font-weight: bold;">${data.bpm} <span style="font-size: 0.4em;">BPM</span></div>
+                        ${slider('set_bpm', data.bpm, 40, 250)}
+                    </div>
+                    <div style="margin-top: 15px; padding: 10px; border-radius: 10px; ${sel === 2 ? 'border: 2px solid #007bff; background: #222;' : ''}">
+                        <div style="font-size: 0.8em; color: #888;">CLICK VOLUME</div>
+                        <div style="font-size: 2em; font-weight: bold; color: #007bff;">${data.metro_vol}</div>
+                        ${slider('set_metro_vol', data.metro_vol, 0, 127)}
+                    </div>
+                </div>`;
+        }
+        else if (data.mode === "RENAME") {
+            // Type the whole name instead of picking letters one at a time
+            html = `
+                <div style="padding: 20px;">
+                    <h2 style="color: #aaa;">RENAME</h2>
+                    <input id="rename-input" class="rename-input" value="${esc(data.rename_tmp || '')}" autocomplete="off">
+                    <div class="controls"><button class="sel-btn" onclick="sendOp('rename_file', {new_name: document.getElementById('rename-input').value})">SAVE NAME</button></div>
+                </div>`;
+        }
+        else {
+            // Default Menu List Logic
+            (data.files || []).forEach((item, i) => {
+                let isSel = (parseInt(i) === parseInt(data.index));
+                let style = isSel ? 'background: #007bff; color: white; font-weight: bold; border-left: 8px solid yellow;' : 'color: #888;';
+                html += `<div id="item-${i}" class="menu-item" style="${style}" onclick="tapRow(${i})">${esc(item)}</div>`;
+            });
+            // Mixer rows end in "(vol%)": a slider for the highlighted channel
+            let row = data.mode === "MIXER" ? (data.files || [])[data.index] || '' : '';
+            let vol = parseInt(row.slice(row.lastIndexOf('(') + 1));
+            if (row.endsWith('%)') && !isNaN(vol)) html += slider('set_channel_volume', vol, 0, 127, {channel: parseInt(data.index)});
+        }
+
+        if (redraw) menuContainer.innerHTML = html;
+
+        // 4. Scrolling Logic
+        if (redraw && data.mode !== "VOLUME" && data.mode !== "METRONOME") {
+            const active = document.getElementById(`item-${data.index}`);
+            if (active) active.scrollIntoView({ block: 'center', behavior: 'smooth' });
+        }
+    }
+    // Full snapshot (first connect, or too far behind)
+    socket.on('state_update', function(data) {
+        if(!data) return;
+        if (data instanceof ArrayBuffer) data = unpack(data);
+        lastSeq = data.seq || 0; epoch = data.epoch || '';
+        showState(data);
+    });
+    // Only the keys that changed since seq "since"
+    socket.on('state_patch', function(msg) {
+        if (msg instanceof ArrayBuffer) msg = unpack(msg);
+        if (msg.seq <= lastSeq && msg.since !== lastSeq) return; // already have it
+        if (msg.since !== lastSeq || !lastState) { socket.emit('resume', {seq: lastSeq, epoch: epoch}); return; }
+        lastSeq = msg.seq;
+        showState(Object.assign({}, lastState, msg.changes));
+    });
+
+    // --- MESSAGEPACK (state_update arrives as one binary attachment when the Pi has msgpack) ---
+    const utf8 = new TextDecoder();
+    var mpBytes = null, mpView = null, mpPos = 0;
+    function mpStr(n) {
+        let end = mpPos + n;
+        if (n > 24) { let s = utf8.decode(mpBytes.subarray(mpPos, end)); mpPos = end; return s; }
+        let s = '';
+        for (let i = mpPos; i < end; i++) {
+            let c = mpBytes[i];
+            if (c > 127) { s = utf8.decode(mpBytes.subarray(mpPos, end)); break; }
+            s += String.fromCharCode(c); // short ASCII: cheaper than TextDecoder
+        }
+        mpPos = end;
+        return s;
+    }
+    function mpList(n) { let a = new Array(n); for (let i = 0; i < n; i++) a[i] = mpNext(); return a; }
+    function mpMap(n) { let o = {}; for (let i = 0; i < n; i++) { let k = mpNext(); o[k] = mpNext(); } return o; }
+    function mpNext() {
+        let t = mpBytes[mpPos++], v;
+        if (t < 0x80) return t;
+        if (t < 0x90) return mpMap(t & 15);
+        if (t < 0xa0) return mpList(t & 15);
+        if (t < 0xc0) return mpStr(t & 31);
+        if (t >= 0xe0) return t - 256;
+        switch (t) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: v = mpBytes[mpPos++]; mpPos += v; return mpBytes.slice(mpPos - v, mpPos);
+            case 0xca: v = mpView.getFloat32(mpPos); mpPos += 4; return v;
+            case 0xcb: v = mpView.getFloat64(mpPos); mpPos += 8; return v;
+            case 0xcc: return mpBytes[mpPos++];
+            case 0xcd: v = mpView.getUint16(mpPos); mpPos += 2; return v;
+            case 0xce: v = mpView.getUint32(mpPos); mpPos += 4; return v;
+            case 0xcf: v = Number(mpView.getBigUint64(mpPos)); mpPos += 8; return v;
+            case 0xd0: return mpView.getInt8(mpPos++);
+            case 0xd1: v = mpView.getInt16(mpPos); mpPos += 2; return v;
+            case 0xd2: v = mpView.getInt32(mpPos); mpPos += 4; return v;
+            case 0xd3: v = Number(mpView.getBigInt64(mpPos)); mpPos += 8; return v;
+            case 0xd9: return mpStr(mpBytes[mpPos++]);
+            case 0xda: v = mpView.getUint16(mpPos); mpPos += 2; return mpStr(v);
+            case 0xdb: v = mpView.getUint32(mpPos); mpPos += 4; return mpStr(v);
+            case 0xdc: v = mpView.getUint16(mpPos); mpPos += 2; return mpList(v);
+            case 0xdd: v = mpView.getUint32(mpPos); mpPos += 4; return mpList(v);
+            case 0xde: v = mpView.getUint16(mpPos); mpPos += 2; return mpMap(v);
+            case 0xdf: v = mpView.getUint32(mpPos); mpPos += 4; return mpMap(v);
+        }
+        throw new Error('msgpack type ' + t);
+    }
+    function unpack(buf) {
+        mpBytes = new Uint8Array(buf);
+        mpView = new DataView(mpBytes.buffer, mpBytes.byteOffset, mpBytes.byteLength);
+        mpPos = 0;
+        return mpNext();
+    }
+
+    // --- OFFLINE START ---
+    // The page itself may come from the service worker's cache: paint the last
+    // state right away and let the socket reconnect behind it
+    try {
+        let saved = JSON.parse(localStorage.getItem('zompler-state'));
+        if (saved && saved.state) {
+            // Kept with its journal position, so the reconnect only fetches what changed since
+            lastSeq = saved.seq; epoch = saved.epoch;
+            showState(saved.state);
+            document.getElementById('mode-text').innerText = "CONNECTING...";
+        }
+    } catch (e) {}
+    document.addEventListener('visibilitychange', function() {
+        if (document.hidden && lastState) {
+            try { localStorage.setItem('zompler-state', JSON.stringify({state: lastState, seq: lastSeq, epoch: epoch})); } catch (e) {}
+        }
+    });
+    // Service workers need a secure origin (https or localhost); plain-http LAN skips this
+    if ('serviceWorker' in navigator) navigator.serviceWorker.register('/sw.js').catch(() => {});
+
+    // Error logging for debugging
+    socket.on('connect_error', (err) => {
+        console.log("Connection Error: ", err.message);
+    });
+</script>
+</body>
+</html>
+"""
+
+# Stale-while-revalidate for the page and the socket.io client: the remote
+# opens from the phone's cache even before the Pi is on the network.
+# __CACHE__ and __SIO__ are filled in by build_assets().
+SW_JS = """
+const CACHE = 'zompler-__CACHE__';
+const URLS = ['/', '/socket.io.js?v=__SIO__'];
+self.addEventListener('install', e => {
+    e.waitUntil(caches.open(CACHE).then(c => c.addAll(URLS)));
+    self.skipWaiting();
+});
+self.addEventListener('activate', e => {
+    e.waitUntil(caches.keys().then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k)))));
+    self.clients.claim();
+});
+self.addEventListener('fetch', e => {
+    let url = new URL(e.request.url);
+    if (e.request.method !== 'GET' || !URLS.includes(url.pathname + url.search)) return;
+    e.respondWith(caches.open(CACHE).then(c => c.match(e.request).then(hit => {
+        let fresh = fetch(e.request).then(r => { if (r.ok) c.put(e.request, r.clone()); return r; });
+        if (!hit) return fresh;
+        e.waitUntil(fresh.catch(() => null));
+        return hit;
+    })));
+});
+"""
+
+# --- PRECOMPRESSED ASSETS ---
+# The page is rendered once, and it and the scripts are compressed once
+# (gzip, plus brotli if that module is installed), then served from memory
+# with an ETag. The page and sw.js are revalidated on each load, which costs
+# a 304 of a few bytes. The socket.io client's URL carries its hash, so the
+# phone keeps it for a year.
+ASSETS = {}
+_assets_lock = threading.Lock()
+
+def _asset(body, mimetype, cache):
+    import gzip, hashlib
+    variants = {None: body, 'gzip': gzip.compress(body, 9, mtime=0)}
+    try:
+        import brotli
+        variants['br'] = brotli.compress(body, quality=11)
+    except ImportError:
+        pass
+    return {'variants': variants, 'etag': hashlib.sha1(body).hexdigest()[:16], 'mimetype': mimetype, 'cache': cache}
+
+def build_assets():
+    with _assets_lock:
+        if ASSETS:
+            return ASSETS
+        assets = {}
+        try:
+            with open(os.path.join(BASE_DIR, 'socket.io.min.js'), 'rb') as f:
+                assets['socket.io.js'] = _asset(f.read(), 'application/javascript', 'public, max-age=31536000, immutable')
+        except OSError:
+            print("socket.io.min.js missing from", BASE_DIR)
+        sio_version = assets['socket.io.js']['etag'] if 'socket.io.js' in assets else '0'
+        with app.app_context():
+            page = render_template_string(HTML_TEMPLATE, sio_version=sio_version)
+        assets['index'] = _asset(page.encode('utf-8'), 'text/html', 'no-cache')
+        sw = SW_JS.replace('__CACHE__', assets['index']['etag']).replace('__SIO__', sio_version)
+        assets['sw.js'] = _asset(sw.encode('utf-8'), 'application/javascript', 'no-cache')
+        ASSETS.update(assets)
+    return ASSETS
+
+def send_asset(name):
+    asset = build_assets().get(name)
+    if asset is None:
+        return "Not found", 404
+    accepted = request.accept_encodings
+    enc = next((e for e in ('br', 'gzip') if e in asset['variants'] and accepted[e]), None)
+    etag = asset['etag'] + ('-' + enc if enc else '') # one tag per encoding
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(asset['variants'][enc], mimetype=asset['mimetype'])
+        if enc:
+            resp.headers['Content-Encoding'] = enc
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = asset['cache']
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+@app.route('/')
+def index():
+    return send_asset('index')
+
+@app.route('/sw.js')
+def service_worker():
+    return send_asset('sw.js')
+
+state_reader = shm_state.StateReader()
+
+# --- METRICS (see metrics.py) ---
+EMIT_TIME = metrics.histogram("zompler_web_emit_seconds", "Engine state publish to Socket.IO broadcast")
+
+@app.route('/metrics')
+def metrics_text():
+    # Ours plus the engine's file; embedded, the engine's are in our registry
+    text = metrics.render() + (metrics.read() if _engine is None else "")
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+def current_state():
+    # Embedded: straight from the engine's globals. Otherwise the shared
+    # memory block the engine publishes.
+    if _engine is not None:
+        with _engine.ENGINE_LOCK:
+            return _engine.build_web_state()
+    return state_reader.snapshot()
+
+# --- STATE CODECS ---
+# A page that connects with ?codec=msgpack gets state_update as one
+# MessagePack binary attachment instead of JSON text. Each codec has a room,
+# so a state is encoded once per codec in use and that one packet goes to
+# every client in the room. msgpack is optional; without it everyone gets JSON.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+CODECS = ('json', 'msgpack')
+client_codecs = {} # sid -> codec
+
+def encode_state(state, codec):
+    if codec == 'msgpack':
+        return msgpack.packb(state, use_single_float=True)
+    return state # Socket.IO serializes dicts as JSON itself
+
+def emit_state(event, payload):
+    in_use = set(client_codecs.values())
+    for codec in CODECS:
+        if codec in in_use:
+            socketio.emit(event, encode_state(payload, codec), to=codec)
+
+# --- STATE JOURNAL ---
+# Every published state gets a sequence number, and only the keys that changed
+# go out, as state_patch {seq, since, changes}. The last JOURNAL_LEN patches
+# are kept. A page that reconnects sends the seq it last applied (Socket.IO
+# auth) and gets the missed patches merged into one, or a full snapshot
+# (state_update with seq and epoch) if the journal no longer reaches back that
+# far. The epoch is new on every web_app start, so a seq from an earlier run
+# always gets a snapshot.
+JOURNAL_LEN = 128
+JOURNAL_EPOCH = os.urandom(4).hex()
+journal = collections.deque(maxlen=JOURNAL_LEN) # (seq, changes)
+journal_seq = 0
+journal_state = None
+journal_lock = threading.Lock()
+
+def publish(state):
+    # Record a new state and broadcast its patch; False if nothing changed
+    global journal_seq, journal_state
+    if state is None:
+        return False
+    with journal_lock:
+        old = journal_state or {}
+        changes = {k: v for k, v in state.items() if k not in old or old[k] != v}
+        if not changes:
+            return False
+        journal_seq += 1
+        journal_state = state
+        journal.append((journal_seq, changes))
+        emit_state('state_patch', {'seq': journal_seq, 'since': journal_seq - 1, 'changes': changes})
+    return True
+
+def sync_client(since, epoch, codec):
+    # Called with journal_lock held, so no patch slips in between
+    if journal_state is None:
+        return
+    if epoch == JOURNAL_EPOCH and isinstance(since, int) and journal and journal[0][0] - 1 <= since <= journal_seq:
+        changes = {}
+        for seq, patch in journal:
+            if seq > since:
+                changes.update(patch)
+        emit('state_patch', encode_state({'seq': journal_seq, 'since': since, 'changes': changes}, codec))
+    else:
+        emit('state_update', encode_state(dict(journal_state, seq=journal_seq, epoch=JOURNAL_EPOCH), codec))
+
+def decode_message(data):
+    # control/command may also arrive as a MessagePack attachment
+    if isinstance(data, (bytes, bytearray)) and msgpack is not None:
+        try:
+            return msgpack.unpackb(data)
+        except Exception:
+            return None
+    return data
+
+def push_state(state):
+    # Embedded: called by main.update_web_state on every change and on the
+    # 1 s heartbeat; only real changes go out
+    t0 = time.perf_counter()
+    if publish(state):
+        EMIT_TIME.since(t0)
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    codec = 'msgpack' if request.args.get('codec') == 'msgpack' and msgpack is not None else 'json'
+    # Bring the journal up to date first, rather than wait for broadcast_loop
+    publish(current_state())
+    auth = auth if isinstance(auth, dict) else {}
+    with journal_lock:
+        client_codecs[request.sid] = codec
+        join_room(codec)
+        sync_client(auth.get('seq'), auth.get('epoch'), codec)
+
+@socketio.on('resume')
+def handle_resume(data):
+    # The page saw a gap in the patch sequence
+    data = decode_message(data)
+    if not isinstance(data, dict):
+        return
+    with journal_lock:
+        sync_client(data.get('seq'), data.get('epoch'), client_codecs.get(request.sid, 'json'))
+
+@socketio.on('control')
+def handle_control(data):
+    data = decode_message(data)
+    if not isinstance(data, dict):
+        return
+    btn = data.get('btn')
+    if _engine is not None:
+        # The handler's publish_state() pushes the new state itself
+        _engine.run_command(btn)
+        return
+    # The engine picks this up within 0.1 s; broadcast_loop sees the new
+    # state in shared memory and sends it
+    cmd_file = os.path.join(BASE_DIR, f"cmd_{btn}")
+    try:
+        with open(cmd_file, "w") as f:
+            f.write("1")
+    except:
+        pass
+
+def send_command(data):
+    # Embedded: applied right here, returns the engine's error (or None).
+    # Otherwise queued for the engine's next directory scan.
+    if _engine is not None:
+        return _engine.apply_command(data)
+    # Unique, time-ordered name; written whole then renamed into place
+    path = os.path.join(BASE_DIR, f"cmd_op_{time.time_ns()}.json")
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except:
+        pass
+    return None
+
+@socketio.on('command')
+def handle_command(data):
+    # Typed command, e.g. {op: 'set_volume', value: 80}, or a list of them
+    # applied as one batch; see main.COMMAND_OPS
+    data = decode_message(data)
+    if not isinstance(data, (dict, list)) or not data:
+        return
+    err = send_command(data)
+    if err:
+        emit('command_error', {'error': err})
+
+# --- NOTE PAD ---
+# Each pad press is a 12-byte binary event: status, note, velocity, pad, then
+# the browser's performance.now() as a float64, which comes back in
+# note_ack with the engine's receive-to-noteon delay in microseconds so the
+# page can show the round trip. Embedded, the note is played from this
+# handler. Otherwise it goes to main.note_server as one UDP datagram.
+NOTE_ADDR = ('127.0.0.1', 5010)   # main.NOTE_PORT
+NOTE_PACKET = struct.Struct('<BBBxIQ') # main.NOTE_PACKET
+NOTE_REPLY = struct.Struct('<Iq')      # main.NOTE_REPLY
+note_sock = None
+note_id = 0
+note_pending = {} # id -> (sid, browser timestamp)
+
+@socketio.on('note')
+def handle_note(data):
+    global note_id
+    t_recv = time.monotonic_ns()
+    if not isinstance(data, (bytes, bytearray)) or len(data) < 12:
+        return
+    status, note, velocity = data[0], data[1], data[2]
+    stamp = struct.unpack_from('<d', data, 4)[0]
+    if _engine is not None:
+        dt = _engine.play_note(status, note, velocity, t_recv)
+        emit('note_ack', [stamp, -1 if dt is None else dt // 1000])
+        return
+    if note_sock is None:
+        return
+    note_id = (note_id + 1) & 0xFFFFFFFF
+    if len(note_pending) > 256:
+        note_pending.clear() # engine not answering
+    note_pending[note_id] = (request.sid, stamp)
+    try:
+        note_sock.sendto(NOTE_PACKET.pack(status, note, velocity, note_id, t_recv), NOTE_ADDR)
+    except OSError:
+        pass
+
+def note_reply_loop():
+    while True:
+        try:
+            note, dt = NOTE_REPLY.unpack(note_sock.recv(64))
+            sid, stamp = note_pending.pop(note, (None, None))
+            if sid is not None:
+                socketio.emit('note_ack', [stamp, -1 if dt < 0 else dt // 1000], to=sid)
+        except OSError:
+            socketio.sleep(0.1) # engine not running (ICMP port unreachable)
+        except Exception:
+            pass
+
+# --- RESUMABLE UPLOADS ---
+# The page sends a file as a series of PUTs of up to a few MB, each written
+# straight from the request stream to <name>.part next to its destination, so
+# nothing bigger than UPLOAD_BLOCK is ever held in RAM. GET tells a client
+# where to resume; POST .../finish checks the SHA-256 of the whole .part,
+# renames it into place and tells the engine to add that one file. Anything
+# that writes, removes or renames a .part holds that upload's lock, so two
+# PUTs at the same offset (a retry racing its original, a second tab) can't
+# interleave their appends.
+UPLOAD_KINDS = {'sf2': (SF2_DIR, '.sf2'), 'midi': (MIDI_DIR, '.mid')}
+UPLOAD_BLOCK = 64 * 1024
+UPLOAD_FREE_MARGIN = 50 * 1024 * 1024 # leave the SD card some room
+upload_locks = {} # .part path -> Lock
+upload_locks_guard = threading.Lock()
+
+def upload_lock(part):
+    with upload_locks_guard:
+        return upload_locks.setdefault(part, threading.Lock())
+
+def upload_paths(kind, name):
+    if kind not in UPLOAD_KINDS:
+        return None
+    folder, ext = UPLOAD_KINDS[kind]
+    name = os.path.basename(name).strip()
+    if name.lower().endswith(ext):
+        name = name[:-len(ext)] + ext # the scanners match a lower-case extension
+    if not name.endswith(ext) or name.startswith('.') or name == ext:
+        return None
+    path = os.path.join(folder, name)
+    return name, path, path + '.part'
+
+def part_size(part):
+    try:
+        return os.path.getsize(part)
+    except OSError:
+        return 0
+
+@app.route('/upload/<kind>/<name>', methods=['GET'])
+def upload_status(kind, name):
+    paths = upload_paths(kind, name)
+    if paths is None:
+        return jsonify(error='bad file name or type'), 400
+    name, path, part = paths
+    offset = part_size(part)
+    size = request.args.get('size', type=int)
+    if size is not None:
+        import shutil
+        if size <= 0:
+            return jsonify(error='empty file'), 400
+        with upload_lock(part):
+            offset = part_size(part)
+            if offset > size:
+                os.remove(part); offset = 0 # left over from some other file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if shutil.disk_usage(os.path.dirname(path)).free < size - offset + UPLOAD_FREE_MARGIN:
+            return jsonify(error='not enough space on the SD card'), 507
+    return jsonify(name=name, offset=offset, exists=os.path.exists(path))
+
+@app.route('/upload/<kind>/<name>', methods=['PUT'])
+def upload_chunk(kind, name):
+    paths = upload_paths(kind, name)
+    if paths is None:
+        return jsonify(error='bad file name or type'), 400
+    name, path, part = paths
+    offset = request.args.get('offset', 0, type=int)
+    with upload_lock(part):
+        have = part_size(part)
+        if offset != have:
+            # Client and server disagree (lost reply, second tab): resume from ours
+            return jsonify(error='offset mismatch', offset=have), 409
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        with open(part, 'ab') as f:
+            while True:
+                block = request.stream.read(UPLOAD_BLOCK)
+                if not block:
+                    break
+                f.write(block)
+        return jsonify(offset=part_size(part))
+
+@app.route('/upload/<kind>/<name>/finish', methods=['POST'])
+def upload_finish(kind, name):
+    paths = upload_paths(kind, name)
+    if paths is None:
+        return jsonify(error='bad file name or type'), 400
+    name, path, part = paths
+    want = request.get_json(silent=True)
+    if not isinstance(want, dict):
+        want = {}
+    size_wanted = want.get('size')
+    if size_wanted is not None:
+        try:
+            size_wanted = int(size_wanted)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify(error='bad size'), 400
+    with upload_lock(part):
+        return finish_part(kind, name, path, part, size_wanted, want.get('sha256', ''))
+
+def finish_part(kind, name, path, part, size_wanted, sha256):
+    # Caller holds upload_lock(part)
+    import hashlib
+    if not os.path.exists(part):
+        return jsonify(error='nothing uploaded', offset=0), 409
+    size = part_size(part)
+    if size_wanted is not None and size_wanted != size:
+        return jsonify(error='size mismatch', offset=size), 409
+    digest = hashlib.sha256()
+    with open(part, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+            socketio.sleep(0) # let the socket traffic through on a big file
+    if digest.hexdigest() != str(sha256).lower():
+        os.remove(part) # corrupt: start over rather than resume into it
+        return jsonify(error='checksum mismatch'), 422
+    with open(part, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(part, path)
+    send_command({'op': 'catalog_add', 'kind': kind, 'name': name})
+    return jsonify(name=name, size=size, sha256=digest.hexdigest())
+
+# --- OFFLINE BOUNCE (runs bounce.py as a separate process) ---
+def emit_bounce():
+    try:
+        with open(BOUNCE_FILE, 'r') as f:
+            socketio.emit('bounce_update', json.load(f))
+    except:
+        pass
+
+@socketio.on('boot_report')
+def handle_boot_report():
+    try:
+        with open(BOOT_FILE, 'r') as f:
+            emit('boot_report', json.load(f))
+    except:
+        pass
+
+@socketio.on('file_list')
+def handle_file_list():
+    try:
+        names = sorted(f for f in os.listdir(MIDI_DIR) if f.endswith('.mid'))
+    except:
+        names = []
+    emit('file_list', {'files': names})
+
+@socketio.on('bounce_list')
+def handle_bounce_list():
+    try:
+        names = sorted(f for f in os.listdir(MIDI_DIR) if f.endswith('.mid'))
+    except:
+        names = []
+    emit('bounce_list', {'files': names})
+    emit_bounce()
+
+@socketio.on('bounce_start')
+def handle_bounce_start(data):
+    global BOUNCE_PROC
+    if BOUNCE_PROC is not None and BOUNCE_PROC.poll() is None:
+        emit('bounce_update', {'error': 'A bounce is already running'})
+        return
+    sf2 = (current_state() or {}).get('sf2')
+    if not sf2:
+        emit('bounce_update', {'error': 'LOAD SF2 FIRST'})
+        return
+    # Only bare names from the MIDI folder; never paths from the client
+    names = [os.path.basename(n) for n in (data or {}).get('files', []) if n]
+    fmt = 'flac' if (data or {}).get('format') == 'flac' else 'wav'
+    if not names:
+        return
+    import subprocess
+    BOUNCE_PROC = subprocess.Popen(
+        [sys.executable, os.path.join(APP_DIR, 'bounce.py'), '--sf2', sf2, '--format', fmt,
+         '--midi-dir', MIDI_DIR, '--progress', BOUNCE_FILE] + names,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# --- LIVE LCD MIRROR ---
+# Each subscribed client gets a full frame when it subscribes, then only the
+# 16x16 tiles that changed since what it was last sent (runs of adjacent
+# tiles merged, PNG compressed). A client has at most one update in flight;
+# its ack releases the next one, so slow links simply get fewer frames.
+LCD_W = LCD_H = 240
+TILE = 16
+MIRROR_MIN_INTERVAL = 1 / 15.0 # frame rate cap on a fast link
+MIRROR_ACK_TIMEOUT = 5.0
+mirror_clients = {} # sid -> {"sent", "seq", "waiting", "t_sent", "rtt"}
+lcd_frame = None
+lcd_mtime = 0
+_mirror_cache = (None, None, None) # (old frame, new frame, tiles) shared by clients in step
+
+def read_lcd():
+    global lcd_frame, lcd_mtime
+    try:
+        mtime = os.path.getmtime(LCD_FILE)
+        if mtime != lcd_mtime:
+            with open(LCD_FILE, 'rb') as f:
+                data = f.read()
+            if len(data) == LCD_W * LCD_H * 3:
+                lcd_frame, lcd_mtime = data, mtime
+    except OSError:
+        pass
+
+def diff_tiles(old, new):
+    stride = LCD_W * 3
+    rects = []
+    for ty in range(0, LCD_H, TILE):
+        y1 = min(ty + TILE, LCD_H)
+        # Whole band unchanged: one compare skips 15 tiles
+        if old[ty * stride:y1 * stride] == new[ty * stride:y1 * stride]:
+            continue
+        run = None
+        for tx in range(0, LCD_W, TILE):
+            a, b = tx * 3, min(tx + TILE, LCD_W) * 3
+            changed = any(old[r * stride + a:r * stride + b] != new[r * stride + a:r * stride + b] for r in range(ty, y1))
+            if changed:
+                run = [run[0], tx + TILE] if run else [tx, tx + TILE]
+            elif run:
+                rects.append((run[0], ty, run[1] - run[0], y1 - ty)); run = None
+        if run:
+            rects.append((run[0], ty, min(run[1], LCD_W) - run[0], y1 - ty))
+    return rects
+
+def encode_tiles(frame, rects):
+    import io
+    from PIL import Image
+    stride = LCD_W * 3
+    tiles = []
+    for x, y, w, h in rects:
+        raw = b"".join(frame[(y + r) * stride + x * 3:(y + r) * stride + (x + w) * 3] for r in range(h))
+        buf = io.BytesIO()
+        Image.frombytes("RGB", (w, h), raw).save(buf, "PNG", compress_level=1)
+        tiles.append([x, y, w, h, buf.getvalue()])
+    return tiles
+
+def send_mirror(sid):
+    global _mirror_cache
+    c = mirror_clients.get(sid)
+    if c is None or lcd_frame is None or c["sent"] is lcd_frame:
+        return
+    old = c["sent"]
+    if _mirror_cache[0] is old and _mirror_cache[1] is lcd_frame:
+        tiles = _mirror_cache[2]
+    else:
+        rects = [(0, 0, LCD_W, LCD_H)] if old is None else diff_tiles(old, lcd_frame)
+        tiles = encode_tiles(lcd_frame, rects)
+        _mirror_cache = (old, lcd_frame, tiles)
+    c["sent"] = lcd_frame
+    if not tiles:
+        return
+    c["seq"] += 1
+    c["waiting"] = True
+    c["t_sent"] = time.time()
+    socketio.emit('lcd', {'seq': c["seq"], 'tiles': tiles}, to=sid)
+
+@socketio.on('mirror_on')
+def handle_mirror_on():
+    # (Re)subscribing always starts from a full frame
+    mirror_clients[request.sid] = {"sent": None, "seq": 0, "waiting": False, "t_sent": 0.0, "rtt": 0.0}
+    read_lcd()
+    send_mirror(request.sid)
+
+@socketio.on('mirror_off')
+def handle_mirror_off():
+    mirror_clients.pop(request.sid, None)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    mirror_clients.pop(request.sid, None)
+    client_codecs.pop(request.sid, None)
+
+@socketio.on('mirror_ack')
+def handle_mirror_ack(data):
+    c = mirror_clients.get(request.sid)
+    if c is None or (data or {}).get('seq') != c["seq"]:
+        return
+    c["waiting"] = False
+    c["rtt"] = 0.7 * c["rtt"] + 0.3 * (time.time() - c["t_sent"])
+
+def mirror_loop():
+    while True:
+        if mirror_clients:
+            read_lcd()
+            now = time.time()
+            for sid, c in list(mirror_clients.items()):
+                if c["waiting"] and now - c["t_sent"] > MIRROR_ACK_TIMEOUT:
+                    c["waiting"] = False
+                if not c["waiting"] and now - c["t_sent"] >= max(MIRROR_MIN_INTERVAL, c["rtt"]):
+                    send_mirror(sid)
+        socketio.sleep(0.05)
+
+def broadcast_loop():
+    # The state check is a read of the shared memory sequence number (no
+    # syscall), so it can run often; the bounce file is stat'ed every 0.2 s.
+    last_bounce_mtime = 0
+    last_bounce_check = 0
+    while True:
+        try:
+            if _engine is None:
+                first = journal_state is None # the engine may have published it long ago
+                if publish(state_reader.poll()) and not first:
+                    EMIT_TIME.observe(time.monotonic() - state_reader.published)
+            if time.time() - last_bounce_check >= 0.2:
+                last_bounce_check = time.time()
+                if os.path.exists(BOUNCE_FILE):
+                    mtime = os.path.getmtime(BOUNCE_FILE)
+                    if mtime != last_bounce_mtime:
+                        emit_bounce()
+                        last_bounce_mtime = mtime
+        except:
+            pass
+        socketio.sleep(0.05)
+
+def serve(engine=None):
+    global _engine, note_sock
+    _engine = engine
+    if not os.path.exists(BASE_DIR):
+        os.makedirs(BASE_DIR)
+    
+    build_assets() # render and compress before the first phone asks
+    if engine is None:
+        import socket
+        note_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        note_sock.bind(('127.0.0.1', 0))
+        socketio.start_background_task(note_reply_loop)
+    socketio.start_background_task(broadcast_loop)
+    socketio.start_background_task(mirror_loop)
+    # Added allow_unsafe_werkzeug for better stability on the Pi
+    socketio.run(app, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True,
+                 use_reloader=False, log_output=not EMBEDDED)
+
+if __name__ == '__main__':
+    serve()